@@ -0,0 +1,122 @@
+"""Run the benchmark suite, store its results as a JSON baseline, and
+compare runs to flag statistically significant slowdowns.
+
+Usage:
+    python -m benchmarks run -o baseline.json
+    python -m benchmarks compare baseline.json           # against a new run
+    python -m benchmarks compare baseline.json new.json  # two stored runs
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from benchmarks.stats import welch_t_test
+from benchmarks.suite import BENCHMARKS
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable
+
+    Results = dict[str, Any]
+
+
+def run(names: Iterable[str], samples: int) -> Results:
+    benchmarks: dict[str, Any] = {}
+    # in the order of the suite, so the crypto benchmarks run before an
+    # application (and its KDF pool) is created
+    for name in (name for name in BENCHMARKS if name in names):
+        timings = BENCHMARKS[name](samples)
+        benchmarks[name] = {
+            "samples": timings,
+            "mean": statistics.fmean(timings),
+            "stdev": statistics.stdev(timings),
+        }
+        print(
+            f"{name:<16} {benchmarks[name]['mean'] * 1000:>10.3f} ms "
+            f"± {benchmarks[name]['stdev'] * 1000:.3f}",
+            file=sys.stderr)
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(baseline: Results,
+            current: Results,
+            alpha: float,
+            threshold: float) -> list[str]:
+    """Print how each benchmark changed, return the names of the ones that
+    got significantly slower.
+
+    A change is significant when Welch's t-test p-value is below `alpha`,
+    and the mean changed by more than `threshold` (a ratio).
+    """
+    regressions = []
+    print(f"{'benchmark':<16} {'baseline':>12} {'current':>12} "
+          f"{'change':>8} {'p-value':>8}")
+    for name, result in current["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        before = baseline["benchmarks"][name]
+        _, p_value = welch_t_test(before["samples"], result["samples"])
+        change = result["mean"] / before["mean"] - 1
+        verdict = ""
+        if p_value < alpha and abs(change) > threshold:
+            verdict = "SLOWER" if change > 0 else "faster"
+            if change > 0:
+                regressions.append(name)
+        print(f"{name:<16} {before['mean'] * 1000:>9.3f} ms "
+              f"{result['mean'] * 1000:>9.3f} ms {change:>+8.1%} "
+              f"{p_value:>8.4f} {verdict}")
+    return regressions
+
+
+def _load(path: str) -> Results:
+    with open(path) as f:
+        return dict(json.load(f))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("run", "compare"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("--only",
+                               nargs="+",
+                               choices=sorted(BENCHMARKS),
+                               default=list(BENCHMARKS))
+        subparser.add_argument("--samples", type=int, default=20)
+        subparser.add_argument("-o", "--output", help="write results to")
+    compare_parser = subparsers.choices["compare"]
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current", nargs="?")
+    compare_parser.add_argument("--alpha", type=float, default=0.01)
+    compare_parser.add_argument("--threshold", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.command == "compare" and args.current:
+        results = _load(args.current)
+    else:
+        results = run(args.only, args.samples)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.command == "compare":
+        if compare(_load(args.baseline), results, args.alpha, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark the expired secrets reaper against a large SQLite table.
+
+Seeds an in-memory SQLite database with expired rows, then runs the reaper
+until the table is empty, reporting throughput and peak Python memory.
+
+Usage: python -m benchmarks.reaper --rows 1000000 --chunk-size 5000
+"""
+from __future__ import annotations
+
+import argparse
+import resource
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import insert
+
+from shhh.adapters import orm
+from shhh.constants import EnvConfig
+from shhh.entrypoint import create_app
+from shhh.extensions import db, scheduler
+from shhh.scheduler import tasks
+
+
+def seed_expired_secrets(rows: int,
+                         expired: datetime,
+                         batch_size: int = 50_000) -> None:
+    """Insert `rows` secrets expired since `expired`."""
+    for start in range(0, rows, batch_size):
+        db.session.execute(
+            insert(orm.secret),
+            [{
+                "encrypted_text": b"x" * 120,
+                "date_created": expired,
+                "date_expires": expired,
+                "external_id": f"{i:020d}",
+                "tries": 5
+            } for i in range(start, min(start + batch_size, rows))])
+        db.session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app(EnvConfig.TESTING)
+    scheduler.pause_job(tasks.DELETE_EXPIRED_RECORDS_JOB)
+    with app.app_context():
+        orm.metadata.create_all(db.engine)
+        started = time.perf_counter()
+        seed_expired_secrets(args.rows, datetime.now() - timedelta(days=1))
+        print(f"seeded {args.rows} expired rows in "
+              f"{time.perf_counter() - started:.2f}s")
+
+    tracemalloc.start()
+    runs = deleted = 0
+    started = time.perf_counter()
+    with patch.dict(app.config, {"SHHH_REAPER_CHUNK_SIZE": args.chunk_size}):
+        while deleted < args.rows:
+            stats = tasks.delete_expired_records()
+            if stats is None or not stats.deleted:
+                break
+            runs += 1
+            deleted += stats.deleted
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"deleted {deleted} rows in {elapsed:.2f}s over {runs} run(s) "
+          f"({deleted / elapsed:.0f} rows/s)")
+    print(f"peak python memory during reaping: {peak / 1024:.0f} KiB")
+    print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the API throughput of the WSGI and ASGI serving modes.
+
+Runs the same workload (create a secret, then read it) with concurrent
+clients against running instances of each mode, and reports the throughput
+and latency percentiles side by side. Start both modes on the same database
+with the same number of workers first, for example:
+
+    gunicorn -b :8081 -w 2 wsgi:app
+    uvicorn --port 8082 --workers 2 asgi:app
+
+Usage: python -m benchmarks.serving --wsgi http://localhost:8081 \
+    --asgi http://localhost:8082 --concurrency 32 --requests 2000
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PASSPHRASE = "Benchmark123"
+
+
+def _roundtrip(session: requests.Session, base_url: str) -> float:
+    started = time.perf_counter()
+    created = session.post(f"{base_url}/api/secret",
+                           json={
+                               "secret": "benchmark", "passphrase": PASSPHRASE
+                           },
+                           timeout=30)
+    created.raise_for_status()
+    external_id = created.json()["response"]["external_id"]
+    read = session.get(f"{base_url}/api/secret",
+                       params={
+                           "external_id": external_id,
+                           "passphrase": PASSPHRASE
+                       },
+                       timeout=30)
+    read.raise_for_status()
+    return time.perf_counter() - started
+
+
+def _run(base_url: str, concurrency: int, total: int) -> dict[str, float]:
+    sessions = [requests.Session() for _ in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(
+            executor.map(
+                lambda i: _roundtrip(sessions[i % concurrency], base_url),
+                range(total)))
+    elapsed = time.perf_counter() - started
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "req/s": 2 * total / elapsed,
+        "p50 (ms)": quantiles[49] * 1000,
+        "p99 (ms)": quantiles[98] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--wsgi", default="http://localhost:8081")
+    parser.add_argument("--asgi", default="http://localhost:8082")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {
+        mode: _run(url, args.concurrency, args.requests)
+        for mode, url in (("wsgi", args.wsgi), ("asgi", args.asgi))
+    }
+    print(f"{'':>10} {'wsgi':>10} {'asgi':>10}")
+    for metric in results["wsgi"]:
+        print(f"{metric:>10} {results['wsgi'][metric]:>10.1f} "
+              f"{results['asgi'][metric]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Statistics used to compare benchmark runs, using the standard library
+only so the suite runs anywhere."""
+from __future__ import annotations
+
+import math
+import statistics
+
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # continued fraction of the incomplete beta function (modified Lentz)
+    tiny, eps = 1e-300, 3e-16
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) *
+                                                        (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < eps:
+            break
+    return result
+
+
+def betainc(a: float, b: float, x: float) -> float:
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+        a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def welch_t_test(a: list[float], b: list[float]) -> tuple[float, float]:
+    """Welch's unequal variances t-test, return the t statistic and the two
+    sided p-value."""
+    mean_a, mean_b = statistics.fmean(a), statistics.fmean(b)
+    var_a = statistics.variance(a) / len(a)
+    var_b = statistics.variance(b) / len(b)
+    if var_a + var_b == 0:
+        return 0.0, 1.0 if mean_a == mean_b else 0.0
+
+    t = (mean_a - mean_b) / math.sqrt(var_a + var_b)
+    df = (var_a + var_b)**2 / (var_a**2 / (len(a) - 1) + var_b**2 /
+                               (len(b) - 1))
+    return t, betainc(df / 2, 0.5, df / (df + t * t))
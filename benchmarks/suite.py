@@ -0,0 +1,239 @@
+"""Benchmarks of each layer of the application, from the crypto alone to
+full requests and the reaper.
+
+Each benchmark returns the duration in seconds of each of its samples. The
+database ones run against an in-memory SQLite database, so the suite runs
+offline.
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+from benchmarks.reaper import seed_expired_secrets
+from shhh.adapters import orm
+from shhh.adapters.repository import get_repository
+from shhh.api.handlers import (ClientReadHandler,
+                               ClientWriteHandler,
+                               ReadHandler,
+                               WriteHandler)
+from shhh.constants import EnvConfig
+from shhh.domain import model
+from shhh.extensions import db, scheduler
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+    from flask import Flask
+
+    Benchmark = Callable[[int], list[float]]
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+WARMUP = 1
+MESSAGE = "benchmark message"
+PASSPHRASE = "Benchmark123"
+# key proving the passphrase of the secrets encrypted by the client
+PROOF = secrets.token_bytes(32)
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    """Register a benchmark under the given name."""
+
+    def register(func: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def measure(op: Callable[..., Any],
+            samples: int,
+            setup: Callable[[], tuple] | None = None) -> list[float]:
+    """Time `samples` calls of `op`, after a warmup. `setup` runs before
+    each call, untimed, and returns the arguments of `op`."""
+    timings = []
+    for _ in range(samples + WARMUP):
+        args = setup() if setup is not None else ()
+        started = time.perf_counter()
+        op(*args)
+        timings.append(time.perf_counter() - started)
+    return timings[WARMUP:]
+
+
+@functools.cache
+def _get_app() -> Flask:
+    # imported here, so the crypto benchmarks don't need an application
+    from shhh.entrypoint import create_app
+
+    app = create_app(EnvConfig.TESTING)
+    # only report the results, and let the benchmarks run the reaper
+    logging.getLogger().setLevel(logging.WARNING)
+    scheduler.pause()
+    with app.app_context():
+        orm.metadata.create_all(db.engine)
+    return app
+
+
+def _store_secret() -> tuple[str]:
+    secret = _encrypt()
+    db.session.add(secret)
+    db.session.commit()
+    return (secret.external_id, )
+
+
+def _encrypt() -> model.Secret:
+    return model.Secret.encrypt(message=MESSAGE,
+                                passphrase=PASSPHRASE,
+                                expire_code="1d")
+
+
+@benchmark("crypto.encrypt")
+def bench_encrypt(samples: int) -> list[float]:
+    return measure(_encrypt, samples)
+
+
+@benchmark("crypto.decrypt")
+def bench_decrypt(samples: int) -> list[float]:
+    return measure(_encrypt().decrypt, samples, setup=lambda: (PASSPHRASE, ))
+
+
+@benchmark("repository.add")
+def bench_repository_add(samples: int) -> list[float]:
+    app = _get_app()
+    repository = get_repository(app)
+    with app.app_context():
+        return measure(repository.add, samples, setup=lambda: (_encrypt(), ))
+
+
+@benchmark("repository.get")
+def bench_repository_get(samples: int) -> list[float]:
+    app = _get_app()
+    repository = get_repository(app)
+    with app.app_context():
+        return measure(repository.get, samples, setup=_store_secret)
+
+
+@benchmark("repository.consume")
+def bench_repository_consume(samples: int) -> list[float]:
+    app = _get_app()
+    repository = get_repository(app)
+    with app.app_context():
+        return measure(repository.consume, samples, setup=_store_secret)
+
+
+@benchmark("handler.write")
+def bench_write_handler(samples: int) -> list[float]:
+    app = _get_app()
+    handler = WriteHandler(passphrase=PASSPHRASE,
+                           secret=MESSAGE,
+                           expire="1d",
+                           tries=5)
+    with app.test_request_context():
+        return measure(handler.handle, samples)
+
+
+@benchmark("handler.read")
+def bench_read_handler(samples: int) -> list[float]:
+    app = _get_app()
+
+    def read(external_id: str) -> None:
+        ReadHandler(external_id, PASSPHRASE).handle()
+
+    with app.test_request_context():
+        return measure(read, samples, setup=_store_secret)
+
+
+def _store_client_secret() -> tuple[str]:
+    secret = model.Secret.from_client(ciphertext=MESSAGE.encode(),
+                                      salt=secrets.token_bytes(16),
+                                      iterations=600000,
+                                      verifier=hashlib.sha256(PROOF).digest(),
+                                      expire_code="1d")
+    db.session.add(secret)
+    db.session.commit()
+    return (secret.external_id, )
+
+
+@benchmark("handler.client_write")
+def bench_client_write_handler(samples: int) -> list[float]:
+    app = _get_app()
+    handler = ClientWriteHandler(ciphertext=MESSAGE.encode(),
+                                 salt=secrets.token_bytes(16),
+                                 iterations=600000,
+                                 verifier=hashlib.sha256(PROOF).digest(),
+                                 expire="1d",
+                                 tries=5)
+    with app.test_request_context():
+        return measure(handler.handle, samples)
+
+
+@benchmark("handler.client_read")
+def bench_client_read_handler(samples: int) -> list[float]:
+    app = _get_app()
+
+    def read(external_id: str) -> None:
+        ClientReadHandler(external_id, PROOF).handle()
+
+    with app.test_request_context():
+        return measure(read, samples, setup=_store_client_secret)
+
+
+@benchmark("http.create")
+def bench_http_create(samples: int) -> list[float]:
+    app = _get_app()
+    payload = {"secret": MESSAGE, "passphrase": PASSPHRASE}
+    with app.test_client() as client:
+        return measure(lambda: client.post("/api/secret", json=payload),
+                       samples)
+
+
+@benchmark("http.read")
+def bench_http_read(samples: int) -> list[float]:
+    app = _get_app()
+
+    def setup() -> tuple[str]:
+        with app.app_context():
+            return _store_secret()
+
+    with app.test_client() as client:
+
+        def read(external_id: str) -> None:
+            client.get("/api/secret",
+                       query_string={
+                           "external_id": external_id,
+                           "passphrase": PASSPHRASE
+                       })
+
+        return measure(read, samples, setup=setup)
+
+
+@benchmark("reaper.100k")
+def bench_reaper(samples: int) -> list[float]:
+    # imported here, as the tasks need the scheduler to be initialised
+    from shhh.scheduler import tasks
+
+    app = _get_app()
+    rows = 100_000
+
+    def setup() -> tuple:
+        with app.app_context():
+            seed_expired_secrets(rows,
+                                 expired=datetime.now() - timedelta(days=1))
+        return ()
+
+    def reap() -> None:
+        deleted = 0
+        while deleted < rows:
+            stats = tasks.delete_expired_records()
+            if stats is None or not stats.deleted:
+                raise RuntimeError("The reaper did not run")
+            deleted += stats.deleted
+
+    # a few samples are enough, as each one reaps the whole table
+    return measure(reap, max(samples // 5, 3), setup=setup)
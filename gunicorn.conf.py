@@ -0,0 +1,30 @@
+"""Gunicorn settings, loaded from the working directory."""
+import glob
+import os
+
+from prometheus_client import multiprocess
+
+# Metrics are aggregated across the workers from the files they write in
+# PROMETHEUS_MULTIPROC_DIR. Clear the files of a previous run, before the
+# application is loaded (with --preload).
+if metrics_dir := os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
+def post_worker_init(worker):
+    # initialise the database pool, cryptography and templates before the
+    # worker accepts requests, rather than on its first ones
+    from flask import Flask
+
+    from shhh.startup import warm_up
+
+    if isinstance(worker.wsgi, Flask):
+        warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # drop the gauges of the dead worker
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,194 @@
+"""Stores of the encrypted content of the large secrets.
+
+The secret keeps the metadata of its content (see `Secret.encrypt_stream`),
+stored in a blob named after its external identifier. Blobs are written and
+read in chunks, so the memory used doesn't depend on their size. A blob is
+deleted as soon as it is opened for reading (its secret having been deleted
+first), and the blobs of the expired secrets are deleted by a scheduled job,
+whatever the storage of the secrets.
+
+Blobs are kept in a store selected with SHHH_BLOB_STORE:
+
+* `file` (default) in the SHHH_BLOB_PATH directory (defaults to the
+  `blobs` directory of the instance folder), which must be shared by the
+  nodes if there are several of them.
+* `memory` is local to the process, for tests and single process
+  deployments.
+"""
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, cast
+
+from flask import current_app
+
+if TYPE_CHECKING:
+    from datetime import datetime
+    from typing import BinaryIO, Iterable
+
+    from flask import Flask
+
+EXTENSION_NAME = "shhh.blobs"
+
+_BLOB_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class BlobNotFound(LookupError):
+    """Raised when opening a blob which doesn't exist."""
+
+
+class BlobStore(ABC):
+
+    @abstractmethod
+    def write(self, blob_id: str, chunks: Iterable[bytes],
+              expires: datetime) -> int:
+        """Store the blob from its chunks, return its size. The blob only
+        exists once all its chunks are written."""
+
+    @abstractmethod
+    def pop(self, blob_id: str) -> BinaryIO:
+        """Open the blob for reading and delete it. Raise `BlobNotFound` if
+        it doesn't exist."""
+
+    @abstractmethod
+    def delete(self, blob_id: str) -> None:
+        """Delete the blob, if it exists."""
+
+    @abstractmethod
+    def delete_expired(self) -> int:
+        """Delete the expired blobs, return their number."""
+
+
+class FileBlobStore(BlobStore):
+    """Blobs stored as files, under a directory per first two characters of
+    their identifier. Files are written under a temporary name, then
+    renamed, and their modification time is set to their expiry date."""
+
+    # temporary files of the uploads interrupted before they could be
+    # cleaned up are deleted after this number of seconds
+    stale_upload_age = 3600
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _path(self, blob_id: str) -> str:
+        if not _BLOB_ID.match(blob_id):
+            raise ValueError(f"Invalid blob identifier {blob_id!r}")
+        return os.path.join(self.path, blob_id[:2], blob_id)
+
+    def write(self, blob_id: str, chunks: Iterable[bytes],
+              expires: datetime) -> int:
+        path = self._path(blob_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+        try:
+            size = 0
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    size += len(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+            os.utime(temp_path, (time.time(), expires.timestamp()))
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_path)
+            raise
+        return size
+
+    def pop(self, blob_id: str) -> BinaryIO:
+        path = self._path(blob_id)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(blob_id) from None
+        # the content stays readable until the file is closed
+        os.unlink(path)
+        return file
+
+    def delete(self, blob_id: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path(blob_id))
+
+    def delete_expired(self) -> int:
+        now = time.time()
+        deleted = 0
+        if not os.path.isdir(self.path):
+            return deleted
+        with os.scandir(self.path) as directories:
+            for directory in directories:
+                if not directory.is_dir():
+                    continue
+                with os.scandir(directory.path) as entries:
+                    for entry in entries:
+                        with contextlib.suppress(FileNotFoundError):
+                            modified = entry.stat().st_mtime
+                            if entry.name.startswith("."):
+                                modified += self.stale_upload_age
+                            if modified <= now:
+                                os.unlink(entry.path)
+                                deleted += 1
+        return deleted
+
+
+class MemoryBlobStore(BlobStore):
+    """Blobs local to the process."""
+
+    def __init__(self) -> None:
+        self._blobs: dict[str, tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def write(self, blob_id: str, chunks: Iterable[bytes],
+              expires: datetime) -> int:
+        data = b"".join(chunks)
+        with self._lock:
+            self._blobs[blob_id] = (data, expires.timestamp())
+        return len(data)
+
+    def pop(self, blob_id: str) -> BinaryIO:
+        with self._lock:
+            if (blob := self._blobs.pop(blob_id, None)) is None:
+                raise BlobNotFound(blob_id)
+        return io.BytesIO(blob[0])
+
+    def delete(self, blob_id: str) -> None:
+        with self._lock:
+            self._blobs.pop(blob_id, None)
+
+    def delete_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [
+                blob_id for blob_id, (_, expires) in self._blobs.items()
+                if expires <= now
+            ]
+            for blob_id in expired:
+                del self._blobs[blob_id]
+        return len(expired)
+
+
+def create_store(app: Flask) -> BlobStore:
+    store = app.config["SHHH_BLOB_STORE"]
+    if store == "file":
+        return FileBlobStore(app.config["SHHH_BLOB_PATH"]
+                             or os.path.join(app.instance_path, "blobs"))
+    if store == "memory":
+        return MemoryBlobStore()
+    raise RuntimeError(f"Blob {store=} is not supported")
+
+
+def init_app(app: Flask) -> None:
+    app.extensions[EXTENSION_NAME] = create_store(app)
+
+
+def get_blob_store(app: Flask | None = None) -> BlobStore:
+    """Blob store of the given application, or of the current one."""
+    return cast(BlobStore, (app or current_app).extensions[EXTENSION_NAME])
@@ -0,0 +1,100 @@
+"""SQLAlchemy engine options, built from the `SHHH_DB_*` settings."""
+from __future__ import annotations
+
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from sqlalchemy import exc, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from shhh import metrics
+
+if TYPE_CHECKING:
+    from typing import Any, Mapping
+
+    from flask import Flask
+    from sqlalchemy.pool import ConnectionPoolEntry
+
+logger = logging.getLogger(__name__)
+
+# Name of the connect argument setting the connection timeout, for each
+# supported driver.
+CONNECT_TIMEOUT_ARGS = {
+    "psycopg2": "connect_timeout",
+    "psycopg": "connect_timeout",
+    "asyncpg": "timeout",
+    "pymysql": "connect_timeout",
+    "mysqldb": "connect_timeout",
+    "aiomysql": "connect_timeout",
+}
+
+
+class TimedQueuePool(QueuePool):
+    """Queue pool reporting the time waited to check out a connection, and
+    its number of checked out connections."""
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            logger.warning("Timed out waiting for a database connection: %s",
+                           self.status())
+            raise
+        finally:
+            metrics.record_db_pool_checkout(time.perf_counter() - started,
+                                            self.size(),
+                                            self.checkedout())
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        super()._do_return_conn(record)
+        metrics.record_db_pool_checkin(self.checkedout())
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """Timed queue pool, for the async engines."""
+
+
+def build_engine_options(uri: str,
+                         config: Mapping[str, Any],
+                         is_async: bool = False) -> dict[str, Any]:
+    """Build the engine options of a database URI from the settings.
+
+    SQLite databases keep the default options, as they are only used for
+    development and tests.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite":
+        return {}
+
+    options: dict[str, Any] = {}
+    if config["SHHH_DB_POOL"] == "null":
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+            pool_size=config["SHHH_DB_POOL_SIZE"],
+            max_overflow=config["SHHH_DB_MAX_OVERFLOW"],
+            pool_timeout=config["SHHH_DB_POOL_TIMEOUT"],
+            pool_recycle=config["SHHH_DB_POOL_RECYCLE"],
+            pool_pre_ping=config["SHHH_DB_POOL_PRE_PING"])
+
+    if config["SHHH_DB_ISOLATION_LEVEL"]:
+        options["isolation_level"] = config["SHHH_DB_ISOLATION_LEVEL"]
+
+    driver = url.get_driver_name()
+    if argument := CONNECT_TIMEOUT_ARGS.get(driver):
+        options["connect_args"] = {argument: config["SHHH_DB_CONNECT_TIMEOUT"]}
+    return options
+
+
+def init_app(app: Flask) -> None:
+    """Set the engine options of Flask-SQLAlchemy, must be called before it
+    is initialised. Options already set in `SQLALCHEMY_ENGINE_OPTIONS` take
+    precedence."""
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **build_engine_options(app.config["SQLALCHEMY_DATABASE_URI"],
+                               app.config),
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    }
@@ -0,0 +1,83 @@
+"""Worker level cache of the identifiers of the secrets known to be gone.
+
+Once a secret has been read, deleted after too many tries, or reaped, its
+link keeps being hit (people refreshing the page, link unfurlers,
+scanners...). External identifiers are random and never reused, so these
+reads are answered from this cache, without checking the database health
+or querying it.
+
+The cache is exact (no false positives, which would hide live secrets), and
+bounded to SHHH_GONE_CACHE_SIZE identifiers, evicting the least recently
+used ones.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from shhh import metrics
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+    from flask import Flask
+
+
+class GoneCache:
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self._ids: OrderedDict[str, None] = OrderedDict()
+        self._ids_size = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.max_size = app.config["SHHH_GONE_CACHE_SIZE"]
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def memory_size(self) -> int:
+        """Approximate memory used by the cache, in bytes."""
+        return sys.getsizeof(self._ids) + self._ids_size
+
+    def contains(self, external_id: str) -> bool:
+        """Return whether the secret is known to be gone."""
+        if self.max_size <= 0:
+            return False
+        with self._lock:
+            hit = external_id in self._ids
+            if hit:
+                self._ids.move_to_end(external_id)
+        metrics.record_gone_cache_lookup(hit)
+        return hit
+
+    def add(self, external_id: str) -> None:
+        self.update((external_id, ))
+
+    def update(self, external_ids: Iterable[str]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for external_id in external_ids:
+                if external_id in self._ids:
+                    self._ids.move_to_end(external_id)
+                    continue
+                self._ids[external_id] = None
+                self._ids_size += sys.getsizeof(external_id)
+                if len(self._ids) > self.max_size:
+                    evicted, _ = self._ids.popitem(last=False)
+                    self._ids_size -= sys.getsizeof(evicted)
+            metrics.record_gone_cache_size(len(self._ids), self.memory_size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+            self._ids_size = 0
+
+
+gone_cache = GoneCache()
@@ -1,9 +1,57 @@
+from __future__ import annotations
+
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import TYPE_CHECKING
+
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import registry
+from sqlalchemy.types import LargeBinary, TypeDecorator
 
 from shhh.constants import DEFAULT_READ_TRIES_VALUE
 from shhh.domain import model
 from shhh.extensions import db
 
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Dialect
+    from sqlalchemy.types import TypeEngine
+
+_EXTERNAL_ID_RE = re.compile(r"[A-Za-z0-9_-]{%d}" %
+                             (model.EXTERNAL_ID_SIZE * 4 // 3))
+
+
+class ExternalId(TypeDecorator[str]):
+    """External identifier of a secret, stored as its random bytes rather
+    than their URL-safe base64 encoding, for a smaller index.
+
+    Identifiers which are not the encoding of these bytes are bound as an
+    empty value, which never matches a secret."""
+
+    impl = LargeBinary(model.EXTERNAL_ID_SIZE)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect: Dialect) -> TypeEngine[bytes]:
+        if dialect.name == "mysql":
+            # fixed width, and indexable without a prefix length
+            return dialect.type_descriptor(mysql.BINARY(
+                model.EXTERNAL_ID_SIZE))
+        return dialect.type_descriptor(self.impl)
+
+    def process_bind_param(self, value: str | None,
+                           dialect: Dialect) -> bytes | None:
+        if value is None:
+            return None
+        if not _EXTERNAL_ID_RE.fullmatch(value):
+            return b""
+        return urlsafe_b64decode(value)
+
+    def process_result_value(self, value: bytes | None,
+                             dialect: Dialect) -> str | None:
+        if value is None:
+            return None
+        return urlsafe_b64encode(value).decode()
+
+
 metadata = db.MetaData()
 
 secret = db.Table(
@@ -13,12 +61,22 @@ secret = db.Table(
     db.Column("encrypted_text", db.LargeBinary),
     db.Column("date_created", db.DateTime),
     db.Column("date_expires", db.DateTime),
-    db.Column("external_id", db.String(20), nullable=False),
+    db.Column("external_id", ExternalId(), nullable=False),
     db.Column("tries", db.Integer, default=DEFAULT_READ_TRIES_VALUE),
-    db.Index("external_id_idx", "external_id"),
+    db.Index("external_id_idx", "external_id", unique=True),
     db.Index("date_expires_idx", "date_expires"),
 )
 
+# Leases used to elect a single leader across workers and nodes for the
+# scheduled jobs.
+scheduler_lease = db.Table(
+    "scheduler_lease",
+    metadata,
+    db.Column("name", db.String(64), primary_key=True),
+    db.Column("owner", db.String(128), nullable=False),
+    db.Column("expires_at", db.DateTime, nullable=False),
+)
+
 
 def start_mappers() -> None:
     mapper_reg = registry()
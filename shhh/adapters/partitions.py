@@ -0,0 +1,216 @@
+"""Range partitioning of the `secret` table by expiry date, on PostgreSQL.
+
+With SHHH_PARTITION_INTERVAL set to `hour` or `day`, the secrets are stored
+in a partition per hour or per day of their expiry date. A scheduled job
+creates the partitions ahead of time, for the longest expiration preset, and
+expires the secrets by dropping whole partitions once all of their secrets
+have expired, rather than deleting rows (which leaves dead tuples to vacuum
+and churns the indexes).
+
+The table is converted by the `flask partition-table` command.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+from sqlalchemy import text
+
+from shhh.constants import EXPIRATION_TIME_VALUES
+from shhh.domain import model
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+    from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "secret"
+PARTITION_PREFIX = f"{TABLE_NAME}_p"
+
+INTERVALS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+_NAME_FORMATS = {"hour": "%Y%m%d%H", "day": "%Y%m%d"}
+
+_EPOCH = datetime(2000, 1, 1)
+# secrets can't expire later than the longest preset after their creation
+MAX_EXPIRATION = max(
+    model.Secret._set_expiry_date(_EPOCH, code) - _EPOCH
+    for code in EXPIRATION_TIME_VALUES.values())
+
+# dropping a partition locks the parent table, give up rather than queue
+# behind (and block) the running requests
+LOCK_TIMEOUT = "2s"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_start(when: datetime, interval: str) -> datetime:
+    """Start of the partition of an expiry date."""
+    if interval == "day":
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def partition_name(start: datetime, interval: str) -> str:
+    return f"{PARTITION_PREFIX}{start.strftime(_NAME_FORMATS[interval])}"
+
+
+def partition_bounds(name: str) -> tuple[datetime, datetime] | None:
+    """Bounds of a partition, from its name, None if it is not ours."""
+    suffix = name.removeprefix(PARTITION_PREFIX)
+    for interval, name_format in _NAME_FORMATS.items():
+        try:
+            start = datetime.strptime(suffix, name_format)
+        except ValueError:
+            continue
+        if partition_name(start, interval) == name:
+            return start, start + INTERVALS[interval]
+    return None
+
+
+def missing_partitions(existing: Iterable[str], interval: str,
+                       now: datetime) -> list[tuple[str, datetime, datetime]]:
+    """Partitions to create, up to the longest expiration from now.
+
+    Partitions can't overlap, so after the interval has been changed the
+    ranges already covered are skipped, and the gaps left in a daily range
+    are filled with hourly partitions.
+    """
+    covered = [
+        bounds for name in existing if (bounds := partition_bounds(name))
+    ]
+
+    def is_free(start: datetime, end: datetime) -> bool:
+        return all(end <= lower or start >= upper for lower, upper in covered)
+
+    missing = []
+    start = bucket_start(now, interval)
+    while start <= now + MAX_EXPIRATION:
+        end = start + INTERVALS[interval]
+        if is_free(start, end):
+            missing.append((partition_name(start, interval), start, end))
+        elif interval != "hour":
+            # secrets don't expire in the past hours
+            hour = max(start, bucket_start(now, "hour"))
+            while hour < end:
+                if is_free(hour, hour + INTERVALS["hour"]):
+                    missing.append((partition_name(hour, "hour"),
+                                    hour,
+                                    hour + INTERVALS["hour"]))
+                hour += INTERVALS["hour"]
+        start = end
+    return missing
+
+
+def expired_partitions(existing: Iterable[str], now: datetime) -> list[str]:
+    """Partitions whose secrets have all expired."""
+    return [
+        name for name in sorted(existing)
+        if (bounds := partition_bounds(name)) and bounds[1] <= now
+    ]
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return bool(
+        connection.scalar(
+            text("SELECT count(*) FROM pg_partitioned_table pt "
+                 "JOIN pg_class c ON c.oid = pt.partrelid "
+                 "WHERE c.relname = :table"), {"table": TABLE_NAME}))
+
+
+def list_partitions(connection: Connection) -> list[str]:
+    return list(
+        connection.scalars(
+            text("SELECT c.relname FROM pg_inherits i "
+                 "JOIN pg_class c ON c.oid = i.inhrelid "
+                 "JOIN pg_class p ON p.oid = i.inhparent "
+                 "WHERE p.relname = :table"), {"table": TABLE_NAME}))
+
+
+def create_partitions(connection: Connection,
+                      interval: str,
+                      now: datetime | None = None) -> int:
+    """Create the missing partitions, return how many were."""
+    to_create = missing_partitions(list_partitions(connection),
+                                   interval,
+                                   now or _utcnow())
+    for name, start, end in to_create:
+        connection.execute(
+            text(f"CREATE TABLE IF NOT EXISTS {name} "
+                 f"PARTITION OF {TABLE_NAME} "
+                 f"FOR VALUES FROM ('{start.isoformat()}') "
+                 f"TO ('{end.isoformat()}')"))
+    return len(to_create)
+
+
+def drop_expired_partitions(connection: Connection,
+                            now: datetime | None = None) -> int:
+    """Drop the partitions whose secrets have all expired, return how many
+    were."""
+    to_drop = expired_partitions(list_partitions(connection), now or _utcnow())
+    if to_drop:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+    for name in to_drop:
+        connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    return len(to_drop)
+
+
+# The statements converting the table only use constant identifiers. The new
+# table copies the columns of the previous one, whatever the version of the
+# schema.
+_FREE_NAMES = ("ALTER TABLE secret RENAME TO secret_previous",
+               "ALTER INDEX secret_pkey RENAME TO secret_previous_pkey",
+               "DROP INDEX IF EXISTS external_id_idx",
+               "DROP INDEX IF EXISTS date_expires_idx",
+               "ALTER SEQUENCE secret_id_seq OWNED BY NONE",
+               )
+_CREATE_PARTITIONED = (
+    "CREATE TABLE secret (LIKE secret_previous INCLUDING DEFAULTS) "
+    "PARTITION BY RANGE (date_expires)",
+    # the partition key must be part of the primary key and unique indexes,
+    # so the external ids are only unique per expiry date (with 15 random
+    # bytes, collisions are not expected either way)
+    "ALTER TABLE secret ALTER COLUMN date_expires SET NOT NULL",
+    "ALTER TABLE secret ADD CONSTRAINT secret_pkey "
+    "PRIMARY KEY (id, date_expires)",
+    "CREATE UNIQUE INDEX external_id_idx "
+    "ON secret (external_id, date_expires)",
+)
+_CREATE_UNPARTITIONED = (
+    "CREATE TABLE secret (LIKE secret_previous INCLUDING DEFAULTS)",
+    "ALTER TABLE secret ALTER COLUMN date_expires DROP NOT NULL",
+    "ALTER TABLE secret ADD CONSTRAINT secret_pkey PRIMARY KEY (id)",
+    "CREATE UNIQUE INDEX external_id_idx ON secret (external_id)",
+    "CREATE INDEX date_expires_idx ON secret (date_expires)",
+)
+_COPY_SECRETS = ("INSERT INTO secret SELECT * FROM secret_previous "
+                 "WHERE date_expires > (now() AT TIME ZONE 'utc')",
+                 "ALTER SEQUENCE secret_id_seq OWNED BY secret.id",
+                 "DROP TABLE secret_previous",
+                 )
+
+
+def _execute(connection: Connection, statements: Iterable[str]) -> None:
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def partition_table(connection: Connection, interval: str) -> None:
+    """Replace the secret table by a table partitioned per `interval` of
+    expiry date, with the secrets not expired yet.
+
+    The table is locked until the transaction is committed.
+    """
+    _execute(connection, _FREE_NAMES + _CREATE_PARTITIONED)
+    create_partitions(connection, interval)
+    _execute(connection, _COPY_SECRETS)
+
+
+def unpartition_table(connection: Connection) -> None:
+    """Replace the partitioned secret table by a regular table, with the
+    secrets not expired yet."""
+    _execute(connection, _FREE_NAMES + _CREATE_UNPARTITIONED + _COPY_SECRETS)
@@ -0,0 +1,579 @@
+"""Storage of the secrets.
+
+Handlers and the reaper go through a `SecretRepository`, selected with
+SHHH_STORAGE:
+
+* `sql` (default) stores the secrets in the relational database, expired
+  secrets being deleted by the scheduled reaper, or on PostgreSQL with
+  SHHH_PARTITION_INTERVAL set, in partitions of their expiry date dropped
+  by a scheduled job once expired.
+* `memory` and `redis` store them in a key-value store, with a time to live
+  per key, so expired secrets vanish on their own and the reaper is not
+  needed. `memory` is local to the process, so only suited for tests and
+  single process deployments.
+"""
+from __future__ import annotations
+
+import functools
+import heapq
+import threading
+import time
+from abc import ABC, abstractmethod
+from base64 import b64decode, b64encode
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, cast
+
+from flask import current_app
+from sqlalchemy import (CursorResult,
+                        bindparam,
+                        delete,
+                        func,
+                        insert,
+                        inspect,
+                        make_url,
+                        select,
+                        update)
+
+from shhh.adapters import orm, partitions
+from shhh.adapters.gone_cache import gone_cache
+from shhh.domain import model
+from shhh.extensions import db
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable
+
+    from flask import Flask
+    from sqlalchemy import Executable, Row
+    from sqlalchemy.engine import Dialect
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+EXTENSION_NAME = "shhh.secrets"
+
+
+class SecretRepository(ABC):
+    """Storage of the secrets, each method commits its own changes."""
+
+    # whether the secrets are stored in the relational database, which then
+    # needs to be checked before handling the requests
+    uses_database = False
+    # whether expired secrets need to be deleted by the reaper
+    needs_reaper = False
+
+    @abstractmethod
+    def add(self, secret: model.Secret) -> None:
+        pass  # pragma: no cover
+
+    def add_all(self, secrets: Iterable[model.Secret]) -> None:
+        for secret in secrets:
+            self.add(secret)
+
+    @abstractmethod
+    def get(self, external_id: str) -> model.Secret | None:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def consume(self, external_id: str) -> bool:
+        """Delete the secret, return whether this call deleted it.
+
+        Only one of several concurrent reads can delete it, so only one of
+        them is allowed to reveal the secret.
+        """
+
+    @abstractmethod
+    def decrement_tries(self, external_id: str) -> int | None:
+        """Atomically decrement the number of tries left on the secret, and
+        delete it when none are left.
+
+        Return the number of tries remaining, or None if the secret is gone.
+        """
+
+    @abstractmethod
+    def purge_expired(self, limit: int) -> int:
+        """Delete up to `limit` expired secrets, return how many were."""
+
+    @abstractmethod
+    def count_expired(self) -> int:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def count_active(self) -> int:
+        pass  # pragma: no cover
+
+
+# Statements of the requests and of the reaper are built once, rather than
+# on each call, and executed with the `lookup_id` and `now` parameters. Their
+# compiled form is cached by SQLAlchemy, and secrets are read as rows rather
+# than through the ORM identity map and unit of work.
+_SECRET_COLUMNS = tuple(column for column in orm.secret.columns
+                        if not column.primary_key)
+_LOOKUP_ID = orm.secret.c.external_id == bindparam("lookup_id")
+_EXPIRED = orm.secret.c.date_expires <= bindparam("now")
+
+_INSERT_SECRET = insert(orm.secret)
+_SELECT_SECRET = select(*_SECRET_COLUMNS).where(_LOOKUP_ID)
+_SELECT_LIVE_SECRET = _SELECT_SECRET.where(~_EXPIRED)
+_DELETE_SECRET = delete(orm.secret).where(_LOOKUP_ID)
+_DECREMENT_TRIES = update(orm.secret).where(
+    _LOOKUP_ID, orm.secret.c.tries > 0).values(tries=orm.secret.c.tries - 1)
+_DECREMENT_TRIES_RETURNING = _DECREMENT_TRIES.returning(orm.secret.c.tries)
+_SELECT_TRIES = select(orm.secret.c.tries).where(_LOOKUP_ID)
+_COUNT_EXPIRED = select(func.count()).select_from(orm.secret).where(_EXPIRED)
+_COUNT_ACTIVE = select(func.count()).select_from(orm.secret).where(~_EXPIRED)
+
+
+def _lookup(external_id: str) -> dict[str, Any]:
+    return {"lookup_id": external_id}
+
+
+def _now() -> dict[str, Any]:
+    return {"now": datetime.now(timezone.utc)}
+
+
+def _secret_to_row(secret: model.Secret) -> dict[str, Any]:
+    return {
+        column.name: getattr(secret, column.name)
+        for column in _SECRET_COLUMNS
+    }
+
+
+def _secret_from_row(row: Row | None) -> model.Secret | None:
+    if row is None:
+        return None
+    return model.Secret(**row._mapping)
+
+
+@functools.lru_cache(maxsize=16)
+def _purge_expired_stmt(dialect: Dialect, limit: int) -> Executable:
+    if dialect.name == "mysql":
+        # MySQL doesn't support LIMIT in subqueries, but supports it directly
+        # on DELETE statements
+        stmt = delete(
+            orm.secret).where(_EXPIRED).with_dialect_options(mysql_limit=limit)
+    else:
+        ids = select(orm.secret.c.id).where(_EXPIRED).order_by(
+            orm.secret.c.date_expires).limit(limit)
+        if dialect.name == "postgresql":
+            # do not wait on rows locked by a concurrent read
+            ids = ids.with_for_update(skip_locked=True)
+        stmt = delete(orm.secret).where(
+            orm.secret.c.id.in_(ids.scalar_subquery()))
+
+    if dialect.delete_returning:
+        # remember the deleted secrets, so reads of their links don't query
+        # the database (not on MySQL, which doesn't support RETURNING)
+        return stmt.returning(orm.secret.c.external_id)
+    return stmt
+
+
+class SqlSecretRepository(SecretRepository):
+    """Secrets stored in the relational database."""
+
+    uses_database = True
+    needs_reaper = True
+
+    @staticmethod
+    def _commit() -> None:
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def add(self, secret: model.Secret) -> None:
+        db.session.execute(_INSERT_SECRET, _secret_to_row(secret))
+        self._commit()
+
+    def add_all(self, secrets: Iterable[model.Secret]) -> None:
+        # a single batched insert, rather than an insert per secret
+        if rows := [_secret_to_row(secret) for secret in secrets]:
+            db.session.execute(_INSERT_SECRET, rows)
+            self._commit()
+
+    def get(self, external_id: str) -> model.Secret | None:
+        # expired secrets waiting for the reaper can't be read
+        return _secret_from_row(
+            db.session.execute(_SELECT_LIVE_SECRET, {
+                **_lookup(external_id), **_now()
+            }).one_or_none())
+
+    def consume(self, external_id: str) -> bool:
+        result = cast(CursorResult,
+                      db.session.execute(_DELETE_SECRET, _lookup(external_id)))
+        self._commit()
+        return bool(result.rowcount == 1)
+
+    def decrement_tries(self, external_id: str) -> int | None:
+        # the row stays locked until the end of the transaction
+        remaining = self._decrement_tries(external_id)
+        if remaining == 0:
+            db.session.execute(_DELETE_SECRET, _lookup(external_id))
+        self._commit()
+        return remaining
+
+    @staticmethod
+    def _decrement_tries(external_id: str) -> int | None:
+        if db.engine.dialect.update_returning:
+            return db.session.execute(
+                _DECREMENT_TRIES_RETURNING,
+                _lookup(external_id)).scalar_one_or_none()
+
+        # MySQL doesn't support RETURNING, read our own write in the
+        # transaction
+        result = cast(
+            CursorResult,
+            db.session.execute(_DECREMENT_TRIES, _lookup(external_id)))
+        if result.rowcount != 1:
+            return None
+        return cast(
+            int,
+            db.session.execute(_SELECT_TRIES,
+                               _lookup(external_id)).scalar_one())
+
+    def purge_expired(self, limit: int) -> int:
+        # bulk deletes driven by the expiry date index
+        stmt = _purge_expired_stmt(db.engine.dialect, limit)
+        if not db.engine.dialect.delete_returning:
+            result = cast(CursorResult, db.session.execute(stmt, _now()))
+            self._commit()
+            return int(result.rowcount)
+
+        external_ids = db.session.scalars(stmt, _now()).all()
+        self._commit()
+        gone_cache.update(external_ids)
+        return len(external_ids)
+
+    def count_expired(self) -> int:
+        return db.session.execute(_COUNT_EXPIRED, _now()).scalar_one()
+
+    def count_active(self) -> int:
+        return db.session.execute(_COUNT_ACTIVE, _now()).scalar_one()
+
+
+class AsyncSecretRepository(ABC):
+    """Storage of the secrets read and written by the async handlers, with
+    the same semantics as `SecretRepository`."""
+
+    @abstractmethod
+    async def add(self, secret: model.Secret) -> None:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def get(self, external_id: str) -> model.Secret | None:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def consume(self, external_id: str) -> bool:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def decrement_tries(self, external_id: str) -> int | None:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    async def ping(self, check_table: bool) -> bool:
+        """Query the database, return whether the secret table exists (if
+        `check_table`)."""
+
+
+class AsyncSqlSecretRepository(AsyncSecretRepository):
+    """Secrets stored in the relational database, through an async session,
+    with the statements of `SqlSecretRepository`."""
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def _commit(self) -> None:
+        try:
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            raise
+
+    async def add(self, secret: model.Secret) -> None:
+        await self.session.execute(_INSERT_SECRET, _secret_to_row(secret))
+        await self._commit()
+
+    async def ping(self, check_table: bool) -> bool:
+        await self.session.execute(select(1))
+        if not check_table:
+            return True
+        return bool(await self.session.run_sync(lambda session: inspect(
+            session.connection()).has_table(orm.secret.name)))
+
+    async def get(self, external_id: str) -> model.Secret | None:
+        # expired secrets waiting for the reaper can't be read
+        result = await self.session.execute(_SELECT_LIVE_SECRET, {
+            **_lookup(external_id), **_now()
+        })
+        return _secret_from_row(result.one_or_none())
+
+    async def consume(self, external_id: str) -> bool:
+        result = cast(
+            CursorResult,
+            await self.session.execute(_DELETE_SECRET, _lookup(external_id)))
+        await self._commit()
+        return bool(result.rowcount == 1)
+
+    async def decrement_tries(self, external_id: str) -> int | None:
+        # the row stays locked until the end of the transaction
+        remaining = await self._decrement_tries(external_id)
+        if remaining == 0:
+            await self.session.execute(_DELETE_SECRET, _lookup(external_id))
+        await self._commit()
+        return remaining
+
+    async def _decrement_tries(self, external_id: str) -> int | None:
+        lookup = _lookup(external_id)
+        if self.session.get_bind().dialect.update_returning:
+            tries = await self.session.scalars(_DECREMENT_TRIES_RETURNING,
+                                               lookup)
+            return cast(int | None, tries.one_or_none())
+
+        # MySQL doesn't support RETURNING, read our own write in the
+        # transaction
+        result = cast(CursorResult,
+                      await self.session.execute(_DECREMENT_TRIES, lookup))
+        if result.rowcount != 1:
+            return None
+        return cast(int, (await self.session.scalars(_SELECT_TRIES,
+                                                     lookup)).one())
+
+
+class PartitionedSqlSecretRepository(SqlSecretRepository):
+    """Secrets stored in the relational database, in a table partitioned per
+    `interval` of their expiry date (PostgreSQL only).
+
+    Expired secrets are dropped with their partition by `maintain`, rather
+    than by the reaper, and can't be read until then.
+    """
+
+    needs_reaper = False
+
+    def __init__(self, interval: str) -> None:
+        self.interval = interval
+
+    def maintain(self) -> tuple[int, int]:
+        """Create the upcoming partitions and drop the expired ones, return
+        how many were created and dropped."""
+        connection = db.session.connection()
+        try:
+            if not partitions.is_partitioned(connection):
+                raise RuntimeError("The secret table is not partitioned, run "
+                                   "`flask partition-table`")
+            created = partitions.create_partitions(connection, self.interval)
+            dropped = partitions.drop_expired_partitions(connection)
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.commit()
+        return created, dropped
+
+
+class KeyValueStore(ABC):
+    """Key-value store of string fields, with a time to live per key."""
+
+    @abstractmethod
+    def set(self, key: str, fields: dict[str, str], ttl: float) -> None:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def get(self, key: str) -> dict[str, str] | None:
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Delete the key, return whether this call deleted it."""
+
+    @abstractmethod
+    def decrement(self, key: str, field: str) -> int | None:
+        """Atomically decrement an integer field, return its new value, or
+        None if the key doesn't exist."""
+
+    @abstractmethod
+    def count(self, prefix: str) -> int:
+        pass  # pragma: no cover
+
+
+class MemoryStore(KeyValueStore):
+    """In process key-value store.
+
+    Expired keys are evicted on access, in the order of their expiry.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[float, dict[str, str]]] = {}
+        self._expiries: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        while self._expiries and self._expiries[0][0] <= now:
+            expires, key = heapq.heappop(self._expiries)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expires:
+                del self._entries[key]
+
+    def set(self, key: str, fields: dict[str, str], ttl: float) -> None:
+        expires = time.time() + ttl
+        with self._lock:
+            self._evict_expired()
+            self._entries[key] = (expires, dict(fields))
+            heapq.heappush(self._expiries, (expires, key))
+
+    def get(self, key: str) -> dict[str, str] | None:
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+            return dict(entry[1]) if entry is not None else None
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            self._evict_expired()
+            return self._entries.pop(key, None) is not None
+
+    def decrement(self, key: str, field: str) -> int | None:
+        with self._lock:
+            self._evict_expired()
+            if (entry := self._entries.get(key)) is None:
+                return None
+            value = int(entry[1][field]) - 1
+            entry[1][field] = str(value)
+            return value
+
+    def count(self, prefix: str) -> int:
+        with self._lock:
+            self._evict_expired()
+            return sum(key.startswith(prefix) for key in self._entries)
+
+
+# return nil when the key has expired or been deleted, rather than creating it
+_DECREMENT_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return false
+end
+return redis.call("HINCRBY", KEYS[1], ARGV[1], -1)
+"""
+
+
+class RedisStore(KeyValueStore):
+    """Redis key-value store, each key being a hash."""
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis
+        except ImportError as exc:  # pragma: no cover
+            raise RuntimeError(
+                "The redis storage needs the redis package, install "
+                "requirements.redis.txt") from exc
+
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._decrement = self._client.register_script(_DECREMENT_SCRIPT)
+
+    def set(self, key: str, fields: dict[str, str], ttl: float) -> None:
+        with self._client.pipeline() as pipeline:
+            pipeline.hset(key, mapping=fields)
+            pipeline.pexpire(key, max(int(ttl * 1000), 1))
+            pipeline.execute()
+
+    def get(self, key: str) -> dict[str, str] | None:
+        return cast(dict[str, str], self._client.hgetall(key)) or None
+
+    def delete(self, key: str) -> bool:
+        return bool(self._client.delete(key))
+
+    def decrement(self, key: str, field: str) -> int | None:
+        value = self._decrement(keys=[key], args=[field])
+        return int(value) if value is not None else None
+
+    def count(self, prefix: str) -> int:
+        # scans the keyspace, only used for reporting
+        return sum(1 for _ in self._client.scan_iter(match=f"{prefix}*"))
+
+
+class KeyValueSecretRepository(SecretRepository):
+    """Secrets stored in a key-value store, expiring with their key."""
+
+    prefix = "secret:"
+
+    def __init__(self, store: KeyValueStore) -> None:
+        self.store = store
+
+    def _key(self, external_id: str) -> str:
+        return f"{self.prefix}{external_id}"
+
+    def add(self, secret: model.Secret) -> None:
+        ttl = (secret.date_expires -
+               datetime.now(timezone.utc)).total_seconds()
+        if ttl <= 0:
+            return
+        self.store.set(
+            self._key(secret.external_id),
+            {
+                "encrypted_text": b64encode(secret.encrypted_text).decode(),
+                "date_created": secret.date_created.isoformat(),
+                "date_expires": secret.date_expires.isoformat(),
+                "tries": str(secret.tries),
+            },
+            ttl)
+
+    def get(self, external_id: str) -> model.Secret | None:
+        if (fields := self.store.get(self._key(external_id))) is None:
+            return None
+        return model.Secret(
+            encrypted_text=b64decode(fields["encrypted_text"]),
+            date_created=datetime.fromisoformat(fields["date_created"]),
+            date_expires=datetime.fromisoformat(fields["date_expires"]),
+            external_id=external_id,
+            tries=int(fields["tries"]))
+
+    def consume(self, external_id: str) -> bool:
+        return self.store.delete(self._key(external_id))
+
+    def decrement_tries(self, external_id: str) -> int | None:
+        remaining = self.store.decrement(self._key(external_id), "tries")
+        if remaining is None or remaining < 0:
+            # deleted, or a concurrent request used the last try
+            return None
+        if remaining == 0:
+            self.store.delete(self._key(external_id))
+        return remaining
+
+    def purge_expired(self, limit: int) -> int:
+        # expired keys are removed by the store
+        return 0
+
+    def count_expired(self) -> int:
+        return 0
+
+    def count_active(self) -> int:
+        return self.store.count(self.prefix)
+
+
+def create_repository(app: Flask) -> SecretRepository:
+    storage = app.config["SHHH_STORAGE"]
+    if storage == "sql":
+        if not (interval := app.config["SHHH_PARTITION_INTERVAL"]):
+            return SqlSecretRepository()
+        url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+        if url.get_backend_name() != "postgresql":
+            raise RuntimeError("SHHH_PARTITION_INTERVAL is only supported "
+                               "on PostgreSQL")
+        return PartitionedSqlSecretRepository(interval)
+    if storage == "memory":
+        return KeyValueSecretRepository(MemoryStore())
+    if storage == "redis":
+        if not (url := app.config["SHHH_REDIS_URL"]):
+            raise RuntimeError("SHHH_REDIS_URL is required by the redis "
+                               "storage")
+        return KeyValueSecretRepository(RedisStore(url))
+    raise RuntimeError(f"Storage {storage=} is not supported")
+
+
+def init_app(app: Flask) -> None:
+    app.extensions[EXTENSION_NAME] = create_repository(app)
+
+
+def get_repository(app: Flask | None = None) -> SecretRepository:
+    """Repository of the given application, or of the current one."""
+    flask_app = app or current_app
+    return cast(SecretRepository, flask_app.extensions[EXTENSION_NAME])
@@ -5,26 +5,55 @@ from typing import TYPE_CHECKING
 
 from flask import Blueprint
 from flask.views import MethodView
-from webargs.flaskparser import parser, use_kwargs
+from webargs.flaskparser import FlaskParser
 from werkzeug.exceptions import HTTPException
 
-from shhh.api.handlers import ErrorHandler, ReadHandler, WriteHandler
-from shhh.api.schemas import ReadRequest, WriteRequest
+from shhh import profiling
+from shhh.api.handlers import (BulkWriteHandler,
+                               ClientReadHandler,
+                               ClientWriteHandler,
+                               ErrorHandler,
+                               FileReadHandler,
+                               FileWriteHandler,
+                               KdfHandler,
+                               ReadHandler,
+                               WriteHandler)
+from shhh.api.schemas import (BulkWriteRequest,
+                              ClientReadRequest,
+                              ClientWriteRequest,
+                              FileReadRequest,
+                              FileWriteRequest,
+                              KdfRequest,
+                              PassphraseHeader,
+                              ReadRequest,
+                              WriteRequest)
 
 if TYPE_CHECKING:
-    from typing import NoReturn
+    from typing import Any, NoReturn
 
     from flask import Response
     from marshmallow import ValidationError
 
 
+class Parser(FlaskParser):
+    """Request arguments parser, timing the parsing of the requests."""
+
+    def parse(self, *args, **kwargs) -> Any:
+        with profiling.phase("parse"):
+            return super().parse(*args, **kwargs)
+
+
+parser = Parser()
+
+
 @parser.error_handler
 def handle_parsing_error(err: ValidationError, *args, **kwargs) -> NoReturn:
     raise HTTPException(response=ErrorHandler(err).make_response())
 
 
-body = functools.partial(use_kwargs, location="json")
-query = functools.partial(use_kwargs, location="query")
+body = functools.partial(parser.use_kwargs, location="json")
+query = functools.partial(parser.use_kwargs, location="query")
+headers = functools.partial(parser.use_kwargs, location="headers")
 
 
 class Api(MethodView):
@@ -38,5 +67,49 @@ class Api(MethodView):
         return WriteHandler(*args, **kwargs).make_response()
 
 
+class ClientApi(MethodView):
+    """Secrets encrypted and decrypted by the clients."""
+
+    @query(ClientReadRequest())
+    def get(self, *args, **kwargs) -> Response:
+        return ClientReadHandler(*args, **kwargs).make_response()
+
+    @body(ClientWriteRequest())
+    def post(self, *args, **kwargs) -> Response:
+        return ClientWriteHandler(*args, **kwargs).make_response()
+
+
+class FileApi(MethodView):
+    """Large secrets, streamed in the body of the requests and responses."""
+
+    @query(FileReadRequest())
+    def get(self, *args, **kwargs) -> Response:
+        return FileReadHandler(*args, **kwargs).make_response()
+
+    @headers(PassphraseHeader())
+    @query(FileWriteRequest())
+    def post(self, *args, **kwargs) -> Response:
+        return FileWriteHandler(*args, **kwargs).make_response()
+
+
+class KdfApi(MethodView):
+
+    @query(KdfRequest())
+    def get(self, *args, **kwargs) -> Response:
+        return KdfHandler(*args, **kwargs).make_response()
+
+
+class BulkApi(MethodView):
+
+    @body(BulkWriteRequest())
+    def post(self, *args, **kwargs) -> Response:
+        return BulkWriteHandler(*args, **kwargs).make_response()
+
+
 api = Blueprint("api", __name__, url_prefix="/api")
 api.add_url_rule("/secret", view_func=Api.as_view("secret"))
+api.add_url_rule("/secret/client",
+                 view_func=ClientApi.as_view("client_secret"))
+api.add_url_rule("/secret/kdf", view_func=KdfApi.as_view("kdf"))
+api.add_url_rule("/file", view_func=FileApi.as_view("file"))
+api.add_url_rule("/secrets", view_func=BulkApi.as_view("secrets"))
@@ -1,24 +1,39 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from base64 import urlsafe_b64encode
 from http import HTTPStatus
 from typing import TYPE_CHECKING
 
 from cryptography.fernet import InvalidToken
-from flask import current_app as app, make_response
-from sqlalchemy.orm.exc import NoResultFound
+from flask import current_app as app, g, make_response, request
+from marshmallow import ValidationError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
-from shhh.api.schemas import ErrorResponse, ReadResponse, WriteResponse
+from shhh import metrics, profiling, ratelimit
+from shhh.adapters.blobs import BlobNotFound, get_blob_store
+from shhh.adapters.gone_cache import gone_cache
+from shhh.adapters.repository import get_repository
+from shhh.api.schemas import (BulkWriteResponse,
+                              ErrorResponse,
+                              FileResponse,
+                              FileWriteResponse,
+                              KdfResponse,
+                              ReadResponse,
+                              WriteRequest,
+                              WriteResponse)
 from shhh.constants import ClientType, Message, Status
 from shhh.domain import model
-from shhh.extensions import db
+from shhh.domain.kdf import KdfPoolBusy, kdf_pool, last_kdf_timing
+from shhh.domain.stream import CHUNK_SIZE
 from shhh.liveness import db_liveness_ping
 
 if TYPE_CHECKING:
-    from flask import Response
-    from marshmallow import ValidationError
+    from typing import Any, BinaryIO, Iterator
 
+    from flask import Response
     from shhh.api.schemas import CallableResponse
+    from shhh.domain.stream import StreamCipher
 
 
 class Handler(ABC):
@@ -27,9 +42,88 @@ class Handler(ABC):
     def handle(self) -> tuple[CallableResponse, HTTPStatus]:
         pass  # pragma: no cover
 
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        """Rate limits checked before handling the request, as
+        `(name, key, cost)` tuples."""
+        return []
+
+    def cached_response(self) -> tuple[CallableResponse, HTTPStatus] | None:
+        """Response known without handling the request, if any."""
+        return None
+
     def make_response(self) -> Response:
-        response, code = self.handle()
-        return make_response(response(), code)
+        try:
+            retry_after = ratelimit.throttle(*self.rate_limits())
+        except ratelimit.LimitExceeded as exc:
+            return make_flask_response(*limit_exceeded_response(exc))
+        if retry_after:
+            return throttled_response(retry_after)
+        if cached := self.cached_response():
+            return make_flask_response(*cached)
+        try:
+            return make_flask_response(*self.handle())
+        except PoolTimeoutError as exc:
+            return make_flask_response(*busy_response(exc))
+
+
+def make_flask_response(response: CallableResponse,
+                        code: HTTPStatus) -> Response:
+    metrics.record_outcome(response)
+    flask_response = make_response(response(), code)
+    if code == HTTPStatus.SERVICE_UNAVAILABLE:
+        flask_response.headers.set("Retry-After",
+                                   str(app.config["SHHH_RETRY_AFTER"]))
+    return flask_response
+
+
+def busy_response(exc: Exception) -> tuple[ErrorResponse, HTTPStatus]:
+    app.logger.warning("Shedding request, %s", exc)
+    return ErrorResponse(Message.BUSY), HTTPStatus.SERVICE_UNAVAILABLE
+
+
+def throttled_response(retry_after: int) -> Response:
+    response = make_flask_response(ErrorResponse(Message.THROTTLED),
+                                   HTTPStatus.TOO_MANY_REQUESTS)
+    response.headers.set("Retry-After", str(retry_after))
+    g.metrics_outcome = "throttled"
+    return response
+
+
+def unexpected_error_response(
+        exc: Exception) -> tuple[ErrorResponse, HTTPStatus]:
+    app.logger.exception("Failed to create secret: %s", exc)
+    return (ErrorResponse(Message.UNEXPECTED),
+            HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+def limit_exceeded_response(
+        exc: ratelimit.LimitExceeded) -> tuple[ErrorResponse, HTTPStatus]:
+    # the request would never be allowed, retrying it is pointless
+    return (ErrorResponse(
+        Message.LIMIT_EXCEEDED.format(count=exc.limit.count)),
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+
+def not_found_response() -> tuple[ReadResponse, HTTPStatus]:
+    return (ReadResponse(Status.EXPIRED, Message.NOT_FOUND),
+            HTTPStatus.NOT_FOUND)
+
+
+def log_kdf_timing(secret: model.Secret) -> None:
+    if secret.client_encrypted:
+        # the key is derived by the client
+        return
+    if timing := last_kdf_timing.get():
+        profiling.add_phase("kdf-wait", timing.queue_wait)
+        profiling.add_phase("kdf", timing.duration)
+        app.logger.info("%s kdf queue wait: %.4fs, kdf duration: %.4fs",
+                        str(secret),
+                        timing.queue_wait,
+                        timing.duration)
+
+
+def _format_messages(messages: dict[str, list[str]]) -> str:
+    return " ".join(message[0] for message in messages.values())
 
 
 class ReadHandler(Handler):
@@ -38,43 +132,195 @@ class ReadHandler(Handler):
         self.external_id = external_id
         self.passphrase = passphrase
 
-    @db_liveness_ping(ClientType.WEB)
-    def handle(self) -> tuple[ReadResponse, HTTPStatus]:
-        try:
-            secret = db.session.query(model.Secret).filter(
-                model.Secret.has_external_id(self.external_id)).one()
-        except NoResultFound:
-            return (ReadResponse(Status.EXPIRED, Message.NOT_FOUND),
-                    HTTPStatus.NOT_FOUND)
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return [("read", ratelimit.client_address(), 1),
+                ("secret", self.external_id, 1)]
 
+    def cached_response(self) -> tuple[ReadResponse, HTTPStatus] | None:
+        if gone_cache.contains(self.external_id):
+            return not_found_response()
+        return None
+
+    def accepts(self, secret: model.Secret) -> bool:
+        """Whether the secret can be read with this handler."""
+        return not (secret.streamed or secret.client_encrypted)
+
+    def open(self, secret: model.Secret) -> CallableResponse:
+        """Return the response sending the secret, raise `InvalidToken` if
+        the passphrase is wrong."""
         try:
             message = secret.decrypt(self.passphrase)
         except InvalidToken:
-            remaining = secret.tries - 1
-            if remaining == 0:
-                # number of tries exceeded, delete secret
-                app.logger.info("%s tries to open secret exceeded",
-                                str(secret))
-                db.session.delete(secret)
-                db.session.commit()
-                return (ReadResponse(Status.INVALID, Message.EXCEEDED),
-                        HTTPStatus.UNAUTHORIZED)
-
-            secret.tries = remaining
-            db.session.commit()
-            app.logger.info(
-                "%s wrong passphrase used. Number of tries remaining: %s",
-                str(secret),
-                remaining)
-            return (ReadResponse(
-                Status.INVALID,
-                Message.INVALID.value.format(remaining=remaining)),
-                    HTTPStatus.UNAUTHORIZED)
+            log_kdf_timing(secret)
+            raise
+        log_kdf_timing(secret)
+        return ReadResponse(Status.SUCCESS, message)
 
-        db.session.delete(secret)
-        db.session.commit()
+    def not_found(self) -> tuple[ReadResponse, HTTPStatus]:
+        """Response to a read of a secret which doesn't exist."""
+        gone_cache.add(self.external_id)
+        return not_found_response()
+
+    @staticmethod
+    def rejected(secret: model.Secret) -> tuple[ReadResponse, HTTPStatus]:
+        """Response to a read of a secret which can't be read with this
+        handler, pointing to the endpoint to use. No try is used."""
+        if secret.streamed:
+            endpoint = "/api/file"
+        elif secret.client_encrypted:
+            endpoint = "/api/secret/client"
+        else:
+            endpoint = "/api/secret"
+        return (ReadResponse(Status.ERROR,
+                             Message.WRONG_ENDPOINT.format(endpoint=endpoint)),
+                HTTPStatus.CONFLICT)
+
+    def consumed(self,
+                 secret: model.Secret,
+                 response: CallableResponse,
+                 consumed: bool) -> tuple[CallableResponse, HTTPStatus]:
+        """Response to a read with the right passphrase, once the secret has
+        been consumed (or not, if a concurrent request did first)."""
+        gone_cache.add(self.external_id)
+        if not consumed:
+            return not_found_response()
         app.logger.info("%s was decrypted and deleted", str(secret))
-        return ReadResponse(Status.SUCCESS, message), HTTPStatus.OK
+        return response, HTTPStatus.OK
+
+    def invalid_passphrase(
+            self, secret: model.Secret,
+            remaining: int | None) -> tuple[ReadResponse, HTTPStatus]:
+        """Response to a read with a wrong passphrase, once the tries of the
+        secret have been decremented."""
+        if remaining is None:
+            gone_cache.add(self.external_id)
+            return not_found_response()
+
+        if remaining == 0:
+            gone_cache.add(self.external_id)
+            if secret.streamed:
+                get_blob_store().delete(self.external_id)
+            app.logger.info("%s tries to open secret exceeded", str(secret))
+            return (ReadResponse(Status.INVALID, Message.EXCEEDED),
+                    HTTPStatus.UNAUTHORIZED)
+
+        app.logger.info(
+            "%s wrong passphrase used. Number of tries remaining: %s",
+            str(secret),
+            remaining)
+        return (ReadResponse(
+            Status.INVALID, Message.INVALID.value.format(remaining=remaining)),
+                HTTPStatus.UNAUTHORIZED)
+
+    @db_liveness_ping(ClientType.WEB)
+    def handle(self) -> tuple[CallableResponse, HTTPStatus]:
+        repository = get_repository()
+        secret = repository.get(self.external_id)
+        if secret is None:
+            return self.not_found()
+        if not self.accepts(secret):
+            return self.rejected(secret)
+
+        try:
+            response = self.open(secret)
+        except KdfPoolBusy as exc:
+            return busy_response(exc)
+        except InvalidToken:
+            return self.invalid_passphrase(
+                secret, repository.decrement_tries(self.external_id))
+        return self.consumed(secret,
+                             response,
+                             repository.consume(self.external_id))
+
+
+class ClientReadHandler(ReadHandler):
+    """Read a secret encrypted by the client, sending its ciphertext (URL-safe
+    base64 encoded) once the reader proves it derived the key, without any
+    key derivation on the server. Tries are counted as with passphrases."""
+
+    def __init__(self, external_id: str, proof: bytes) -> None:
+        self.external_id = external_id
+        self.proof = proof
+
+    def accepts(self, secret: model.Secret) -> bool:
+        return secret.client_encrypted
+
+    def open(self, secret: model.Secret) -> ReadResponse:
+        return ReadResponse(
+            Status.SUCCESS,
+            urlsafe_b64encode(secret.open(self.proof)).decode())
+
+
+def _stream_blob(blob: BinaryIO, cipher: StreamCipher) -> Iterator[bytes]:
+    with blob:
+        yield from cipher.decrypt(blob.read)
+
+
+class FileReadHandler(ReadHandler):
+    """Read a large secret, streaming its content decrypted one chunk at a
+    time from its blob, deleted with the secret."""
+
+    def accepts(self, secret: model.Secret) -> bool:
+        return secret.streamed
+
+    def open(self, secret: model.Secret) -> FileResponse:
+        try:
+            name, self.cipher = secret.decrypt_stream(self.passphrase)
+        except InvalidToken:
+            log_kdf_timing(secret)
+            raise
+        log_kdf_timing(secret)
+        return FileResponse(name, ())
+
+    def consumed(self,
+                 secret: model.Secret,
+                 response: CallableResponse,
+                 consumed: bool) -> tuple[CallableResponse, HTTPStatus]:
+        response, code = super().consumed(secret, response, consumed)
+        if not isinstance(response, FileResponse):
+            return response, code
+
+        # only the request which consumed the secret takes its blob
+        try:
+            blob = get_blob_store().pop(self.external_id)
+        except BlobNotFound:
+            app.logger.error("Content of secret %s not found",
+                             self.external_id)
+            return not_found_response()
+        response.content = _stream_blob(blob, self.cipher)
+        return response, code
+
+
+class KdfHandler(Handler):
+    """Send the parameters of the key derivation of a secret encrypted by
+    the client, needed to derive the key proving the passphrase is known."""
+
+    def __init__(self, external_id: str) -> None:
+        self.external_id = external_id
+
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return [("read", ratelimit.client_address(), 1)]
+
+    def cached_response(self) -> tuple[ReadResponse, HTTPStatus] | None:
+        if gone_cache.contains(self.external_id):
+            return not_found_response()
+        return None
+
+    @db_liveness_ping(ClientType.WEB)
+    def handle(self) -> tuple[KdfResponse | ReadResponse, HTTPStatus]:
+        if (secret := get_repository().get(self.external_id)) is None:
+            gone_cache.add(self.external_id)
+            return not_found_response()
+        if not secret.client_encrypted:
+            # read with the passphrase
+            return KdfResponse(client_encrypted=False), HTTPStatus.OK
+
+        kdf, salt = secret.client_kdf()
+        return (KdfResponse(client_encrypted=True,
+                            kdf=kdf.algorithm,
+                            iterations=kdf.params[0],
+                            salt=urlsafe_b64encode(salt).decode()),
+                HTTPStatus.OK)
 
 
 class WriteHandler(Handler):
@@ -86,24 +332,180 @@ class WriteHandler(Handler):
         self.expire = expire
         self.tries = tries
 
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return [("write", ratelimit.client_address(), 1)]
+
+    def encrypt(self) -> model.Secret:
+        return model.Secret.encrypt(message=self.secret,
+                                    passphrase=self.passphrase,
+                                    expire_code=self.expire,
+                                    tries=self.tries)
+
+    @staticmethod
+    def created(secret: model.Secret) -> tuple[WriteResponse, HTTPStatus]:
+        """Response once the secret has been stored."""
+        app.logger.info("%s created", str(secret))
+        return (WriteResponse(secret.external_id, secret.expires_on_text),
+                HTTPStatus.CREATED)
+
     @db_liveness_ping(ClientType.WEB)
     def handle(self) -> tuple[WriteResponse | ErrorResponse, HTTPStatus]:
         try:
-            encrypted_secret = model.Secret.encrypt(message=self.secret,
-                                                    passphrase=self.passphrase,
-                                                    expire_code=self.expire,
-                                                    tries=self.tries)
-            db.session.add(encrypted_secret)
-            db.session.commit()
+            encrypted_secret = self.encrypt()
+            log_kdf_timing(encrypted_secret)
+            get_repository().add(encrypted_secret)
+        except (KdfPoolBusy, PoolTimeoutError) as exc:
+            return busy_response(exc)
         except Exception as exc:
-            db.session.rollback()
-            app.logger.exception("Failed to create secret: %s", exc)
+            return unexpected_error_response(exc)
+        return self.created(encrypted_secret)
+
+
+class ClientWriteHandler(WriteHandler):
+    """Store a secret encrypted by the client, without any key derivation
+    on the server."""
+
+    def __init__(self,
+                 ciphertext: bytes,
+                 salt: bytes,
+                 iterations: int,
+                 verifier: bytes,
+                 expire: str,
+                 tries: int) -> None:
+        self.ciphertext = ciphertext
+        self.salt = salt
+        self.iterations = iterations
+        self.verifier = verifier
+        self.expire = expire
+        self.tries = tries
+
+    def encrypt(self) -> model.Secret:
+        return model.Secret.from_client(ciphertext=self.ciphertext,
+                                        salt=self.salt,
+                                        iterations=self.iterations,
+                                        verifier=self.verifier,
+                                        expire_code=self.expire,
+                                        tries=self.tries)
+
+
+class FileTooLarge(ValueError):
+    """Raised when the content of a large secret exceeds
+    SHHH_FILE_MAX_SIZE."""
+
+
+def _read_body(max_size: int) -> Iterator[bytes]:
+    size = 0
+    while chunk := request.stream.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise FileTooLarge
+        yield chunk
+
+
+class FileWriteHandler(Handler):
+    """Create a large secret from the body of the request, encrypted one
+    chunk at a time while streamed to the blob store, so the memory used
+    doesn't depend on its size."""
+
+    def __init__(self, passphrase: str, name: str, expire: str,
+                 tries: int) -> None:
+        self.passphrase = passphrase
+        self.name = name
+        self.expire = expire
+        self.tries = tries
+
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return [("write", ratelimit.client_address(), 1)]
+
+    @db_liveness_ping(ClientType.WEB)
+    def handle(self) -> tuple[FileWriteResponse | ErrorResponse, HTTPStatus]:
+        max_size = app.config["SHHH_FILE_MAX_SIZE"]
+        too_large = (ErrorResponse(f"The file should not exceed {max_size} "
+                                   "bytes."),
+                     HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        if (request.content_length or 0) > max_size:
+            return too_large
+
+        blob_store = get_blob_store()
+        try:
+            secret, cipher = model.Secret.encrypt_stream(
+                name=self.name,
+                passphrase=self.passphrase,
+                expire_code=self.expire,
+                tries=self.tries)
+            log_kdf_timing(secret)
+            blob_store.write(secret.external_id,
+                             cipher.encrypt(_read_body(max_size)),
+                             expires=secret.date_expires)
+            try:
+                get_repository().add(secret)
+            except Exception:
+                blob_store.delete(secret.external_id)
+                raise
+        except FileTooLarge:
+            return too_large
+        except (KdfPoolBusy, PoolTimeoutError) as exc:
+            return busy_response(exc)
+        except Exception as exc:
+            return unexpected_error_response(exc)
+        app.logger.info("%s created", str(secret))
+        return (FileWriteResponse(secret.external_id, secret.expires_on_text),
+                HTTPStatus.CREATED)
+
+
+class BulkWriteHandler(Handler):
+    """Create many secrets at once.
+
+    Each item is validated and encrypted like a single write (encryptions
+    run in parallel, up to the size of the KDF pool), then all the valid
+    secrets are stored at once (with a single batched insert and commit in
+    the database). Invalid items get an error result, without failing the
+    others.
+    """
+
+    def __init__(self, secrets: list[Any]) -> None:
+        self.secrets = secrets
+
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        # each secret costs a key derivation
+        return [("write", ratelimit.client_address(), len(self.secrets))]
+
+    @db_liveness_ping(ClientType.WEB)
+    def handle(self) -> tuple[BulkWriteResponse | ErrorResponse, HTTPStatus]:
+        results: dict[int, WriteResponse | ErrorResponse] = {}
+        handlers: dict[int, WriteHandler] = {}
+        for index, item in enumerate(self.secrets):
+            try:
+                handlers[index] = WriteHandler(**WriteRequest().load(item))
+            except ValidationError as exc:
+                results[index] = ErrorResponse(
+                    _format_messages(exc.normalized_messages()))
+
+        try:
+            encrypted_secrets = kdf_pool.map(WriteHandler.encrypt,
+                                             list(handlers.values()))
+            get_repository().add_all(encrypted_secrets)
+        except (KdfPoolBusy, PoolTimeoutError) as exc:
+            return busy_response(exc)
+        except Exception as exc:
+            app.logger.exception("Failed to create secrets: %s", exc)
             return (ErrorResponse(Message.UNEXPECTED),
                     HTTPStatus.INTERNAL_SERVER_ERROR)
-        app.logger.info("%s created", str(encrypted_secret))
-        return (WriteResponse(encrypted_secret.external_id,
-                              encrypted_secret.expires_on_text),
-                HTTPStatus.CREATED)
+
+        for index, secret in zip(handlers, encrypted_secrets):
+            results[index] = WriteResponse(secret.external_id,
+                                           secret.expires_on_text)
+        app.logger.info("%s secrets created in bulk, %s invalid",
+                        len(encrypted_secrets),
+                        len(self.secrets) - len(encrypted_secrets))
+
+        if not encrypted_secrets:
+            code = HTTPStatus.UNPROCESSABLE_ENTITY
+        elif len(encrypted_secrets) < len(self.secrets):
+            code = HTTPStatus.MULTI_STATUS
+        else:
+            code = HTTPStatus.CREATED
+        return BulkWriteResponse([results[i] for i in sorted(results)]), code
 
 
 class ErrorHandler(Handler):
@@ -113,8 +515,8 @@ class ErrorHandler(Handler):
 
     def handle(self) -> tuple[ErrorResponse, HTTPStatus]:
         messages = self.error_exc.normalized_messages()
-        error = ""
-        for source in ("json", "query"):
-            for _, message in messages.get(source, {}).items():
-                error += f"{message[0]} "
-        return ErrorResponse(error.strip()), HTTPStatus.UNPROCESSABLE_ENTITY
+        error = " ".join(
+            _format_messages(messages[source])
+            for source in ("json", "query", "headers")
+            if messages.get(source))
+        return ErrorResponse(error), HTTPStatus.UNPROCESSABLE_ENTITY
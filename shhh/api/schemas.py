@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import binascii
 import re
+from base64 import b64decode
 from dataclasses import dataclass, field, fields as dfields
 from urllib.parse import urljoin
 from typing import TYPE_CHECKING
 
-from flask import current_app as app, jsonify, url_for
+from flask import (current_app as app,
+                   jsonify,
+                   make_response,
+                   request,
+                   url_for)
 from marshmallow import Schema, ValidationError, fields, pre_load, validate
 
 from shhh.constants import (DEFAULT_EXPIRATION_TIME_VALUE,
@@ -14,8 +20,12 @@ from shhh.constants import (DEFAULT_EXPIRATION_TIME_VALUE,
                             READ_TRIES_VALUES,
                             Message,
                             Status)
+from shhh.domain.kdf import KEY_SIZE
+from shhh.domain.model import NONCE_SIZE, SALT_SIZE, VERIFIER_SIZE
 
 if TYPE_CHECKING:
+    from typing import Iterable, Mapping
+
     from flask import Response
 
 
@@ -25,6 +35,36 @@ class ReadRequest(Schema):
     passphrase = fields.Str(required=True)
 
 
+class Base64Bytes(fields.Field):
+    """Bytes encoded with URL-safe base64, padded or not."""
+
+    default_error_messages = {"invalid": "Not a valid base64 string."}
+
+    def _deserialize(self, value, attr, data, **kwargs) -> bytes:
+        if not isinstance(value, str):
+            raise self.make_error("invalid")
+        try:
+            return b64decode(value + "=" * (-len(value) % 4),
+                             altchars=b"-_",
+                             validate=True)
+        except (binascii.Error, ValueError) as exc:
+            raise self.make_error("invalid") from exc
+
+
+class ClientReadRequest(Schema):
+    """Schema for inbound read requests of secrets encrypted by the
+    client."""
+    external_id = fields.Str(required=True)
+    proof = Base64Bytes(required=True,
+                        validate=validate.Length(equal=KEY_SIZE))
+
+
+class KdfRequest(Schema):
+    """Schema for inbound requests of the key derivation parameters of a
+    secret."""
+    external_id = fields.Str(required=True)
+
+
 def _passphrase_validator(passphrase: str) -> None:
     regex = re.compile(r"^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9]).{8,}$")
     if not regex.search(passphrase):
@@ -40,23 +80,102 @@ def _secret_validator(secret: str) -> None:
                               "characters.")
 
 
-class WriteRequest(Schema):
-    """Schema for inbound write requests."""
-    passphrase = fields.Str(required=True, validate=_passphrase_validator)
-    secret = fields.Str(required=True, validate=_secret_validator)
+class _SecretOptions(Schema):
     expire = fields.Str(load_default=DEFAULT_EXPIRATION_TIME_VALUE,
                         validate=validate.OneOf(
                             EXPIRATION_TIME_VALUES.values()))
     tries = fields.Int(load_default=DEFAULT_READ_TRIES_VALUE,
                        validate=validate.OneOf(READ_TRIES_VALUES))
 
+
+class WriteRequest(_SecretOptions):
+    """Schema for inbound write requests."""
+    passphrase = fields.Str(required=True, validate=_passphrase_validator)
+    secret = fields.Str(required=True, validate=_secret_validator)
+
     @pre_load
     def secret_sanitise_newline(self, data: dict, **kwargs) -> dict:
-        if isinstance(data.get("secret"), str):
+        if isinstance(data, dict) and isinstance(data.get("secret"), str):
             data["secret"] = "\n".join(data["secret"].splitlines())
         return data
 
 
+class FileWriteRequest(_SecretOptions):
+    """Schema for inbound write requests of large secrets, whose content is
+    the body of the request."""
+    name = fields.Str(load_default="secret",
+                      validate=validate.Length(min=1, max=255))
+
+
+class FileReadRequest(ReadRequest):
+    """Schema for inbound read requests of large secrets, whose passphrase
+    is taken from the X-Shhh-Passphrase header when sent, to keep it out of
+    the access logs."""
+
+    @pre_load
+    def passphrase_from_header(self, data: Mapping, **kwargs) -> Mapping:
+        if (passphrase := request.headers.get("X-Shhh-Passphrase")) is None:
+            return data
+        return {**data, "passphrase": passphrase}
+
+
+class PassphraseHeader(Schema):
+    """Schema for the passphrase sent in a header, for the requests whose
+    other arguments are in the URL, to keep it out of the access logs."""
+    passphrase = fields.Str(required=True,
+                            data_key="X-Shhh-Passphrase",
+                            validate=_passphrase_validator)
+
+
+def _ciphertext_validator(ciphertext: bytes) -> None:
+    # up to 3 bytes per character encoded in UTF-8, with the nonce and tag
+    # of AES-GCM
+    max_size = 3 * app.config["SHHH_SECRET_MAX_LENGTH"] + NONCE_SIZE + 16
+    if len(ciphertext) > max_size:
+        raise ValidationError(f"The ciphertext should not exceed {max_size} "
+                              "bytes.")
+
+
+def _iterations_validator(iterations: int) -> None:
+    minimum = app.config["SHHH_CLIENT_KDF_ITERATIONS"]
+    if not minimum <= iterations < 2**32:
+        raise ValidationError(f"At least {minimum} iterations are needed.")
+
+
+class ClientWriteRequest(_SecretOptions):
+    """Schema for inbound write requests of secrets encrypted by the
+    client, with keys derived with PBKDF2-SHA256 from the passphrase.
+
+    The server never sees the passphrase, so its strength is checked by the
+    client. The ciphertext is only sent to the readers proving they derived
+    the keys, with a key whose SHA-256 is `verifier`.
+    """
+    ciphertext = Base64Bytes(required=True, validate=_ciphertext_validator)
+    salt = Base64Bytes(required=True,
+                       validate=validate.Length(equal=SALT_SIZE))
+    iterations = fields.Int(required=True, validate=_iterations_validator)
+    verifier = Base64Bytes(required=True,
+                           validate=validate.Length(equal=VERIFIER_SIZE))
+
+
+def _bulk_size_validator(secrets: list) -> None:
+    max_size = app.config["SHHH_BULK_MAX_SECRETS"]
+    if not 0 < len(secrets) <= max_size:
+        raise ValidationError(f"Between 1 and {max_size} secrets can be "
+                              "created at once.")
+
+
+class BulkWriteRequest(Schema):
+    """Schema for inbound bulk write requests.
+
+    Each item is validated against `WriteRequest` on its own, so invalid
+    items are reported without rejecting the others.
+    """
+    secrets = fields.List(fields.Raw(),
+                          required=True,
+                          validate=_bulk_size_validator)
+
+
 @dataclass
 class CallableResponse:
 
@@ -76,10 +195,38 @@ class ReadResponse(CallableResponse):
     msg: str
 
 
-def _build_link_url(external_id: str) -> str:
-    url = url_for("web.read", external_id=external_id, _external=True)
+@dataclass
+class KdfResponse(CallableResponse):
+    """Schema for outbound responses with the parameters of the key
+    derivation run by the client, for the secrets it encrypted."""
+    client_encrypted: bool
+    kdf: str | None = None
+    iterations: int | None = None
+    salt: str | None = None
+    status: Status = Status.FOUND
+
+
+@dataclass
+class FileResponse(CallableResponse):
+    """Schema for outbound responses streaming the content of a large
+    secret, as an attachment."""
+    name: str
+    content: Iterable[bytes]
+    status: Status = Status.SUCCESS
+
+    def __call__(self) -> Response:
+        response = make_response(self.content)
+        response.mimetype = "application/octet-stream"
+        response.headers.set("Content-Disposition",
+                             "attachment",
+                             filename=self.name)
+        return response
+
+
+def _build_link_url(external_id: str, endpoint: str = "web.read") -> str:
+    url = url_for(endpoint, external_id=external_id, _external=True)
     if root_host := app.config.get("SHHH_HOST"):
-        url = urljoin(root_host, url_for("web.read", external_id=external_id))
+        url = urljoin(root_host, url_for(endpoint, external_id=external_id))
     return str(url)
 
 
@@ -96,8 +243,29 @@ class WriteResponse(CallableResponse):
         self.link = _build_link_url(self.external_id)
 
 
+@dataclass
+class FileWriteResponse(WriteResponse):
+    """Schema for outbound write responses of large secrets, linking to
+    the page downloading them."""
+
+    def __post_init__(self) -> None:
+        self.link = _build_link_url(self.external_id, "web.read_file")
+
+
 @dataclass
 class ErrorResponse(CallableResponse):
     """Schema for outbound error responses."""
     details: str
     status: Status = Status.ERROR
+
+
+@dataclass
+class BulkWriteResponse(CallableResponse):
+    """Schema for outbound bulk write responses, with a result per item in
+    the order of the request."""
+    results: list[WriteResponse | ErrorResponse]
+    created: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.created = sum(
+            isinstance(result, WriteResponse) for result in self.results)
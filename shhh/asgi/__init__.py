@@ -0,0 +1 @@
+from .app import AsgiApp, create_asgi_app  # noqa: F401
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import sys
+from typing import TYPE_CHECKING
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+from shhh.adapters.repository import AsyncSqlSecretRepository, get_repository
+from shhh.api.api import parser
+from shhh.api.schemas import ReadRequest, WriteRequest
+from shhh.asgi.db import AsyncDatabase
+from shhh.asgi.handlers import AsyncReadHandler, AsyncWriteHandler
+from shhh.entrypoint import create_app
+from shhh.startup import warm_up
+
+if TYPE_CHECKING:
+    from typing import Any, Awaitable, Callable
+
+    from flask import Flask, Response
+
+    from shhh.constants import EnvConfig
+
+    Scope = dict[str, Any]
+    Message = dict[str, Any]
+    Receive = Callable[[], Awaitable[Message]]
+    Send = Callable[[Message], Awaitable[None]]
+
+# Routes served by the async handlers, everything else is served by the
+# Flask application.
+ASYNC_ROUTES = {("GET", "/api/secret"), ("POST", "/api/secret")}
+
+
+def _get_path_info(scope: Scope) -> str:
+    root_path, path = scope.get("root_path", ""), scope["path"]
+    if root_path and path.startswith(root_path):
+        return str(path[len(root_path):])
+    return str(path)
+
+
+def _build_environ(scope: Scope, body: bytes) -> dict[str, Any]:
+    """Build a WSGI environ from an ASGI HTTP scope."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": _get_path_info(scope),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = raw_value.decode("latin1")
+        if name in environ:
+            value = f"{environ[name]},{value}"
+        environ[name] = value
+    # the body has been read in full already
+    environ.setdefault("CONTENT_LENGTH", str(len(body)))
+    return environ
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get("body", b""))
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def _send_response(response: Response, send: Send) -> None:
+    headers = [(name.lower().encode("latin1"), value.encode("latin1"))
+               for name, value in response.headers.items()]
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": headers,
+    })
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+class AsgiApp:
+    """ASGI application serving the secrets API asynchronously.
+
+    Database round trips of the API go through an async SQLAlchemy engine,
+    and key derivations are awaited off the event loop, so a worker keeps
+    serving other requests while they wait. Requests are validated and
+    answered with the same schemas, handlers semantics and response hooks
+    as the WSGI mode. All the other routes are served by the Flask
+    application, run in a thread.
+    """
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.flask_app = flask_app
+        self.db = AsyncDatabase.from_app(flask_app)
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        # the async handlers only support the secrets stored in the database
+        self.async_api = get_repository(flask_app).uses_database
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif (scope["type"] == "http" and self.async_api
+              and (scope["method"], _get_path_info(scope)) in ASYNC_ROUTES):
+            await self._handle_api(scope, receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(warm_up, self.flask_app)
+                await self.db.warm_up()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.db.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _handle_api(self, scope: Scope, receive: Receive,
+                          send: Send) -> None:
+        environ = _build_environ(scope, await _read_body(receive))
+        with self.flask_app.request_context(environ):
+            try:
+                # run the before request handlers, as the WSGI app would
+                if (rv := self.flask_app.preprocess_request()) is not None:
+                    response = self.flask_app.make_response(rv)
+                else:
+                    response = await self._dispatch()
+            except Exception as exc:
+                response = self.flask_app.handle_exception(exc)
+            response = self.flask_app.process_response(response)
+        await _send_response(response, send)
+
+    async def _dispatch(self) -> Response:
+        try:
+            # parsed as in the WSGI mode, invalid JSON bodies and arguments
+            # get the same responses
+            if request.method == "GET":
+                kwargs = parser.parse(ReadRequest(), location="query")
+            else:
+                kwargs = parser.parse(WriteRequest(), location="json")
+        except HTTPException as exc:
+            return self.flask_app.make_response(
+                self.flask_app.handle_user_exception(exc))
+
+        async with self.db.session() as session:
+            repository = AsyncSqlSecretRepository(session)
+            handler: AsyncReadHandler | AsyncWriteHandler
+            if request.method == "GET":
+                handler = AsyncReadHandler(repository, **kwargs)
+            else:
+                handler = AsyncWriteHandler(repository, **kwargs)
+            return await handler.make_response()
+
+
+def create_asgi_app(env: EnvConfig) -> AsgiApp:
+    """ASGI application factory."""
+    return AsgiApp(create_app(env))
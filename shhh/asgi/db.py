@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from sqlalchemy import make_url, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from shhh.adapters.engine import build_engine_options
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from flask import Flask
+    from sqlalchemy import URL
+    from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Async driver used for each supported database backend.
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg", "mysql": "aiomysql", "sqlite": "aiosqlite",
+}
+
+
+def to_async_url(uri: str) -> URL:
+    """Swap the driver of a database URI for its async counterpart."""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver supported for {backend=}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+class AsyncDatabase:
+    """Async SQLAlchemy engine and sessions, for the ASGI mode.
+
+    The engine is bound to the event loop it is first used in, so it is only
+    created on first use and must be disposed of before the loop closes.
+    """
+
+    def __init__(self, uri: str, **engine_options: Any) -> None:
+        self.url = to_async_url(uri)
+        self.engine_options = engine_options
+        if (self.url.get_backend_name() == "sqlite"
+                and self.url.database in (None, "", ":memory:")):
+            # share the in memory database across sessions
+            self.engine_options.setdefault("poolclass", StaticPool)
+        self._engine: AsyncEngine | None = None
+        self._sessionmaker: async_sessionmaker[AsyncSession] | None = None
+
+    @classmethod
+    def from_app(cls, flask_app: Flask) -> AsyncDatabase:
+        uri = (flask_app.config["SHHH_ASYNC_DATABASE_URI"]
+               or flask_app.config["SQLALCHEMY_DATABASE_URI"])
+        return cls(uri,
+                   echo=flask_app.config["SQLALCHEMY_ECHO"],
+                   **build_engine_options(uri, flask_app.config,
+                                          is_async=True))
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            self._engine = create_async_engine(self.url, **self.engine_options)
+        return self._engine
+
+    def session(self) -> AsyncSession:
+        if self._sessionmaker is None:
+            # instances are not refreshed after a commit, as the consumed
+            # secrets rows are gone
+            self._sessionmaker = async_sessionmaker(self.engine,
+                                                    expire_on_commit=False)
+        return self._sessionmaker()
+
+    async def warm_up(self) -> None:
+        """Open a connection of the pool before the first requests."""
+        try:
+            async with self.engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+        except SQLAlchemyError as exc:
+            logger.warning("Could not connect to the database: %s", exc)
+
+    async def dispose(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+        self._engine = self._sessionmaker = None
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from cryptography.fernet import InvalidToken
+from flask import current_app as app
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from shhh import profiling, ratelimit
+from shhh.api.handlers import (ReadHandler,
+                               WriteHandler,
+                               busy_response,
+                               limit_exceeded_response,
+                               log_kdf_timing,
+                               make_flask_response,
+                               throttled_response,
+                               unexpected_error_response)
+from shhh.domain.kdf import KdfPoolBusy, last_kdf_timing
+from shhh.liveness import db_health, service_unavailable_response
+
+if TYPE_CHECKING:
+    from http import HTTPStatus
+    from typing import Any, Callable, TypeVar
+
+    from flask import Response
+
+    from shhh.adapters.repository import AsyncSecretRepository
+    from shhh.api.schemas import (CallableResponse,
+                                  ErrorResponse,
+                                  ReadResponse,
+                                  WriteResponse)
+
+    RT = TypeVar("RT")
+
+
+async def _run_off_loop(func: Callable[..., RT], *args: Any,
+                        **kwargs: Any) -> RT:
+    """Run CPU bound work (the key derivation) in a thread.
+
+    The timing of the key derivation is copied back to the caller context,
+    so it can be logged the same way as in the WSGI mode.
+    """
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            None, functools.partial(context.run, func, *args, **kwargs))
+    finally:
+        if (timing := context.get(last_kdf_timing)) is not None:
+            last_kdf_timing.set(timing)
+
+
+class AsyncHandler(ABC):
+
+    def __init__(self, repository: AsyncSecretRepository) -> None:
+        self.repository = repository
+
+    @abstractmethod
+    async def handle(self) -> tuple[CallableResponse, HTTPStatus]:
+        pass  # pragma: no cover
+
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return []
+
+    def cached_response(self) -> tuple[CallableResponse, HTTPStatus] | None:
+        return None
+
+    async def make_response(self) -> Response:
+        try:
+            # the buckets are in a locked file or in Redis
+            retry_after = await asyncio.to_thread(ratelimit.throttle,
+                                                  *self.rate_limits())
+        except ratelimit.LimitExceeded as exc:
+            return make_flask_response(*limit_exceeded_response(exc))
+        if retry_after:
+            return throttled_response(retry_after)
+        if cached := self.cached_response():
+            return make_flask_response(*cached)
+
+        flask_app = app._get_current_object()  # type: ignore[attr-defined]
+        with profiling.phase("liveness"):
+            healthy = await db_health.is_healthy_async(flask_app,
+                                                       self.repository)
+        if not healthy:
+            return service_unavailable_response()
+        try:
+            return make_flask_response(*await self.handle())
+        except PoolTimeoutError as exc:
+            return make_flask_response(*busy_response(exc))
+
+
+class AsyncReadHandler(AsyncHandler):
+    """Async version of `ReadHandler`, whose logic it runs around the awaited
+    repository calls."""
+
+    def __init__(self,
+                 repository: AsyncSecretRepository,
+                 external_id: str,
+                 passphrase: str) -> None:
+        super().__init__(repository)
+        self.reader = ReadHandler(external_id, passphrase)
+
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return self.reader.rate_limits()
+
+    def cached_response(self) -> tuple[ReadResponse, HTTPStatus] | None:
+        return self.reader.cached_response()
+
+    async def handle(self) -> tuple[CallableResponse, HTTPStatus]:
+        reader, external_id = self.reader, self.reader.external_id
+        secret = await self.repository.get(external_id)
+        if secret is None:
+            return reader.not_found()
+        if not reader.accepts(secret):
+            return reader.rejected(secret)
+
+        try:
+            response = await _run_off_loop(reader.open, secret)
+        except KdfPoolBusy as exc:
+            return busy_response(exc)
+        except InvalidToken:
+            return reader.invalid_passphrase(
+                secret, await self.repository.decrement_tries(external_id))
+        return reader.consumed(secret,
+                               response,
+                               await self.repository.consume(external_id))
+
+
+class AsyncWriteHandler(AsyncHandler):
+    """Async version of `WriteHandler`, encrypting the secret off the event
+    loop."""
+
+    def __init__(self,
+                 repository: AsyncSecretRepository,
+                 passphrase: str,
+                 secret: str,
+                 expire: str,
+                 tries: int) -> None:
+        super().__init__(repository)
+        self.writer = WriteHandler(passphrase, secret, expire, tries)
+
+    def rate_limits(self) -> list[tuple[str, str, int]]:
+        return self.writer.rate_limits()
+
+    async def handle(self) -> tuple[WriteResponse | ErrorResponse, HTTPStatus]:
+        try:
+            encrypted_secret = await _run_off_loop(self.writer.encrypt)
+            log_kdf_timing(encrypted_secret)
+            await self.repository.add(encrypted_secret)
+        except (KdfPoolBusy, PoolTimeoutError) as exc:
+            return busy_response(exc)
+        except Exception as exc:
+            return unexpected_error_response(exc)
+        return self.writer.created(encrypted_secret)
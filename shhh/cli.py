@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+import logging
+import signal
+import subprocess  # nosec B404
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import click
+from flask import current_app as app
+from flask.cli import with_appcontext
+
+from shhh.adapters import orm, partitions
+from shhh.adapters.repository import get_repository
+from shhh.compression import precompress_static_files
+from shhh.domain.kdf import KDF_ALGORITHMS, calibrate
+from shhh.extensions import assets, db, scheduler
+from shhh.profiling import PROFILE_HEADER, sign_profile_request
+from shhh.scheduler import start_scheduler
+from shhh.scheduler.tasks import blobs_lease, partitions_lease, reaper_lease
+
+if TYPE_CHECKING:
+    from flask_alembic import Alembic
+
+logger = logging.getLogger(__name__)
+
+
+@click.command("build-static")
+@with_appcontext
+def build_static() -> None:
+    """Build the static assets, and their precompressed variants."""
+    from webassets.script import CommandLineEnvironment
+
+    CommandLineEnvironment(assets, logger).build()
+    if app.static_folder is None:
+        return
+    for path in precompress_static_files(app.static_folder):
+        logger.info("Precompressed %s", path)
+
+
+@click.command("calibrate-kdf")
+@click.option("--algorithm",
+              type=click.Choice(list(KDF_ALGORITHMS)),
+              default="pbkdf2",
+              show_default=True)
+@click.option("--target",
+              default=250,
+              show_default=True,
+              help="Target derivation time, in milliseconds.")
+@click.option("--memory-cost",
+              type=int,
+              help="Memory cost of argon2id, in KiB.")
+def calibrate_kdf(algorithm: str, target: int,
+                  memory_cost: int | None) -> None:
+    """Recommend key derivation parameters for this host.
+
+    Run it on the hardware serving the application, the derivation time of
+    each request is close to the target.
+    """
+    kdf, elapsed = calibrate(algorithm, target / 1000, memory_cost)
+    click.echo(f"# derivation time: {elapsed * 1000:.0f}ms")
+    click.echo(f"SHHH_KDF_ALGORITHM={kdf.algorithm}")
+    click.echo(f"SHHH_KDF_PARAMS={kdf}")
+
+
+@click.command("partition-table")
+@click.option("--undo",
+              is_flag=True,
+              help="Convert the table back to a regular table.")
+@with_appcontext
+def partition_table(undo: bool) -> None:
+    """Partition the secret table per SHHH_PARTITION_INTERVAL of expiry
+    date (PostgreSQL only).
+
+    The secrets not expired yet are copied to the new table, which is locked
+    meanwhile, so stop the application first.
+    """
+    interval = app.config["SHHH_PARTITION_INTERVAL"]
+    if db.engine.dialect.name != "postgresql":
+        raise click.ClickException("Partitioning needs PostgreSQL")
+    if not interval and not undo:
+        raise click.ClickException("SHHH_PARTITION_INTERVAL must be set")
+
+    with db.engine.begin() as connection:
+        if partitions.is_partitioned(connection) != undo:
+            raise click.ClickException(
+                f"The secret table is {'not ' if undo else ''}partitioned")
+        if undo:
+            partitions.unpartition_table(connection)
+        else:
+            partitions.partition_table(connection, interval)
+    click.echo("The secret table has been converted")
+
+
+@click.command("profile-token")
+@click.argument("path")
+@click.option("--ttl",
+              default=300,
+              show_default=True,
+              help="Validity of the token, in seconds.")
+@with_appcontext
+def profile_token(path: str, ttl: int) -> None:
+    """Print a header to profile the requests to PATH.
+
+    The profiles are written to SHHH_PROFILING_DIR.
+    """
+    key = app.config["SHHH_PROFILING_KEY"]
+    if not key or not app.config["SHHH_PROFILING_DIR"]:
+        raise click.ClickException(
+            "SHHH_PROFILING_DIR and SHHH_PROFILING_KEY must be set")
+    token = sign_profile_request(key, path, int(time.time()) + ttl)
+    click.echo(f"{PROFILE_HEADER}: {token}")
+
+
+@click.command("run-scheduler")
+@with_appcontext
+def run_scheduler() -> None:
+    """Run the scheduled jobs as a standalone process.
+
+    Use it with SHHH_SCHEDULER_ENABLED=false on the web workers, so they do
+    not carry the scheduler thread.
+    """
+    if not scheduler.running:
+        start_scheduler(scheduler)
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    logger.info("Scheduler running, press CTRL+C to quit")
+    stop.wait()
+
+    scheduler.shutdown()
+    if get_repository().uses_database:
+        # let another node take over straight away
+        reaper_lease.release()
+        partitions_lease.release()
+        blobs_lease.release()
+    logger.info("Scheduler stopped")
+
+
+def _get_alembic() -> Alembic:
+    """Register Flask-Alembic on first use, as it is slow to import and only
+    needed to run the migrations."""
+    if (alembic := app.extensions.get("alembic")) is None:
+        from flask_alembic import Alembic
+
+        flask_app = app._get_current_object()  # type: ignore[attr-defined]
+        alembic = Alembic(command_name="", metadatas={"default": orm.metadata})
+        alembic.init_app(flask_app)
+    return alembic
+
+
+class MigrationsGroup(click.Group):
+    """The `db` commands of Flask-Alembic, imported when they are run."""
+
+    @staticmethod
+    def _commands() -> click.Group:
+        from flask_alembic.cli import cli
+
+        return cli
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx: click.Context,
+                    cmd_name: str) -> click.Command | None:
+        return self._commands().get_command(ctx, cmd_name)
+
+
+@click.group("db", cls=MigrationsGroup)
+@click.pass_context
+def migrations(ctx: click.Context) -> None:
+    """Perform database migrations."""
+    ctx.obj = _get_alembic()
+
+
+@click.command("startup-profile")
+def startup_profile() -> None:
+    """Report the duration of each phase of the application startup.
+
+    The application is started in a new process, as a new worker would be:
+    imports, creation of the application and warm-up.
+    """
+    result = subprocess.run(  # nosec B603
+        [sys.executable, "-m", "shhh.startup"],
+        capture_output=True,
+        text=True,
+        check=False)
+    if result.returncode:
+        raise click.ClickException(
+            f"The application failed to start:\n{result.stderr}")
+
+    phases = json.loads(result.stdout.splitlines()[-1])
+    for name, duration in phases.items():
+        click.echo(f"{name:<12} {duration * 1000:>8.1f}ms")
+    click.echo(f"{'total':<12} {sum(phases.values()) * 1000:>8.1f}ms")
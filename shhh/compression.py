@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from flask import current_app as app, request, send_from_directory
+
+from shhh import metrics, profiling
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterable
+
+    from flask import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+# Supported encodings, by order of preference, with their file extension when
+# precompressed.
+ENCODERS: dict[str, tuple[str, Callable[[bytes], bytes]]] = {}
+PRECOMPRESSED_ENCODERS: dict[str, tuple[str, Callable[[bytes], bytes]]] = {}
+
+if brotli is not None:
+    ENCODERS["br"] = (".br", lambda data: brotli.compress(data, quality=5))
+    PRECOMPRESSED_ENCODERS["br"] = (".br", brotli.compress)
+if zstandard is not None:
+    # compressor instances are not thread safe, do not share them
+    ENCODERS["zstd"] = (
+        ".zst", lambda data: zstandard.ZstdCompressor(level=3).compress(data))
+    PRECOMPRESSED_ENCODERS["zstd"] = (
+        ".zst", lambda data: zstandard.ZstdCompressor(level=19).compress(data))
+ENCODERS["gzip"] = (".gz",
+                    lambda data: gzip.compress(data, compresslevel=6, mtime=0))
+PRECOMPRESSED_ENCODERS["gzip"] = (
+    ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))
+
+PRECOMPRESSED_SUFFIXES = (".min.css", ".min.js")
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    started = time.perf_counter()
+    compressed = ENCODERS[encoding][1](data)
+    metrics.record_compression(encoding, time.perf_counter() - started)
+    return compressed
+
+
+class CompressionCache:
+    """Bounded LRU cache of compressed bodies, keyed by content digest.
+
+    Pages rendered to the same bytes are only compressed once per encoding.
+    """
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[tuple[bytes, str], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def get_or_compress(self, data: bytes, encoding: str,
+                        max_size: int) -> bytes:
+        if max_size <= 0:
+            return _compress(data, encoding)
+
+        key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+        with self._lock:
+            if (compressed := self._entries.get(key)) is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        compressed = _compress(data, encoding)
+        with self._lock:
+            self._entries[key] = compressed
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+        return compressed
+
+
+compression_cache = CompressionCache()
+
+
+def _negotiate(encodings: Iterable[str]) -> str | None:
+    return request.accept_encodings.best_match(list(encodings))
+
+
+def _serve_precompressed(response: Response) -> Response:
+    filename = (request.view_args or {}).get("filename")
+    if (response.status_code != 200 or not filename
+            or app.static_folder is None
+            or not filename.endswith(PRECOMPRESSED_SUFFIXES)):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    available = [
+        encoding for encoding, (ext, _) in PRECOMPRESSED_ENCODERS.items()
+        if os.path.isfile(os.path.join(app.static_folder, filename + ext))
+    ]
+    if not available or not (encoding := _negotiate(available)):
+        return response
+
+    ext = PRECOMPRESSED_ENCODERS[encoding][0]
+    response.close()
+    precompressed = send_from_directory(app.static_folder,
+                                        filename + ext,
+                                        mimetype=response.mimetype)
+    precompressed.headers.set("Content-Encoding", encoding)
+    precompressed.vary.add("Accept-Encoding")
+    return precompressed
+
+
+def compress_response(response: Response) -> Response:
+    """Compress the response using the best encoding accepted by the client.
+
+    Static files are served from their precompressed variant when it exists.
+    Other responses are compressed in memory, and cached when they are not
+    JSON, as HTML pages rendered to the same bytes are common.
+    """
+    if request.endpoint == "static":
+        return _serve_precompressed(response)
+
+    is_json = response.mimetype == "application/json"
+    if (response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or (is_json and not app.config["SHHH_COMPRESS_JSON"])):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    min_size = app.config["SHHH_COMPRESSION_MIN_SIZE"]
+    if (response.content_length or 0) < min_size:
+        return response
+    if not (encoding := _negotiate(ENCODERS)):
+        return response
+
+    # never keep JSON bodies in memory, as they can hold decrypted secrets
+    max_size = 0 if is_json else app.config["SHHH_COMPRESSION_CACHE_SIZE"]
+    with profiling.phase("compress"):
+        response.set_data(
+            compression_cache.get_or_compress(response.get_data(),
+                                              encoding,
+                                              max_size))
+    response.headers.set("Content-Encoding", encoding)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # a strong ETag identifies a byte-exact representation
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def precompress_static_files(static_folder: str) -> Iterable[str]:
+    """Write precompressed variants of the static files, yield their paths.
+
+    Variants are only written when they are smaller than the original file.
+    """
+    for root, _, files in os.walk(static_folder):
+        for file in files:
+            if not file.endswith(PRECOMPRESSED_SUFFIXES):
+                continue
+            path = os.path.join(root, file)
+            with open(path, "rb") as f:
+                data = f.read()
+            for ext, compress in PRECOMPRESSED_ENCODERS.values():
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + ext, "wb") as f:
+                    f.write(compressed)
+                yield path + ext
@@ -1,9 +1,55 @@
 import logging
 import os
+from typing import TypeVar
 from urllib.parse import quote_plus
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T", int, float)
+
+
+def _get_env(name: str,
+             default: T,
+             cast: type[T],
+             minimum: T | None = None) -> T:
+    """Read and cast an environment variable, fallback to its default."""
+    try:
+        value = cast(os.environ.get(name, default))
+        if minimum is not None and value < minimum:
+            raise ValueError(f"{name} must be at least {minimum}")
+        return value
+    except (ValueError, TypeError):
+        logger.warning(
+            "Provided value for %s is not valid, using default value of %s",
+            name,
+            default)
+        return default
+
+
+def _get_choice_env(name: str, default: str | None,
+                    choices: tuple[str, ...]) -> str | None:
+    """Read an environment variable restricted to some choices, fallback to
+    its default."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    for choice in choices:
+        if value.strip().lower() == choice.lower():
+            return choice
+    logger.warning(
+        "Provided value for %s is not valid, using default value of %s",
+        name,
+        default)
+    return default
+
+
+def _get_bool_env(name: str, default: bool) -> bool:
+    """Read a boolean environment variable, fallback to its default."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 
 class DefaultConfig:
     """Default config values (dev-local)."""
@@ -21,6 +67,19 @@ class DefaultConfig:
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Flask-Assets. Bundles are built once with `flask build-static` (ex: when
+    # building the Docker image) into content hashed filenames listed in a
+    # manifest, which is the only thing read at runtime.
+    ASSETS_AUTO_BUILD = False
+    ASSETS_CACHE = False
+    ASSETS_MANIFEST = "json:dist/manifest.json"
+    ASSETS_VERSIONS = "hash"
+    ASSETS_URL_EXPIRE = False
+
+    # Serve static files with the X-Sendfile header, to let the front web
+    # server (ex: Nginx, Apache) send them efficiently.
+    USE_X_SENDFILE = _get_bool_env("SHHH_USE_X_SENDFILE", False)
+
     # Alembic
     ALEMBIC = {"path_separator": "os"}
     _db_user = quote_plus(DB_USER or '')
@@ -40,42 +99,239 @@ class DefaultConfig:
     SHHH_HOST = os.environ.get("SHHH_HOST")
 
     # Default max secret length
-    try:
-        SHHH_SECRET_MAX_LENGTH = int(
-            os.environ.get("SHHH_SECRET_MAX_LENGTH", 250))
-    except (ValueError, TypeError):
-        SHHH_SECRET_MAX_LENGTH = 250
-        logger.warning(
-            "Provided value for SHHH_SECRET_MAX_LENGTH is not "
-            "valid, using default value of %s",
-            SHHH_SECRET_MAX_LENGTH)
-
-    # Number of tries to reach the database before performing a read or write
-    # operation. It could happens that the database is not reachable or is
-    # asleep (for instance this happens often on Heroku free plans). The
-    # default retry number is 5.
-    try:
-        SHHH_DB_LIVENESS_RETRY_COUNT = int(
-            os.environ.get("SHHH_DB_LIVENESS_RETRY_COUNT", 5))
-    except (ValueError, TypeError):
-        SHHH_DB_LIVENESS_RETRY_COUNT = 5
-        logger.warning(
-            "Provided value for SHHH_DB_LIVENESS_RETRY_COUNT is not "
-            "valid, using default value of %s",
-            SHHH_DB_LIVENESS_RETRY_COUNT)
+    SHHH_SECRET_MAX_LENGTH = _get_env("SHHH_SECRET_MAX_LENGTH", 250, int)
 
-    # Sleep interval in seconds between database liveness retries. The default
-    # value is 1 second.
-    try:
+    # The database health is cached by each worker for this number of seconds
+    # after a successful liveness ping, so most read and write operations do
+    # not need to ping the database. The default value is 5 seconds.
+    SHHH_DB_LIVENESS_TTL = _get_env("SHHH_DB_LIVENESS_TTL", 5.0, float)
 
-        SHHH_DB_LIVENESS_SLEEP_INTERVAL = float(
-            os.environ.get("SHHH_DB_LIVENESS_SLEEP_INTERVAL", 1))
-    except (ValueError, TypeError):
-        SHHH_DB_LIVENESS_SLEEP_INTERVAL = 1
-        logger.warning(
-            "Provided value for SHHH_DB_LIVENESS_SLEEP_INTERVAL is not "
-            "valid, using default value of %s",
-            SHHH_DB_LIVENESS_SLEEP_INTERVAL)
+    # Number of consecutive failed pings to reach the database before the
+    # circuit opens and read or write operations fail fast. It could happens
+    # that the database is not reachable or is asleep (for instance this
+    # happens often on Heroku free plans). The default retry number is 5.
+    SHHH_DB_LIVENESS_RETRY_COUNT = _get_env("SHHH_DB_LIVENESS_RETRY_COUNT",
+                                            5,
+                                            int)
+
+    # Sleep interval in seconds between the background database liveness
+    # probes while the circuit is open. The default value is 1 second.
+    SHHH_DB_LIVENESS_SLEEP_INTERVAL = _get_env(
+        "SHHH_DB_LIVENESS_SLEEP_INTERVAL", 1.0, float)
+
+    # Database connection pool of each process: `queue` keeps up to
+    # SHHH_DB_POOL_SIZE connections open (plus SHHH_DB_MAX_OVERFLOW
+    # temporary ones under load), `null` opens a new connection for each
+    # checkout, to leave pooling to an external pooler (ex: pgbouncer in
+    # transaction mode).
+    SHHH_DB_POOL = _get_choice_env("SHHH_DB_POOL", "queue", ("queue", "null"))
+    SHHH_DB_POOL_SIZE = _get_env("SHHH_DB_POOL_SIZE", 5, int, minimum=1)
+    SHHH_DB_MAX_OVERFLOW = _get_env("SHHH_DB_MAX_OVERFLOW", 10, int, minimum=0)
+
+    # Seconds a request waits for a free connection when the pool is
+    # exhausted, before failing with a 503 and a Retry-After header.
+    SHHH_DB_POOL_TIMEOUT = _get_env("SHHH_DB_POOL_TIMEOUT",
+                                    5.0,
+                                    float,
+                                    minimum=0.0)
+
+    # Pooled connections are replaced after this number of seconds, to not
+    # reuse connections closed by the database server (ex: MySQL
+    # wait_timeout) or by a firewall. Set to -1 to never replace them.
+    SHHH_DB_POOL_RECYCLE = _get_env("SHHH_DB_POOL_RECYCLE", 1800, int)
+
+    # Whether to test pooled connections with a round trip before using
+    # them, to transparently replace the broken ones.
+    SHHH_DB_POOL_PRE_PING = _get_bool_env("SHHH_DB_POOL_PRE_PING", False)
+
+    # Seconds to wait for a new database connection to be established.
+    SHHH_DB_CONNECT_TIMEOUT = _get_env("SHHH_DB_CONNECT_TIMEOUT",
+                                       10,
+                                       int,
+                                       minimum=1)
+
+    # Transaction isolation level of the database connections, the database
+    # default is used when not set.
+    SHHH_DB_ISOLATION_LEVEL = _get_choice_env("SHHH_DB_ISOLATION_LEVEL",
+                                              None,
+                                              ("READ UNCOMMITTED",
+                                               "READ COMMITTED",
+                                               "REPEATABLE READ",
+                                               "SERIALIZABLE"))
+
+    # Key derivation algorithm of the new secrets (`pbkdf2`, `scrypt` or
+    # `argon2id`), and its parameters as `name=value` pairs separated with
+    # commas, missing ones taking their default value. Use `flask
+    # calibrate-kdf` to find parameters suited to the host. Existing secrets
+    # keep the parameters they were encrypted with.
+    SHHH_KDF_ALGORITHM = _get_choice_env("SHHH_KDF_ALGORITHM",
+                                         "pbkdf2",
+                                         ("pbkdf2", "scrypt", "argon2id"))
+    SHHH_KDF_PARAMS = os.environ.get("SHHH_KDF_PARAMS", "")
+
+    # Whether the web pages encrypt and decrypt the secrets in the browser,
+    # so the server never sees them nor their passphrases. It only stores
+    # the ciphertexts, and checks a hash of the key derived by the readers
+    # before sending them. The PBKDF2 iterations of the key derivation run in
+    # the browsers are also the minimum accepted from the API clients.
+    SHHH_CLIENT_ENCRYPTION = _get_bool_env("SHHH_CLIENT_ENCRYPTION", False)
+    SHHH_CLIENT_KDF_ITERATIONS = _get_env("SHHH_CLIENT_KDF_ITERATIONS",
+                                          600000,
+                                          int,
+                                          minimum=1)
+
+    # Key derivation runs on a bounded worker pool so a burst of
+    # requests cannot pin every web worker. The pool type can be `thread` or
+    # `process`, and setting the pool size to 0 runs the derivation inline.
+    SHHH_KDF_POOL_TYPE = _get_choice_env("SHHH_KDF_POOL_TYPE",
+                                         "thread", ("thread", "process"))
+    SHHH_KDF_POOL_SIZE = _get_env("SHHH_KDF_POOL_SIZE", 2, int)
+
+    # Maximum number of derivations allowed to wait for a free pool worker.
+    # Requests above this limit are rejected with a 503 and a Retry-After
+    # header instead of queuing.
+    SHHH_KDF_QUEUE_SIZE = _get_env("SHHH_KDF_QUEUE_SIZE", 8, int)
+
+    # Seconds a request waits to be admitted in the queue when it is full
+    # before being rejected. The default value of 0 rejects immediately.
+    SHHH_KDF_ADMISSION_TIMEOUT = _get_env("SHHH_KDF_ADMISSION_TIMEOUT",
+                                          0.0,
+                                          float)
+
+    # Expired secrets are deleted by a background job, in chunks of this
+    # number of rows, for at most SHHH_REAPER_MAX_RUNTIME seconds per run.
+    SHHH_REAPER_CHUNK_SIZE = _get_env("SHHH_REAPER_CHUNK_SIZE", 1000, int)
+    SHHH_REAPER_MAX_RUNTIME = _get_env("SHHH_REAPER_MAX_RUNTIME", 10.0, float)
+
+    # Interval in seconds between runs of the expired secrets job. The job
+    # runs more often (down to the min interval) while a backlog remains, and
+    # backs off (up to the max interval) when there is nothing to delete.
+    SHHH_REAPER_INTERVAL = _get_env("SHHH_REAPER_INTERVAL", 60.0, float)
+    SHHH_REAPER_MIN_INTERVAL = _get_env("SHHH_REAPER_MIN_INTERVAL", 5.0, float)
+    SHHH_REAPER_MAX_INTERVAL = _get_env("SHHH_REAPER_MAX_INTERVAL",
+                                        300.0,
+                                        float)
+
+    # Whether the application process runs the scheduled jobs. Set it to false
+    # on the web workers when running the scheduler as its own process with
+    # `flask run-scheduler`.
+    SHHH_SCHEDULER_ENABLED = _get_bool_env("SHHH_SCHEDULER_ENABLED", True)
+
+    # Only the holder of a lease stored in the database runs the scheduled
+    # jobs, across all the workers and nodes. The leader renews it on each
+    # run, if it dies another node takes over once the lease has expired
+    # (in seconds). It is raised to at least a minute above the longest job
+    # interval (SHHH_REAPER_MAX_INTERVAL, or 600 seconds for the partitions
+    # maintenance), so a live leader keeps its lease between two runs.
+    SHHH_SCHEDULER_LEASE_TTL = _get_env("SHHH_SCHEDULER_LEASE_TTL",
+                                        900.0,
+                                        float)
+
+    # Responses are compressed with the best encoding accepted by the client
+    # (brotli and zstd are used when the `brotli` and `zstandard` packages are
+    # installed, gzip otherwise) when larger than this number of bytes.
+    SHHH_COMPRESSION_MIN_SIZE = _get_env("SHHH_COMPRESSION_MIN_SIZE", 500, int)
+
+    # Number of compressed pages kept in memory by each worker, so identical
+    # pages are only compressed once. Set to 0 to disable the cache.
+    SHHH_COMPRESSION_CACHE_SIZE = _get_env("SHHH_COMPRESSION_CACHE_SIZE",
+                                           64,
+                                           int)
+
+    # Whether to compress JSON API responses. They are never cached.
+    SHHH_COMPRESS_JSON = _get_bool_env("SHHH_COMPRESS_JSON", False)
+
+    # Value in seconds of the Retry-After header sent on 503 responses.
+    SHHH_RETRY_AFTER = _get_env("SHHH_RETRY_AFTER", 1, int)
+
+    # Maximum number of secrets created by a single bulk request.
+    SHHH_BULK_MAX_SECRETS = _get_env("SHHH_BULK_MAX_SECRETS", 1000, int)
+
+    # Database URI used by the async API handlers in the ASGI mode. Defaults
+    # to SQLALCHEMY_DATABASE_URI, with its driver swapped for an async one.
+    SHHH_ASYNC_DATABASE_URI = os.environ.get("SHHH_ASYNC_DATABASE_URI")
+
+    # How inline scripts are allowed by the Content Security Policy. With
+    # `hash`, pages do not depend on the request, so they are rendered once,
+    # cached in memory and served with an ETag. With `nonce`, a new nonce is
+    # generated and pages are rendered on each request.
+    SHHH_CSP_MODE = _get_choice_env("SHHH_CSP_MODE", "hash", ("hash", "nonce"))
+
+    # Where the secrets are stored: `sql` (the database), or a key-value
+    # store expiring the secrets on its own, `redis` or `memory` (local to
+    # the process, for tests and single process deployments).
+    SHHH_STORAGE = _get_choice_env("SHHH_STORAGE",
+                                   "sql", ("sql", "redis", "memory"))
+    SHHH_REDIS_URL = os.environ.get("SHHH_REDIS_URL")
+
+    # Files, or secrets larger than SHHH_SECRET_MAX_LENGTH, up to this number
+    # of bytes can be shared with the `/api/file` endpoint. Their content is
+    # encrypted in chunks while streamed to a blob store: `file` (a directory,
+    # SHHH_BLOB_PATH, defaults to the `blobs` directory of the instance
+    # folder) or `memory` (local to the process, for tests and single process
+    # deployments).
+    SHHH_FILE_MAX_SIZE = _get_env("SHHH_FILE_MAX_SIZE", 10485760, int)
+    SHHH_BLOB_STORE = _get_choice_env("SHHH_BLOB_STORE",
+                                      "file", ("file", "memory"))
+    SHHH_BLOB_PATH = os.environ.get("SHHH_BLOB_PATH")
+
+    # Number of identifiers of secrets known to be gone (read, deleted or
+    # expired) cached by each worker, so the reads of their links are
+    # answered without querying the database. Set to 0 to disable the cache.
+    SHHH_GONE_CACHE_SIZE = _get_env("SHHH_GONE_CACHE_SIZE", 10000, int)
+
+    # With the `sql` storage on PostgreSQL, partition the secret table per
+    # `hour` or per `day` of the expiry date of the secrets, and expire them
+    # by dropping whole partitions instead of deleting rows. The table is
+    # converted by the `flask partition-table` command.
+    SHHH_PARTITION_INTERVAL = _get_choice_env("SHHH_PARTITION_INTERVAL",
+                                              None, ("hour", "day"))
+
+    # API requests are rate limited with token buckets, before any key
+    # derivation, as `<count>/<period>` (period being `second`, `minute`,
+    # `hour` or `day`): reads per client and per secret, and writes per
+    # client (each secret of a bulk request counting as one write, bulk
+    # requests of more secrets than the write limit being refused). Off by
+    # default, as clients behind a reverse proxy would all share the limits
+    # of its address until SHHH_TRUSTED_PROXIES is set.
+    SHHH_RATELIMIT_ENABLED = _get_bool_env("SHHH_RATELIMIT_ENABLED", False)
+    SHHH_RATELIMIT_READ = os.environ.get("SHHH_RATELIMIT_READ", "30/minute")
+    SHHH_RATELIMIT_SECRET = os.environ.get("SHHH_RATELIMIT_SECRET",
+                                           "10/minute")
+    SHHH_RATELIMIT_WRITE = os.environ.get("SHHH_RATELIMIT_WRITE", "30/minute")
+
+    # Where the rate limits are counted: `shared` by the processes of the
+    # node, in a file mapped in memory (SHHH_RATELIMIT_PATH, defaults to
+    # `shhh-ratelimit` in the temporary directory), `memory` (local to the
+    # process) or `redis` (shared by the nodes, using SHHH_REDIS_URL).
+    SHHH_RATELIMIT_STORE = _get_choice_env("SHHH_RATELIMIT_STORE",
+                                           "shared",
+                                           ("shared", "memory", "redis"))
+    SHHH_RATELIMIT_PATH = os.environ.get("SHHH_RATELIMIT_PATH")
+
+    # Number of reverse proxies in front of the application, the clients
+    # being then identified by the address their proxies forwarded in the
+    # X-Forwarded-For header.
+    SHHH_TRUSTED_PROXIES = _get_env("SHHH_TRUSTED_PROXIES", 0, int, minimum=0)
+
+    # Whether to expose Prometheus metrics on `/metrics`. Off by default, as
+    # they reveal the activity of the instance, and the endpoint should then
+    # be protected with a token (or only be reachable by the scrapers).
+    SHHH_METRICS_ENABLED = _get_bool_env("SHHH_METRICS_ENABLED", False)
+    # Bearer token the scrapers must send to get the metrics, if set.
+    SHHH_METRICS_TOKEN = os.environ.get("SHHH_METRICS_TOKEN")
+
+    # Whether to send the duration of each phase of the requests in a
+    # Server-Timing header.
+    SHHH_SERVER_TIMING = _get_bool_env("SHHH_SERVER_TIMING", False)
+
+    # Directory where request profiles are written, profiling is disabled
+    # when not set. Requests are profiled at random with a probability of
+    # SHHH_PROFILING_RATE, or on demand, when sent with a header signed with
+    # SHHH_PROFILING_KEY.
+    SHHH_PROFILING_DIR = os.environ.get("SHHH_PROFILING_DIR")
+    SHHH_PROFILING_RATE = _get_env("SHHH_PROFILING_RATE", 0.0, float)
+    SHHH_PROFILING_KEY = os.environ.get("SHHH_PROFILING_KEY")
 
 
 class TestConfig(DefaultConfig):
@@ -86,10 +342,17 @@ class TestConfig(DefaultConfig):
 
     SQLALCHEMY_DATABASE_URI = "sqlite://"  # in memory
 
+    ASSETS_AUTO_BUILD = True
+
     SHHH_HOST = "http://test.test"
     SHHH_SECRET_MAX_LENGTH = 20
     SHHH_DB_LIVENESS_RETRY_COUNT = 1
     SHHH_DB_LIVENESS_SLEEP_INTERVAL = 0.1
+    SHHH_RATELIMIT_ENABLED = False
+    SHHH_RATELIMIT_STORE = "memory"
+    SHHH_METRICS_ENABLED = True
+    SHHH_METRICS_TOKEN = None
+    SHHH_BLOB_STORE = "memory"
 
 
 class DevelopmentConfig(DefaultConfig):
@@ -97,6 +360,8 @@ class DevelopmentConfig(DefaultConfig):
 
     SQLALCHEMY_ECHO = False
 
+    ASSETS_AUTO_BUILD = True
+
 
 class ProductionConfig(DefaultConfig):
     """Production configuration (production)."""
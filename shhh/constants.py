@@ -28,6 +28,7 @@ class EnvConfig(StrEnum):
 class Status(StrEnum):
     CREATED = "created"
     SUCCESS = "success"
+    FOUND = "found"
     EXPIRED = "expired"
     INVALID = "invalid"
     ERROR = "error"
@@ -42,3 +43,8 @@ class Message(StrEnum):
                "remaining: {remaining}")
     CREATED = "Secret successfully created."
     UNEXPECTED = "An unexpected error has occurred, please try again."
+    BUSY = "The service is busy, please try again in a moment."
+    THROTTLED = "Too many requests, please try again later."
+    WRONG_ENDPOINT = "This secret can't be read here, use {endpoint}."
+    LIMIT_EXCEEDED = ("Sorry, no more than {count} secrets can be created "
+                      "at once.")
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from typing import Callable, TypeVar
+
+    from flask import Flask
+
+    RT = TypeVar("RT")
+    T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 32
+
+
+# Derivation functions are module level functions, so they can be pickled to
+# a process pool.
+def _pbkdf2_sha256(passphrase: bytes, salt: bytes, iterations: int) -> bytes:
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
+                     length=KEY_SIZE,
+                     salt=salt,
+                     iterations=iterations)
+    return kdf.derive(passphrase)
+
+
+def _scrypt(passphrase: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return Scrypt(salt=salt, length=KEY_SIZE, n=n, r=r, p=p).derive(passphrase)
+
+
+def _argon2id(passphrase: bytes,
+              salt: bytes,
+              iterations: int,
+              memory_cost: int,
+              lanes: int) -> bytes:
+    kdf = Argon2id(salt=salt,
+                   length=KEY_SIZE,
+                   iterations=iterations,
+                   lanes=lanes,
+                   memory_cost=memory_cost)
+    return kdf.derive(passphrase)
+
+
+@dataclass(frozen=True)
+class KdfAlgorithm:
+    """Key derivation algorithm, and the default values of its parameters,
+    in the order of the arguments of its function."""
+    id: int
+    func: Callable[..., bytes]
+    defaults: dict[str, int]
+
+
+KDF_ALGORITHMS = {
+    "pbkdf2":
+        KdfAlgorithm(1, _pbkdf2_sha256, {"iterations": 100_000}),
+    "scrypt":
+        KdfAlgorithm(2, _scrypt, {
+            "n": 2**15, "r": 8, "p": 1
+        }),
+    "argon2id":
+        KdfAlgorithm(3,
+                     _argon2id, {
+                         "iterations": 3, "memory_cost": 65536, "lanes": 4
+                     }),
+}
+
+# parameters are stored on 4 bytes with each secret
+MAX_PARAM_VALUE = 2**32 - 1
+
+
+class KdfError(RuntimeError):
+    """Raised for unsupported key derivation algorithms or parameters."""
+
+
+@dataclass(frozen=True)
+class KdfParams:
+    """Key derivation algorithm and work factors, stored with each secret
+    so it can be decrypted after they change."""
+    algorithm: str
+    params: tuple[int, ...]
+
+    @classmethod
+    def parse(cls, algorithm: str, params: str = "") -> KdfParams:
+        """Parse parameters given as `name=value` pairs, separated with
+        commas. Missing parameters get their default value."""
+        if algorithm not in KDF_ALGORITHMS:
+            raise KdfError(f"KDF {algorithm=} is not supported")
+        values = dict(KDF_ALGORITHMS[algorithm].defaults)
+        for pair in filter(None, (p.strip() for p in params.split(","))):
+            name, _, value = pair.partition("=")
+            # isdigit alone accepts other digits than 0-9, like "²"
+            if (name not in values or not value.isascii()
+                    or not value.isdigit()
+                    or not 0 < int(value) <= MAX_PARAM_VALUE):
+                raise KdfError(f"Invalid {algorithm} parameter {pair!r}")
+            values[name] = int(value)
+        return cls(algorithm, tuple(values.values()))
+
+    def __str__(self) -> str:
+        names = KDF_ALGORITHMS[self.algorithm].defaults
+        return ",".join(
+            f"{name}={value}" for name, value in zip(names, self.params))
+
+    def to_bytes(self) -> bytes:
+        return bytes([KDF_ALGORITHMS[self.algorithm].id]) + b"".join(
+            param.to_bytes(4, "big") for param in self.params)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> tuple[KdfParams, int]:
+        """Read the parameters at the start of `data`, return them with
+        their encoded size."""
+        for algorithm, spec in KDF_ALGORITHMS.items():
+            if spec.id == data[0]:
+                size = 1 + 4 * len(spec.defaults)
+                params = tuple(
+                    int.from_bytes(data[i:i + 4], "big")
+                    for i in range(1, size, 4))
+                return cls(algorithm, params), size
+        raise KdfError(f"Unknown KDF id {data[0]}")
+
+    def derive(self, passphrase: bytes, salt: bytes) -> bytes:
+        return KDF_ALGORITHMS[self.algorithm].func(passphrase,
+                                                   salt,
+                                                   *self.params)
+
+
+def calibrate(algorithm: str,
+              target: float,
+              memory_cost: int | None = None) -> tuple[KdfParams, float]:
+    """Find work factors of `algorithm` with a derivation time close to
+    `target` seconds on this host, return them with their derivation time.
+
+    The time cost (iterations) of PBKDF2 and Argon2id is scaled to the
+    target, with the Argon2id memory cost set to `memory_cost` (in KiB).
+    For scrypt, n is doubled until the target is reached.
+    """
+    salt = os.urandom(16)
+
+    def measure(kdf: KdfParams) -> float:
+        started = time.perf_counter()
+        kdf.derive(b"calibration", salt)
+        return time.perf_counter() - started
+
+    defaults = KDF_ALGORITHMS[algorithm].defaults
+    if algorithm == "scrypt":
+        kdf = KdfParams.parse(algorithm, "n=1024")
+        elapsed = measure(kdf)
+        while elapsed < target:
+            candidate = KdfParams(algorithm,
+                                  (kdf.params[0] * 2, ) + kdf.params[1:])
+            candidate_elapsed = measure(candidate)
+            if candidate_elapsed - target > target - elapsed:
+                # closer to the target with the previous value
+                break
+            kdf, elapsed = candidate, candidate_elapsed
+        return kdf, elapsed
+
+    if algorithm == "argon2id":
+        memory_cost = memory_cost or defaults["memory_cost"]
+        kdf = KdfParams.parse(algorithm,
+                              f"iterations=1,memory_cost={memory_cost}")
+    else:
+        kdf = KdfParams.parse(algorithm, "iterations=10000")
+    # time costs are linear, measure the smallest one and scale it
+    base = min(measure(kdf) for _ in range(3))
+    iterations = max(round(kdf.params[0] * target / base), 1)
+    kdf = KdfParams(algorithm, (iterations, ) + kdf.params[1:])
+    return kdf, measure(kdf)
+
+
+class KdfPoolBusy(Exception):
+    """Raised when the key derivation pool cannot admit more work."""
+
+
+@dataclass(frozen=True)
+class KdfTiming:
+    """Time spent waiting for a pool worker, and deriving the key."""
+    queue_wait: float
+    duration: float
+
+
+# Timing of the last key derivation performed in the current context, so
+# callers (request handlers) can report it without threading it through the
+# domain model.
+last_kdf_timing: ContextVar[KdfTiming | None] = ContextVar("last_kdf_timing",
+                                                           default=None)
+
+
+def _timed_call(func: Callable[..., RT], *args) -> tuple[RT, float, float]:
+    # time.monotonic is system-wide, so it can be compared across processes
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic()
+
+
+class KdfPool:
+    """Bounded worker pool running key derivations, with the algorithm and
+    parameters used for the new secrets.
+
+    Admission is limited to `size + queue_size` derivations in flight. When
+    the pool is saturated, `run` raises `KdfPoolBusy` so callers can shed
+    load quickly instead of letting latency build up. When the pool is not
+    configured (or has a size of 0), derivations run inline.
+    """
+
+    def __init__(self) -> None:
+        self._executor_cls: Callable[..., Executor] | None = None
+        self._executor: Executor | None = None
+        self._executor_pid: int | None = None
+        # threads of the callers running many derivations at once
+        self._callers: ThreadPoolExecutor | None = None
+        self._callers_pid: int | None = None
+        self._slots: threading.BoundedSemaphore | None = None
+        self._size = 0
+        self._admission_timeout = 0.0
+        self._lock = threading.Lock()
+        # parameters of the derivations of the new secrets
+        self.params = KdfParams.parse("pbkdf2")
+        # called with the timing of each derivation (ex: to record metrics)
+        self.on_timing: Callable[[KdfTiming], None] | None = None
+
+    def init_app(self, app: Flask) -> None:
+        algorithm = app.config["SHHH_KDF_ALGORITHM"]
+        try:
+            self.params = KdfParams.parse(algorithm,
+                                          app.config["SHHH_KDF_PARAMS"])
+        except KdfError as exc:
+            logger.warning("%s, using the default parameters of %s",
+                           exc,
+                           algorithm)
+            self.params = KdfParams.parse(algorithm)
+        self.configure(
+            pool_type=app.config["SHHH_KDF_POOL_TYPE"],
+            size=app.config["SHHH_KDF_POOL_SIZE"],
+            queue_size=app.config["SHHH_KDF_QUEUE_SIZE"],
+            admission_timeout=app.config["SHHH_KDF_ADMISSION_TIMEOUT"])
+
+    def configure(self,
+                  pool_type: str,
+                  size: int,
+                  queue_size: int,
+                  admission_timeout: float = 0.0) -> None:
+        executors: dict[str, Callable[..., Executor]] = {
+            "thread": ThreadPoolExecutor, "process": ProcessPoolExecutor,
+        }
+        if pool_type not in executors:
+            raise RuntimeError(f"KDF pool type {pool_type=} is not supported")
+
+        self.shutdown()
+        if size <= 0:
+            return
+
+        self._executor_cls = executors[pool_type]
+        self._size = size
+        self._slots = threading.BoundedSemaphore(size + max(queue_size, 0))
+        self._admission_timeout = admission_timeout
+        logger.info("KDF %s pool configured with %s workers and a queue of %s",
+                    pool_type,
+                    size,
+                    queue_size)
+
+    @property
+    def size(self) -> int:
+        """Number of workers, 0 when derivations run inline."""
+        return self._size
+
+    def shutdown(self) -> None:
+        pid = os.getpid()
+        if self._executor is not None and self._executor_pid == pid:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._callers is not None and self._callers_pid == pid:
+            self._callers.shutdown(wait=False, cancel_futures=True)
+        self._executor_cls = None
+        self._executor = None
+        self._callers = None
+        self._executor_pid = None
+        self._slots = None
+        self._size = 0
+
+    def _get_executor(self, executor_cls: Callable[..., Executor]) -> Executor:
+        # The executor is started lazily, and restarted when used from a
+        # forked process (ex: Gunicorn workers with --preload), as its
+        # threads or processes do not survive a fork.
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = executor_cls(max_workers=self._size)
+                self._executor_pid = pid
+            return self._executor
+
+    def _get_callers(self) -> ThreadPoolExecutor:
+        # started lazily and restarted after a fork, as the executor
+        pid = os.getpid()
+        with self._lock:
+            if self._callers is None or self._callers_pid != pid:
+                self._callers = ThreadPoolExecutor(max_workers=self._size)
+                self._callers_pid = pid
+            return self._callers
+
+    def warm_up(self) -> None:
+        """Start the workers, rather than on the first derivations."""
+        if (executor_cls := self._executor_cls) is None:
+            return
+        executor = self._get_executor(executor_cls)
+        # each call keeps a worker busy long enough for the next ones to be
+        # given to other workers
+        futures = [
+            executor.submit(time.sleep, 0.01) for _ in range(self._size)
+        ]
+        for future in futures:
+            future.result()
+
+    def run(self, func: Callable[..., RT], *args) -> RT:
+        """Run `func` on the pool and wait for its result."""
+        submitted = time.monotonic()
+        executor_cls, slots = self._executor_cls, self._slots
+        if executor_cls is None or slots is None:
+            result, started, finished = _timed_call(func, *args)
+        else:
+            self._admit(slots)
+            try:
+                executor = self._get_executor(executor_cls)
+                result, started, finished = executor.submit(
+                    _timed_call, func, *args).result()
+            finally:
+                slots.release()
+        timing = KdfTiming(queue_wait=max(started - submitted, 0.0),
+                           duration=finished - started)
+        last_kdf_timing.set(timing)
+        if self.on_timing is not None:
+            self.on_timing(timing)
+        return result
+
+    def map(self, func: Callable[[T], RT], items: list[T]) -> list[RT]:
+        """Call `func`, running derivations on the pool, for each item.
+
+        The calls are made in parallel, up to the size of the pool, from
+        threads shared by all the callers. If a call fails, the calls not
+        started yet are cancelled and its exception is raised.
+        """
+        if len(items) <= 1 or self._size <= 1:
+            return [func(item) for item in items]
+
+        futures = [self._get_callers().submit(func, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _admit(self, slots: threading.BoundedSemaphore) -> None:
+        if self._admission_timeout > 0:
+            admitted = slots.acquire(timeout=self._admission_timeout)
+        else:
+            admitted = slots.acquire(blocking=False)
+        if not admitted:
+            raise KdfPoolBusy("Key derivation pool is saturated")
+
+
+kdf_pool = KdfPool()
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
 import secrets
 from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, timedelta, timezone
@@ -7,15 +9,53 @@ from typing import TYPE_CHECKING
 
 from sqlalchemy.ext.hybrid import hybrid_method
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 from shhh.constants import DEFAULT_READ_TRIES_VALUE
+from shhh.domain.kdf import KdfParams, kdf_pool
+from shhh.domain.stream import CHUNK_SIZE, NONCE_PREFIX_SIZE, StreamCipher
 
 if TYPE_CHECKING:
     from typing import Self
 
+# Binary format of the encrypted secrets, stored as is:
+# version (1 byte) | KDF id (1) and parameters (4 each) | salt (16) |
+# nonce (12) | AES-GCM ciphertext and tag. The header, up to the nonce, is
+# authenticated with the ciphertext.
+# The v2 format only supported PBKDF2, with its iterations (4) as parameters.
+# Legacy secrets are base64 encoded, so never start with a version byte:
+# base64(salt (16) | iterations (4) | Fernet token without its base64).
+# Secrets encrypted by the clients (v4) are opaque to the server, which only
+# keeps the parameters of the key derivation run by the clients, and the
+# SHA-256 of the key proving the passphrase is known: version (1) | KDF id
+# (1) and parameters (4 each) | salt (16) | verifier (32) | ciphertext.
+# Large secrets (v5) are encrypted in chunks stored in a blob (see
+# `shhh.domain.stream`), the secret keeping their header and their name:
+# version (1) | KDF id (1) and parameters (4 each) | salt (16) | nonce prefix
+# (7) | chunk size (4) | nonce (12) | AES-GCM encrypted name and tag.
+FORMAT_V2 = 2
+FORMAT_V3 = 3
+FORMAT_CLIENT = 4
+FORMAT_STREAM = 5
+SALT_SIZE = 16
+NONCE_SIZE = 12
+VERIFIER_SIZE = 32
+# random bytes of the external identifiers, URL-safe base64 encoded in links
+EXTERNAL_ID_SIZE = 15
+
+
+def _read_header(data: bytes) -> tuple[KdfParams, bytes, int]:
+    """Return the KDF parameters and salt of an encrypted secret, with the
+    size of its header."""
+    if data[0] == FORMAT_V2:
+        iterations = int.from_bytes(data[1:5], "big")
+        kdf, size = KdfParams("pbkdf2", (iterations, )), 4
+    else:
+        kdf, size = KdfParams.from_bytes(data[1:])
+    return kdf, data[1 + size:1 + size + SALT_SIZE], 1 + size + SALT_SIZE
+
 
 class Secret:
     """Domain model for secrets."""
@@ -36,13 +76,13 @@ class Secret:
         return f"<Secret {self.external_id} (expires: {self.date_expires})>"
 
     @staticmethod
-    def _derive_key(passphrase: str, salt: bytes, iterations: int) -> bytes:
-        """Derive a secret key from a given passphrase and salt."""
-        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
-                         length=32,
-                         salt=salt,
-                         iterations=iterations)
-        return urlsafe_b64encode(kdf.derive(passphrase.encode()))
+    def _derive_key(passphrase: str, salt: bytes, kdf: KdfParams) -> bytes:
+        """Derive a secret key from a given passphrase and salt.
+
+        The derivation runs on the KDF pool, which raises `KdfPoolBusy` if
+        it cannot accept more work.
+        """
+        return kdf_pool.run(kdf.derive, passphrase.encode(), salt)
 
     @staticmethod
     def _set_expiry_date(from_date: datetime, expire: str) -> datetime:
@@ -56,36 +96,158 @@ class Secret:
         raise RuntimeError(f"Could not set expiry date for code {expire}")
 
     @classmethod
-    def encrypt(cls,
-                message: str,
-                passphrase: str,
-                expire_code: str,
-                tries: int = DEFAULT_READ_TRIES_VALUE,
-                iterations: int = 100_000) -> Self:
-        salt = secrets.token_bytes(16)
-        key = cls._derive_key(passphrase, salt, iterations)
-        encrypted_text = urlsafe_b64encode(
-            b"%b%b%b" %
-            (salt,
-             iterations.to_bytes(4, "big"),
-             urlsafe_b64decode(Fernet(key).encrypt(message.encode()))))
+    def _create(cls, encrypted_text: bytes, expire_code: str,
+                tries: int) -> Self:
         now = datetime.now(timezone.utc)
         return cls(encrypted_text=encrypted_text,
                    date_created=now,
                    date_expires=cls._set_expiry_date(from_date=now,
                                                      expire=expire_code),
-                   external_id=secrets.token_urlsafe(15),
+                   external_id=secrets.token_urlsafe(EXTERNAL_ID_SIZE),
                    tries=tries)
 
+    @classmethod
+    def encrypt(cls,
+                message: str,
+                passphrase: str,
+                expire_code: str,
+                tries: int = DEFAULT_READ_TRIES_VALUE,
+                kdf: KdfParams | None = None) -> Self:
+        """Encrypt the message, with a key derived from the passphrase with
+        `kdf`, or the KDF configured on the pool."""
+        kdf = kdf or kdf_pool.params
+        salt = secrets.token_bytes(SALT_SIZE)
+        key = cls._derive_key(passphrase, salt, kdf)
+        header = b"%c%b%b" % (FORMAT_V3, kdf.to_bytes(), salt)
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        encrypted_text = b"%b%b%b" % (header,
+                                      nonce,
+                                      AESGCM(key).encrypt(
+                                          nonce, message.encode(), header))
+        return cls._create(encrypted_text, expire_code, tries)
+
+    @classmethod
+    def from_client(cls,
+                    ciphertext: bytes,
+                    salt: bytes,
+                    iterations: int,
+                    verifier: bytes,
+                    expire_code: str,
+                    tries: int = DEFAULT_READ_TRIES_VALUE) -> Self:
+        """Store a secret encrypted by the client, with a key derived with
+        PBKDF2 from the passphrase and salt. It is opened with the key whose
+        SHA-256 is `verifier`."""
+        kdf = KdfParams("pbkdf2", (iterations, ))
+        encrypted_text = b"%c%b%b%b%b" % (
+            FORMAT_CLIENT, kdf.to_bytes(), salt, verifier, ciphertext)
+        return cls._create(encrypted_text, expire_code, tries)
+
+    @classmethod
+    def encrypt_stream(
+            cls,
+            name: str,
+            passphrase: str,
+            expire_code: str,
+            tries: int = DEFAULT_READ_TRIES_VALUE,
+            kdf: KdfParams | None = None) -> tuple[Self, StreamCipher]:
+        """Create a large secret named `name`, return it with the cipher
+        encrypting its content."""
+        kdf = kdf or kdf_pool.params
+        salt = secrets.token_bytes(SALT_SIZE)
+        key = cls._derive_key(passphrase, salt, kdf)
+        nonce_prefix = secrets.token_bytes(NONCE_PREFIX_SIZE)
+        header = b"%c%b%b%b%b" % (FORMAT_STREAM,
+                                  kdf.to_bytes(),
+                                  salt,
+                                  nonce_prefix,
+                                  CHUNK_SIZE.to_bytes(4, "big"))
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        encrypted_text = b"%b%b%b" % (
+            header, nonce, AESGCM(key).encrypt(nonce, name.encode(), header))
+        return (cls._create(encrypted_text, expire_code, tries),
+                StreamCipher(key, header, nonce_prefix))
+
+    @property
+    def streamed(self) -> bool:
+        return self.encrypted_text[0] == FORMAT_STREAM
+
+    def decrypt_stream(self, passphrase: str) -> tuple[str, StreamCipher]:
+        """Return the name of a large secret, with the cipher decrypting
+        its content. Raise `InvalidToken` if the passphrase is wrong."""
+        data = self.encrypted_text
+        if data[0] != FORMAT_STREAM:
+            raise InvalidToken
+        kdf, salt, size = _read_header(data)
+        nonce_prefix = data[size:size + NONCE_PREFIX_SIZE]
+        size += NONCE_PREFIX_SIZE
+        chunk_size = int.from_bytes(data[size:size + 4], "big")
+        header = data[:size + 4]
+        key = self._derive_key(passphrase, salt, kdf)
+        nonce = data[size + 4:size + 4 + NONCE_SIZE]
+        try:
+            name = AESGCM(key).decrypt(nonce,
+                                       data[size + 4 + NONCE_SIZE:],
+                                       header)
+        except InvalidTag as exc:
+            raise InvalidToken from exc
+        return (name.decode("utf-8"),
+                StreamCipher(key, header, nonce_prefix, chunk_size))
+
+    @property
+    def client_encrypted(self) -> bool:
+        return self.encrypted_text[0] == FORMAT_CLIENT
+
+    def client_kdf(self) -> tuple[KdfParams, bytes]:
+        """Return the KDF parameters and salt of a secret encrypted by the
+        client."""
+        kdf, salt, _ = _read_header(self.encrypted_text)
+        return kdf, salt
+
+    def open(self, proof: bytes) -> bytes:
+        """Return the ciphertext of a secret encrypted by the client, raise
+        `InvalidToken` if the SHA-256 of `proof` is not its verifier."""
+        data = self.encrypted_text
+        if data[0] != FORMAT_CLIENT:
+            raise InvalidToken
+        _, _, header_size = _read_header(data)
+        verifier = data[header_size:header_size + VERIFIER_SIZE]
+        if not hmac.compare_digest(hashlib.sha256(proof).digest(), verifier):
+            raise InvalidToken
+        return data[header_size + VERIFIER_SIZE:]
+
     def decrypt(self, passphrase: str) -> str:
+        """Decrypt the secret, raise `InvalidToken` if the passphrase is
+        wrong."""
+        data = self.encrypted_text
+        if data[0] == FORMAT_CLIENT:
+            # only the client knows the key
+            raise InvalidToken
+        if data[0] == FORMAT_STREAM:
+            # the content is in a blob, see `decrypt_stream`
+            raise InvalidToken
+        if data[0] not in (FORMAT_V2, FORMAT_V3):
+            return self._decrypt_legacy(passphrase)
+
+        kdf, salt, header_size = _read_header(data)
+        key = self._derive_key(passphrase, salt, kdf)
+        nonce = data[header_size:header_size + NONCE_SIZE]
+        try:
+            message = AESGCM(key).decrypt(nonce,
+                                          data[header_size + NONCE_SIZE:],
+                                          data[:header_size])
+        except InvalidTag as exc:
+            raise InvalidToken from exc
+        return message.decode("utf-8")
+
+    def _decrypt_legacy(self, passphrase: str) -> str:
         decoded = urlsafe_b64decode(self.encrypted_text)
         salt, iteration, message = (
             decoded[:16],
             decoded[16:20],
             urlsafe_b64encode(decoded[20:]),
         )
-        iterations = int.from_bytes(iteration, "big")
-        key = self._derive_key(passphrase, salt, iterations)
+        kdf = KdfParams("pbkdf2", (int.from_bytes(iteration, "big"), ))
+        key = urlsafe_b64encode(self._derive_key(passphrase, salt, kdf))
         return Fernet(key).decrypt(message).decode("utf-8")
 
     @property
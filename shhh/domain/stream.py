@@ -0,0 +1,89 @@
+"""Encryption of large secrets in chunks, with bounded memory.
+
+The payload is split in chunks of `chunk_size` bytes, each encrypted with
+AES-GCM under a nonce made of a random prefix, the index of the chunk and
+whether it is the last one (the STREAM construction). Chunks can't be
+reordered, dropped or truncated without failing authentication. The header
+of the secret is authenticated with each chunk.
+
+Only a chunk (two when decrypting, to find the last one) is held in memory
+at once, whatever the size of the payload.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+
+def _read_exactly(read: Callable[[int], bytes], size: int) -> bytes:
+    """Read `size` bytes, or less at the end of the data."""
+    data = bytearray()
+    while len(data) < size and (piece := read(size - len(data))):
+        data += piece
+    return bytes(data)
+
+
+class StreamCipher:
+
+    def __init__(self,
+                 key: bytes,
+                 header: bytes,
+                 nonce_prefix: bytes,
+                 chunk_size: int = CHUNK_SIZE) -> None:
+        self._aesgcm = AESGCM(key)
+        self.header = header
+        self.nonce_prefix = nonce_prefix
+        self.chunk_size = chunk_size
+
+    def _nonce(self, index: int, last: bool) -> bytes:
+        return b"%b%b%c" % (self.nonce_prefix, index.to_bytes(4, "big"), last)
+
+    def encrypt(self, data: Iterable[bytes]) -> Iterator[bytes]:
+        """Encrypt data given in pieces of any size, yield the encrypted
+        chunks."""
+        buffer = bytearray()
+        index = 0
+        for piece in data:
+            buffer += piece
+            # keep the last chunk until the end of the data is known
+            while len(buffer) > self.chunk_size:
+                yield self._aesgcm.encrypt(self._nonce(index, False),
+                                           bytes(buffer[:self.chunk_size]),
+                                           self.header)
+                del buffer[:self.chunk_size]
+                index += 1
+        yield self._aesgcm.encrypt(self._nonce(index, True),
+                                   bytes(buffer),
+                                   self.header)
+
+    def decrypt(self, read: Callable[[int], bytes]) -> Iterator[bytes]:
+        """Decrypt the chunks read with `read`, yield the decrypted chunks.
+        Raise `InvalidToken` once a chunk is not authentic."""
+        size = self.chunk_size + TAG_SIZE
+        chunk = _read_exactly(read, size)
+        index = 0
+        while True:
+            # a full chunk may be followed by others
+            following = b""
+            if len(chunk) == size:
+                following = _read_exactly(read, size)
+            try:
+                yield self._aesgcm.decrypt(self._nonce(index, not following),
+                                           chunk,
+                                           self.header)
+            except InvalidTag as exc:
+                raise InvalidToken from exc
+            if not following:
+                return
+            chunk = following
+            index += 1
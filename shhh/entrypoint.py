@@ -1,29 +1,43 @@
 from __future__ import annotations
 
-import gzip
+import base64
+import hashlib
 import logging
 import secrets
 from http import HTTPStatus
-from io import BytesIO
 from typing import TYPE_CHECKING
 
-from flask import Flask, Response, render_template as rt, g, request
-from flask_alembic import Alembic
+from flask import Flask, Response, current_app, g, request
 from flask_assets import Bundle
 
-from shhh import __version__, config
-from shhh.adapters import orm
+from shhh import (__version__,
+                  cli,
+                  config,
+                  metrics,
+                  profiling,
+                  ratelimit,
+                  startup)
+from shhh.adapters import blobs, engine, orm, repository
+from shhh.adapters.gone_cache import gone_cache
 from shhh.api.api import api
+from shhh.compression import compress_response
 from shhh.constants import EnvConfig
+from shhh.domain.kdf import kdf_pool
 from shhh.extensions import assets, db, scheduler
-from shhh.scheduler import tasks
+from shhh.scheduler import start_scheduler
 from shhh.web import web
+from shhh.web.pages import render_page
 
 if TYPE_CHECKING:
-    from flask_apscheduler import APScheduler
     from flask_assets import Environment
     from werkzeug.exceptions import NotFound, InternalServerError
 
+# Inline scripts allowed by the Content Security Policy in `hash` mode.
+INLINE_SCRIPTS = ("feather.replace();", )
+INLINE_SCRIPT_HASHES = " ".join("'sha256-{}'".format(
+    base64.b64encode(hashlib.sha256(script.encode()).digest()).decode())
+                                for script in INLINE_SCRIPTS)
+
 
 def create_app(env: EnvConfig) -> Flask:
     """Application factory."""
@@ -34,25 +48,38 @@ def create_app(env: EnvConfig) -> Flask:
         datefmt="%a, %d %b %Y %H:%M:%S",
     )
     app = Flask(__name__)
-    config_obj = _get_config(env)
-    app.config.from_object(config_obj)
-    _register_extensions(app)
+    timing = startup.get_startup_timing(app)
+    with timing.phase("config"):
+        config_obj = _get_config(env)
+        app.config.from_object(config_obj)
+    with timing.phase("extensions"):
+        _register_extensions(app)
+        # registered first, so the requests are timed up to their last
+        # handler
+        metrics.init_app(app)
+        profiling.init_app(app)
 
     with app.app_context():
-        _register_blueprints(app)
-        orm.start_mappers()
+        with timing.phase("blueprints"):
+            _register_blueprints(app)
+        with timing.phase("mappers"):
+            orm.start_mappers()
 
-        scheduler._scheduler.start()
-        _add_scheduler_jobs(scheduler)
+        if app.config["SHHH_SCHEDULER_ENABLED"]:
+            with timing.phase("scheduler"):
+                start_scheduler(scheduler)
 
-        assets.manifest = False
-        assets.cache = False
-        _compile_static_assets(assets)
+        with timing.phase("assets"):
+            _register_static_assets(assets)
 
     app.context_processor(_inject_global_vars)
     _register_before_request_handlers(app)
     _register_after_request_handlers(app)
     _register_error_handlers(app)
+    _register_commands(app)
+    app.logger.info("Application created in %.0fms (%s)",
+                    timing.total * 1000,
+                    timing.summary())
     return app
 
 
@@ -74,8 +101,10 @@ def _register_before_request_handlers(app: Flask) -> None:
 
 
 def _register_after_request_handlers(app: Flask) -> None:
-    app.after_request(_optimize_response)
+    # handlers run in the reverse order of their registration
+    app.after_request(_add_static_cache_headers)
     app.after_request(_add_csp)
+    app.after_request(compress_response)
 
 
 def _register_error_handlers(app: Flask) -> None:
@@ -89,72 +118,88 @@ def _register_blueprints(app: Flask) -> None:
     app.register_blueprint(web)
 
 
+def _register_commands(app: Flask) -> None:
+    app.cli.add_command(cli.build_static)
+    app.cli.add_command(cli.calibrate_kdf)
+    app.cli.add_command(cli.migrations)
+    app.cli.add_command(cli.partition_table)
+    app.cli.add_command(cli.profile_token)
+    app.cli.add_command(cli.run_scheduler)
+    app.cli.add_command(cli.startup_profile)
+
+
 def _register_extensions(app: Flask) -> None:
-    alembic = Alembic(metadatas={"default": orm.metadata})
-    alembic.init_app(app)
+    # Alembic is registered by the `flask db` commands, as it is slow to
+    # import and not needed to serve requests
     assets.init_app(app)
+    engine.init_app(app)
     db.init_app(app)
+    kdf_pool.init_app(app)
+    repository.init_app(app)
+    gone_cache.init_app(app)
+    ratelimit.init_app(app)
+    blobs.init_app(app)
     scheduler.init_app(app)
 
 
-def _add_scheduler_jobs(scheduler: APScheduler) -> None:
-    scheduler.add_job(id="delete_expired_records",
-                      func=tasks.delete_expired_records,
-                      trigger="interval",
-                      seconds=60)
+def _register_static_assets(app_assets: Environment) -> None:
+    """Register the static assets bundles.
 
-
-def _compile_static_assets(app_assets: Environment) -> None:
-    assets_to_compile = (("js", ("create", "created", "read")),
-                         (("css", ("styles", ))))
-    for k, v in assets_to_compile:
+    Bundles are not built here, but once with `flask build-static` into
+    content hashed filenames listed in a manifest (unless ASSETS_AUTO_BUILD
+    is set, in which case they are built on first use).
+    """
+    assets_to_register = (("js", ("create", "created", "read")),
+                          (("css", ("styles", ))))
+    # sources concatenated before the source of the bundle
+    dependencies = {
+        "create": ("src/js/crypto.js", ), "read": ("src/js/crypto.js", )
+    }
+    for k, v in assets_to_register:
         for file in v:
-            bundle = Bundle(f"src/{k}/{file}.{k}",
+            bundle = Bundle(*dependencies.get(file, ()),
+                            f"src/{k}/{file}.{k}",
                             filters=f"{k}min",
-                            output=f"dist/{k}/{file}.min.{k}")
+                            output=f"dist/{k}/{file}.%(version)s.min.{k}")
             app_assets.register(file, bundle)
-            bundle.build()
 
 
 def _inject_global_vars() -> dict[str, str]:
     return {"version": __version__}
 
 
-def _not_found_error(error: NotFound) -> tuple[str, HTTPStatus]:
-    return rt("error.html", error=error), HTTPStatus.NOT_FOUND
+def _not_found_error(error: NotFound) -> Response:
+    return render_page("error.html", HTTPStatus.NOT_FOUND, error=str(error))
 
 
-def _internal_server_error(
-        error: InternalServerError) -> tuple[str, HTTPStatus]:
-    return rt("error.html", error=error), HTTPStatus.INTERNAL_SERVER_ERROR
+def _internal_server_error(error: InternalServerError) -> Response:
+    return render_page("error.html",
+                       HTTPStatus.INTERNAL_SERVER_ERROR,
+                       error=str(error))
 
 
 def _make_csp_nonce() -> None:
-    g.csp_nonce = secrets.token_urlsafe(16)
-
-
-def _optimize_response(response: Response) -> Response:
-    """Use gzip compression on responses."""
-    # do not gzip below 500 bytes or on JSON content
-    if (response.content_length < 500
-            or response.mimetype == "application/json"):
-        return response
-
-    response.direct_passthrough = False
-
-    gzip_buffer = BytesIO()
-    gzip_file = gzip.GzipFile(mode="wb", compresslevel=6, fileobj=gzip_buffer)
-    gzip_file.write(response.get_data())
-    gzip_file.close()
-
-    response.set_data(gzip_buffer.getvalue())
-    response.headers.remove("Content-Length")
-    response.headers.add("Content-Encoding", "gzip")
+    if current_app.config["SHHH_CSP_MODE"] == "nonce":
+        g.csp_nonce = secrets.token_urlsafe(16)
+
+
+def _add_static_cache_headers(response: Response) -> Response:
+    """Cache the content hashed static assets forever."""
+    if (request.endpoint == "static" and request.view_args
+            and str(request.view_args.get("filename", "")).startswith("dist/")
+            and response.status_code == HTTPStatus.OK):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000  # 1 year
+        response.cache_control.immutable = True
     return response
 
 
 def _add_csp(response: Response) -> Response:
-    nonce = g.get("csp_nonce", "")
+    if nonce := g.get("csp_nonce"):
+        scripts = styles = f"'self' 'nonce-{nonce}'"
+    else:
+        scripts, styles = f"'self' {INLINE_SCRIPT_HASHES}", "'self'"
     response.headers.set("X-Frame-Options", "SAMEORIGIN")
     response.headers.set("X-Content-Type-Options", "nosniff")
     if request.is_secure:
@@ -170,11 +215,11 @@ def _add_csp(response: Response) -> Response:
         "default-src 'self'; "
         "img-src 'self' data: blob:; "
         "object-src 'none'; "
-        f"script-src 'self' 'nonce-{nonce}'; "
-        f"script-src-elem 'self' 'nonce-{nonce}'; "
-        f"style-src 'self' 'nonce-{nonce}';"
-        f"style-src-elem 'self' 'nonce-{nonce}'; "
+        f"script-src {scripts}; "
+        f"script-src-elem {scripts}; "
+        f"style-src {styles};"
+        f"style-src-elem {styles}; "
         "connect-src 'self';"
         "frame-ancestors 'self'; "
-        "base-uri 'self'; ")
+        "base-uri 'self';")
     return response
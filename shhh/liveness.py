@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import threading
 import time
 from functools import wraps
 from http import HTTPStatus
@@ -8,7 +9,10 @@ from typing import TYPE_CHECKING
 
 from flask import abort, current_app as app, make_response
 from sqlalchemy import select
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
+from shhh import profiling
+from shhh.adapters.repository import get_repository
 from shhh.api.schemas import ErrorResponse
 from shhh.constants import ClientType, Message
 from shhh.extensions import db, scheduler
@@ -18,6 +22,8 @@ if TYPE_CHECKING:
 
     from flask import Flask, Response
 
+    from shhh.adapters.repository import AsyncSecretRepository
+
     RT = TypeVar('RT')
 
 logger = logging.getLogger(__name__)
@@ -31,45 +37,163 @@ def _check_table_exists(table_name: str) -> bool:
     return bool(db.inspect(db.engine).has_table(table_name))
 
 
-def _get_retries_configs(flask_app: Flask) -> tuple[int, float]:
-    return (flask_app.config["SHHH_DB_LIVENESS_RETRY_COUNT"],
-            flask_app.config["SHHH_DB_LIVENESS_SLEEP_INTERVAL"])
+def _log_missing_table() -> None:
+    logger.critical("Could not query required table 'secret', make sure it "
+                    "has been created on the database")
+
+
+def _is_db_table_up() -> bool:
+    if _check_table_exists("secret"):
+        return True
+    _log_missing_table()
+    return False
 
 
-def _is_db_awake(flask_app: Flask) -> bool:
-    retry_count, retry_sleep_interval_sec = _get_retries_configs(flask_app)
+class DbHealthMonitor:
+    """Worker level cache of the database health, with a circuit breaker.
+
+    A healthy verdict is cached for `SHHH_DB_LIVENESS_TTL` seconds, so most
+    requests do not hit the database to check it's up. The `secret` table
+    existence is checked until it has been found once. After
+    `SHHH_DB_LIVENESS_RETRY_COUNT` consecutive failed pings the circuit
+    opens: requests fail fast without touching the database, while a
+    background thread probes it every `SHHH_DB_LIVENESS_SLEEP_INTERVAL`
+    seconds to close the circuit again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.reset()
+
+    def reset(self) -> None:
+        # bumping the generation stops any running background probe
+        self._generation += 1
+        self._healthy_until = 0.0
+        self._table_found = False
+        self._failures = 0
+        self._open = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def _get_configs(self, flask_app: Flask) -> tuple[float, int, float]:
+        return (flask_app.config["SHHH_DB_LIVENESS_TTL"],
+                flask_app.config["SHHH_DB_LIVENESS_RETRY_COUNT"],
+                flask_app.config["SHHH_DB_LIVENESS_SLEEP_INTERVAL"])
+
+    def _cached_verdict(self) -> bool | None:
+        if self._open:
+            return False
+        if time.monotonic() < self._healthy_until:
+            return True
+        return None
+
+    def is_healthy(self, flask_app: Flask) -> bool:
+        """Return the cached verdict, or check the database if it expired.
+
+        Must be called within an application context.
+        """
+        if (verdict := self._cached_verdict()) is not None:
+            return verdict
 
-    for _ in range(retry_count):
         try:
             _perform_db_connectivity_query()
-            return True
+        except PoolTimeoutError:
+            # the connection pool is exhausted, the database is not down
+            raise
         except Exception as exc:
-            logger.info("Retrying to reach database...")
-            time.sleep(retry_sleep_interval_sec)
-            exception = exc
-
-    logger.critical("Could not reach the database, something is wrong "
-                    "with the database connection")
-    logger.exception(exception)
-    return False
+            db.session.rollback()
+            self._record_failure(flask_app, exc)
+            return False
 
+        if not self._table_found:
+            if not _is_db_table_up():
+                return False
+            self._table_found = True
 
-def _is_db_table_up(flask_app: Flask) -> bool:
-    if _check_table_exists("secret"):
+        self._record_success(flask_app)
         return True
-    logger.critical("Could not query required table 'secret', make sure it "
-                    "has been created on the database")
-    return False
 
+    async def is_healthy_async(self,
+                               flask_app: Flask,
+                               repository: AsyncSecretRepository) -> bool:
+        """Same as `is_healthy`, checking the database with the connection
+        of an async repository."""
+        if (verdict := self._cached_verdict()) is not None:
+            return verdict
+
+        try:
+            table_found = await repository.ping(
+                check_table=not self._table_found)
+        except PoolTimeoutError:
+            raise
+        except Exception as exc:
+            self._record_failure(flask_app, exc)
+            return False
+
+        if not table_found:
+            _log_missing_table()
+            return False
+        self._table_found = True
+        self._record_success(flask_app)
+        return True
 
-def _is_db_healthy(flask_app: Flask) -> bool:
-    return _is_db_awake(flask_app) and _is_db_table_up(flask_app)
+    def _record_success(self, flask_app: Flask) -> None:
+        ttl, _, _ = self._get_configs(flask_app)
+        with self._lock:
+            self._failures = 0
+            self._healthy_until = time.monotonic() + ttl
+
+    def _record_failure(self, flask_app: Flask, exc: Exception) -> None:
+        _, threshold, interval = self._get_configs(flask_app)
+        with self._lock:
+            self._healthy_until = 0.0
+            self._failures += 1
+            if self._open or self._failures < max(threshold, 1):
+                logger.info("Could not reach the database (%s/%s)",
+                            self._failures,
+                            threshold)
+                return
+            self._open = True
+
+        logger.critical("Could not reach the database, something is wrong "
+                        "with the database connection")
+        logger.exception(exc)
+        prober = threading.Thread(target=self._probe,
+                                  args=(flask_app, interval, self._generation),
+                                  name="db-health-prober",
+                                  daemon=True)
+        prober.start()
+
+    def _probe(self, flask_app: Flask, interval: float,
+               generation: int) -> None:
+        while self._open and generation == self._generation:
+            time.sleep(interval)
+            with flask_app.app_context():
+                try:
+                    _perform_db_connectivity_query()
+                except Exception:
+                    logger.info("Retrying to reach database...")
+                    continue
+            with self._lock:
+                if generation == self._generation:
+                    self._failures = 0
+                    self._open = False
+            logger.info("Database is reachable again, closing the circuit")
+            return
+
+
+db_health = DbHealthMonitor()
 
 
 def _check_task_liveness(f: Callable[..., RT], *args, **kwargs) -> RT | None:
     scheduler_app = scheduler.app
+    if not get_repository(scheduler_app).uses_database:
+        return f(*args, **kwargs)
     with scheduler_app.app_context():
-        if _is_db_healthy(scheduler_app):
+        if db_health.is_healthy(scheduler_app):
             return f(*args, **kwargs)
 
     return None
@@ -77,11 +201,22 @@ def _check_task_liveness(f: Callable[..., RT], *args, **kwargs) -> RT | None:
 
 def _check_web_liveness(f: Callable[..., RT], *args,
                         **kwargs) -> RT | Response:
-    if _is_db_healthy(app):
+    flask_app = app._get_current_object()  # type: ignore[attr-defined]
+    if not get_repository(flask_app).uses_database:
         return f(*args, **kwargs)
+    with profiling.phase("liveness"):
+        healthy = db_health.is_healthy(flask_app)
+    if healthy:
+        return f(*args, **kwargs)
+
+    abort(service_unavailable_response())
+
 
-    response = ErrorResponse(Message.UNEXPECTED)
-    abort(make_response(response(), HTTPStatus.SERVICE_UNAVAILABLE))
+def service_unavailable_response() -> Response:
+    response = make_response(
+        ErrorResponse(Message.UNEXPECTED)(), HTTPStatus.SERVICE_UNAVAILABLE)
+    response.headers.set("Retry-After", str(app.config["SHHH_RETRY_AFTER"]))
+    return response
 
 
 def _check_liveness(client_type: ClientType,
@@ -107,8 +242,9 @@ def db_liveness_ping(
 
     Some database might go to sleep if no recent activity is recorded (for
     example this is the case on some Heroku free plans). This decorator is
-    used to run a dummy query against the database to make sure it's up and
-    running before starting processing requests.
+    used to make sure the database is up and running before starting
+    processing requests, using the cached verdict of the worker health
+    monitor.
     """
 
     def inner(f):
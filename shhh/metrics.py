@@ -0,0 +1,233 @@
+"""Prometheus metrics, exposed on `/metrics`.
+
+When running several worker processes (e.g. with Gunicorn), set the
+`PROMETHEUS_MULTIPROC_DIR` environment variable to an empty directory
+shared by the workers, so the metrics of all the workers are aggregated on
+each scrape.
+"""
+from __future__ import annotations
+
+import hmac
+import os
+import time
+from http import HTTPStatus
+from typing import TYPE_CHECKING
+
+from flask import Blueprint, Response, abort, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST,
+                               REGISTRY,
+                               CollectorRegistry,
+                               Counter,
+                               Gauge,
+                               Histogram,
+                               generate_latest,
+                               multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from shhh.constants import Message, Status
+from shhh.domain.kdf import kdf_pool
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from flask import Flask
+    from sqlalchemy.engine import Connection
+
+    from shhh.api.schemas import CallableResponse
+    from shhh.domain.kdf import KdfTiming
+    from shhh.scheduler.tasks import ReaperStats
+
+# Set by init_app, the record helpers are no-ops while the metrics are
+# disabled, not writing to PROMETHEUS_MULTIPROC_DIR.
+_enabled = False
+
+REQUEST_DURATION = Histogram("shhh_request_duration_seconds",
+                             "Duration of the requests.",
+                             ["endpoint", "method", "outcome"])
+KDF_DURATION = Histogram("shhh_kdf_duration_seconds",
+                         "Duration of the key derivations.",
+                         buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5))
+KDF_QUEUE_WAIT = Histogram("shhh_kdf_queue_wait_seconds",
+                           "Time waited for a free KDF pool worker.",
+                           buckets=(.001, .005, .01, .05, .1, .5, 1, 5))
+DB_DURATION = Histogram("shhh_db_query_duration_seconds",
+                        "Duration of the database queries.",
+                        buckets=(.0005, .001, .005, .01, .05, .1, .5, 1))
+DB_POOL_WAIT = Histogram(
+    "shhh_db_pool_checkout_seconds",
+    "Time waited to check out a database connection from the pool.",
+    buckets=(.0001, .001, .005, .01, .05, .1, .5, 1, 5))
+DB_POOL_SIZE = Gauge("shhh_db_pool_size",
+                     "Number of connections kept in the database pools.",
+                     multiprocess_mode="livesum")
+DB_POOL_CHECKED_OUT = Gauge(
+    "shhh_db_pool_checked_out",
+    "Number of database connections checked out of the pools.",
+    multiprocess_mode="livesum")
+GONE_CACHE_LOOKUPS = Counter(
+    "shhh_gone_cache_lookups",
+    "Lookups of the cache of the secrets known to be gone.", ["result"])
+GONE_CACHE_SIZE = Gauge(
+    "shhh_gone_cache_size",
+    "Number of identifiers in the caches of the secrets known to be gone.",
+    multiprocess_mode="livesum")
+GONE_CACHE_BYTES = Gauge(
+    "shhh_gone_cache_bytes",
+    "Approximate memory used by the caches of the secrets known to be gone.",
+    multiprocess_mode="livesum")
+COMPRESSION_DURATION = Histogram("shhh_compression_duration_seconds",
+                                 "Duration of the responses compression.",
+                                 ["encoding"],
+                                 buckets=(.0001, .0005, .001, .005, .01, .05))
+SECRETS_CREATED = Counter("shhh_secrets_created", "Number of secrets created.")
+SECRETS_DELETED = Counter("shhh_secrets_deleted",
+                          "Number of secrets deleted.", ["reason"])
+# Gauges below are only set by the reaper leader, keep the most recent value
+# across processes.
+SECRETS_ACTIVE = Gauge(
+    "shhh_secrets_active",
+    "Number of secrets not expired, as last counted by the reaper.",
+    multiprocess_mode="mostrecent")
+REAPER_BACKLOG = Gauge("shhh_reaper_backlog",
+                       "Number of expired secrets left after the last run.",
+                       multiprocess_mode="mostrecent")
+REAPER_THROUGHPUT = Gauge("shhh_reaper_rows_per_second",
+                          "Throughput of the last reaper run.",
+                          multiprocess_mode="mostrecent")
+REAPER_DURATION = Histogram("shhh_reaper_run_duration_seconds",
+                            "Duration of the reaper runs.",
+                            buckets=(.01, .1, .5, 1, 5, 10, 30, 60))
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def record_outcome(response: CallableResponse) -> None:
+    """Count the secrets created and deleted by an API response, and keep
+    its outcome to label the request latency."""
+    if not _enabled:
+        return
+    status = getattr(response, "status", None)
+    if (created := getattr(response, "created", None)) is not None:
+        # bulk creation
+        SECRETS_CREATED.inc(created)
+        status = Status.CREATED if created else Status.INVALID
+    elif getattr(response, "msg", None) == Message.EXCEEDED:
+        SECRETS_DELETED.labels("exceeded").inc()
+        status = "exceeded"
+    elif status == Status.CREATED:
+        SECRETS_CREATED.inc()
+    elif status == Status.SUCCESS:
+        SECRETS_DELETED.labels("read").inc()
+    g.metrics_outcome = str(status)
+
+
+def record_kdf_timing(timing: KdfTiming) -> None:
+    if not _enabled:
+        return
+    KDF_DURATION.observe(timing.duration)
+    KDF_QUEUE_WAIT.observe(timing.queue_wait)
+
+
+def record_db_pool_checkout(wait: float, size: int, checked_out: int) -> None:
+    if not _enabled:
+        return
+    DB_POOL_WAIT.observe(wait)
+    DB_POOL_SIZE.set(size)
+    DB_POOL_CHECKED_OUT.set(checked_out)
+
+
+def record_db_pool_checkin(checked_out: int) -> None:
+    if not _enabled:
+        return
+    DB_POOL_CHECKED_OUT.set(checked_out)
+
+
+def record_gone_cache_lookup(hit: bool) -> None:
+    if not _enabled:
+        return
+    GONE_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+
+def record_gone_cache_size(size: int, memory_size: int) -> None:
+    if not _enabled:
+        return
+    GONE_CACHE_SIZE.set(size)
+    GONE_CACHE_BYTES.set(memory_size)
+
+
+def record_reaper_run(stats: ReaperStats, active: int | None) -> None:
+    if not _enabled:
+        return
+    SECRETS_DELETED.labels("expired").inc(stats.deleted)
+    if active is not None:
+        SECRETS_ACTIVE.set(active)
+    REAPER_BACKLOG.set(stats.backlog)
+    REAPER_THROUGHPUT.set(stats.rate)
+    REAPER_DURATION.observe(stats.elapsed)
+
+
+def record_compression(encoding: str, duration: float) -> None:
+    if not _enabled:
+        return
+    COMPRESSION_DURATION.labels(encoding).observe(duration)
+
+
+def _start_timer() -> None:
+    g.metrics_started = time.perf_counter()
+
+
+def _observe_request(response: Response) -> Response:
+    if (started := g.get("metrics_started")) is not None:
+        outcome = g.get("metrics_outcome", str(response.status_code))
+        REQUEST_DURATION.labels(request.endpoint or "none",
+                                request.method,
+                                outcome).observe(time.perf_counter() - started)
+    return response
+
+
+def _before_cursor_execute(conn: Connection, *args: Any) -> None:
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Connection, *args: Any) -> None:
+    if started := conn.info.get("metrics_started"):
+        DB_DURATION.observe(time.perf_counter() - started.pop())
+
+
+def init_app(app: Flask) -> None:
+    """Time the requests and the database queries, and register `/metrics`.
+
+    Must be registered before the other after request handlers, so the
+    request latency includes them.
+    """
+    global _enabled
+    _enabled = app.config["SHHH_METRICS_ENABLED"]
+    if not _enabled:
+        return
+    kdf_pool.on_timing = record_kdf_timing
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.register_blueprint(metrics)
+    if not event.contains(
+            Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+metrics = Blueprint("metrics", __name__)
+
+
+@metrics.get("/metrics")
+def expose() -> Response:
+    token = current_app.config["SHHH_METRICS_TOKEN"]
+    if token and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"):
+        abort(HTTPStatus.UNAUTHORIZED)
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,212 @@
+"""binary external id
+
+Revision ID: 1792360000
+Revises: 1792347412
+Create Date: 2026-10-18 21:00:00.000000
+
+Store the external identifiers as their 15 random bytes, under a unique
+index, rather than their 20 characters URL-safe base64 encoding.
+
+On PostgreSQL and MySQL the table is converted while in use: the binary
+column is added, filled by a trigger for the new secrets and in batches for
+the existing ones, and indexed online (`CREATE INDEX CONCURRENTLY` on
+PostgreSQL, `LOCK=NONE` on MySQL), before replacing the text column. The
+replacement is quick on PostgreSQL, but rebuilds the table on MySQL, which
+is locked meanwhile (the secrets created since the trigger was dropped are
+filled under the same lock). The application must be upgraded once the
+migration completes, as the previous version only knows the text column.
+
+On a partitioned table, unique indexes must include the partition key, so
+the identifiers are only unique per expiry date. With 15 random bytes,
+collisions are not expected either way.
+
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from shhh.adapters import partitions
+
+# revision identifiers, used by Alembic.
+revision: str = '1792360000'
+down_revision: Union[str, None] = '1792347412'
+branch_labels: Union[str, Sequence[str], None] = ()
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+DECODE = {
+    "postgresql": "decode(translate({}, '-_', '+/'), 'base64')",
+    "mysql": "FROM_BASE64(REPLACE(REPLACE({}, '-', '+'), '_', '/'))",
+}
+# fill the binary column of the secrets in a range of ids
+BACKFILL = {
+    "postgresql":
+        "UPDATE secret "
+        "SET external_key = decode(translate(external_id, '-_', '+/'), "
+        "'base64') "
+        "WHERE id > :start AND id <= :end AND external_key IS NULL",
+    "mysql":
+        "UPDATE secret "
+        "SET external_key = FROM_BASE64(REPLACE(REPLACE(external_id, '-', "
+        "'+'), '_', '/')) "
+        "WHERE id > :start AND id <= :end AND external_key IS NULL",
+}
+ENCODE = {
+    "postgresql":
+        "UPDATE secret "
+        "SET external_key = translate(encode(external_id, 'base64'), '+/', "
+        "'-_')",
+    "mysql":
+        "UPDATE secret "
+        "SET external_key = REPLACE(REPLACE(TO_BASE64(external_id), '+', "
+        "'-'), '/', '_')",
+}
+
+
+def _backfill(bind: sa.Connection, after: int = 0) -> int:
+    """Fill the binary column of the secrets past the `after` id, by ranges
+    of ids committed one at a time so rows are not locked for long, and
+    return the last id."""
+    stmt = sa.text(BACKFILL[bind.dialect.name])
+    with op.get_context().autocommit_block():
+        last = bind.execute(sa.text("SELECT max(id) FROM secret")).scalar()
+        for start in range(after, last or 0, BATCH_SIZE):
+            bind.execute(stmt, {"start": start, "end": start + BATCH_SIZE})
+    return max(after, last or 0)
+
+
+def _upgrade_postgresql(bind: sa.Connection) -> None:
+    op.add_column("secret", sa.Column("external_key", sa.LargeBinary()))
+    op.execute(f"""
+        CREATE FUNCTION secret_external_key() RETURNS trigger AS $$
+        BEGIN
+            NEW.external_key := {DECODE["postgresql"].format("NEW.external_id")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("CREATE TRIGGER secret_external_key BEFORE INSERT ON secret "
+               "FOR EACH ROW EXECUTE FUNCTION secret_external_key()")
+    _backfill(bind)
+
+    # validated online, the check lets SET NOT NULL skip scanning the table
+    op.execute("ALTER TABLE secret ADD CONSTRAINT external_key_not_null "
+               "CHECK (external_key IS NOT NULL) NOT VALID")
+    with op.get_context().autocommit_block():
+        op.execute(
+            "ALTER TABLE secret VALIDATE CONSTRAINT external_key_not_null")
+        if not partitions.is_partitioned(bind):
+            op.execute("CREATE UNIQUE INDEX CONCURRENTLY external_key_idx "
+                       "ON secret (external_key)")
+        else:
+            # unique indexes of partitioned tables must include the partition
+            # key, and are built concurrently one partition at a time
+            op.execute("CREATE UNIQUE INDEX external_key_idx "
+                       "ON ONLY secret (external_key, date_expires)")
+            for name in partitions.list_partitions(bind):
+                op.execute(
+                    f"CREATE UNIQUE INDEX CONCURRENTLY {name}_external_key_idx "
+                    f"ON {name} (external_key, date_expires)")
+                op.execute("ALTER INDEX external_key_idx "
+                           f"ATTACH PARTITION {name}_external_key_idx")
+
+    op.execute("DROP TRIGGER secret_external_key ON secret")
+    op.execute("DROP FUNCTION secret_external_key()")
+    op.execute("ALTER TABLE secret DROP COLUMN external_id")
+    op.execute("ALTER TABLE secret RENAME COLUMN external_key TO external_id")
+    op.execute("ALTER TABLE secret ALTER COLUMN external_id SET NOT NULL")
+    op.execute("ALTER TABLE secret DROP CONSTRAINT external_key_not_null")
+    op.execute("ALTER INDEX external_key_idx RENAME TO external_id_idx")
+
+
+def _upgrade_mysql(bind: sa.Connection) -> None:
+    op.execute("ALTER TABLE secret ADD COLUMN external_key BINARY(15) NULL, "
+               "LOCK=NONE")
+    op.execute("CREATE TRIGGER secret_external_key BEFORE INSERT ON secret "
+               "FOR EACH ROW SET NEW.external_key = "
+               f"{DECODE['mysql'].format('NEW.external_id')}")
+    last = _backfill(bind)
+    op.execute("CREATE UNIQUE INDEX external_key_idx ON secret (external_key) "
+               "ALGORITHM=INPLACE LOCK=NONE")
+
+    # the trigger can't outlive the text column: drop it, fill the secrets
+    # created since the backfill and rebuild the table under the same lock,
+    # so no secret is created in between
+    op.execute("LOCK TABLES secret WRITE")
+    try:
+        op.execute("DROP TRIGGER secret_external_key")
+        end = bind.execute(sa.text("SELECT max(id) FROM secret")).scalar()
+        bind.execute(sa.text(BACKFILL["mysql"]), {
+            "start": last, "end": end or 0
+        })
+        missing = bind.execute(
+            sa.text("SELECT count(*) FROM secret "
+                    "WHERE external_key IS NULL")).scalar()
+        if missing:
+            raise RuntimeError(f"{missing} secrets have no binary external id")
+        op.execute(
+            "ALTER TABLE secret DROP COLUMN external_id, "
+            "CHANGE COLUMN external_key external_id BINARY(15) NOT NULL, "
+            "RENAME INDEX external_key_idx TO external_id_idx")
+    finally:
+        op.execute("UNLOCK TABLES")
+
+
+def _upgrade_other(bind: sa.Connection) -> None:
+    op.add_column("secret", sa.Column("external_key", sa.LargeBinary(15)))
+    rows = bind.execute(sa.text("SELECT id, external_id FROM secret")).all()
+    if rows:
+        bind.execute(
+            sa.text("UPDATE secret SET external_key = :key WHERE id = :id"),
+            [{
+                "id": id_, "key": urlsafe_b64decode(external_id)
+            } for id_, external_id in rows])
+
+    with op.batch_alter_table("secret") as batch_op:
+        batch_op.drop_index("external_id_idx")
+        batch_op.drop_column("external_id")
+        batch_op.alter_column("external_key",
+                              new_column_name="external_id",
+                              existing_type=sa.LargeBinary(15),
+                              nullable=False)
+    op.create_index("external_id_idx", "secret", ["external_id"], unique=True)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        _upgrade_postgresql(bind)
+    elif bind.dialect.name == "mysql":
+        _upgrade_mysql(bind)
+    else:
+        _upgrade_other(bind)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    op.add_column("secret", sa.Column("external_key", sa.VARCHAR(length=20)))
+    if dialect in ENCODE:
+        op.execute(ENCODE[dialect])
+    else:
+        rows = bind.execute(
+            sa.text("SELECT id, external_id FROM secret")).all()
+        if rows:
+            bind.execute(
+                sa.text(
+                    "UPDATE secret SET external_key = :key WHERE id = :id"),
+                [{
+                    "id": id_, "key": urlsafe_b64encode(external_id).decode()
+                } for id_, external_id in rows])
+
+    with op.batch_alter_table("secret") as batch_op:
+        batch_op.drop_index("external_id_idx")
+        batch_op.drop_column("external_id")
+        batch_op.alter_column("external_key",
+                              new_column_name="external_id",
+                              existing_type=sa.VARCHAR(length=20),
+                              nullable=False)
+    op.create_index("external_id_idx", "secret", ["external_id"], unique=False)
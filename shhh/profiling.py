@@ -0,0 +1,238 @@
+"""Per request `Server-Timing` breakdown, and on-demand profiling.
+
+Both are opt-in, and their hooks are only registered when enabled.
+
+With SHHH_SERVER_TIMING, responses get a `Server-Timing` header with the
+duration of each phase of the request: database liveness check, arguments
+parsing, key derivation, database queries, template rendering and
+compression.
+
+With SHHH_PROFILING_DIR, a cProfile profile and a tracemalloc snapshot of
+the request are written to that directory, for a SHHH_PROFILING_RATE
+fraction of the requests, or for the requests sent with an `X-Shhh-Profile`
+header signed with SHHH_PROFILING_KEY (see `flask profile-token`).
+Profiled requests also get a `Server-Timing` header.
+"""
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+import tracemalloc
+from typing import TYPE_CHECKING, cast
+
+from flask import current_app as app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+if TYPE_CHECKING:
+    from contextlib import AbstractContextManager
+    from typing import Any, Iterator
+
+    from flask import Flask, Response
+    from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Shhh-Profile"
+
+
+class ServerTiming:
+    """Durations of the phases of a request, summed by phase name."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def add(self, name: str, duration: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def header(self) -> str:
+        phases = {**self.phases, "total": time.perf_counter() - self.started}
+        return ", ".join(f"{name};dur={duration * 1000:.2f}"
+                         for name, duration in phases.items())
+
+
+def _get_server_timing() -> ServerTiming | None:
+    if not has_request_context():
+        return None
+    return cast(ServerTiming | None, g.get("server_timing"))
+
+
+def add_phase(name: str, duration: float) -> None:
+    """Add the duration of a phase to the current request timing."""
+    if (timing := _get_server_timing()) is not None:
+        timing.add(name, duration)
+
+
+@contextlib.contextmanager
+def _timed(timing: ServerTiming, name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - started)
+
+
+def phase(name: str) -> AbstractContextManager[None]:
+    """Time a phase of the current request, when it is timed."""
+    if (timing := _get_server_timing()) is not None:
+        return _timed(timing, name)
+    return contextlib.nullcontext()
+
+
+class _TracemallocSessions:
+    """Keep tracemalloc tracing while at least one request is profiled."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._count = 0
+        self._started = False
+
+    def enter(self) -> None:
+        with self._lock:
+            if self._count == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._count += 1
+
+    def exit(self) -> None:
+        with self._lock:
+            self._count -= 1
+            if self._count == 0 and self._started:
+                tracemalloc.stop()
+                self._started = False
+
+
+_tracemalloc_sessions = _TracemallocSessions()
+
+
+def _sign(key: str, path: str, expires: int) -> str:
+    return hmac.new(key.encode(), f"{expires}:{path}".encode(),
+                    hashlib.sha256).hexdigest()
+
+
+def sign_profile_request(key: str, path: str, expires: int) -> str:
+    """Value of the profiling header, for requests to `path` until the
+    `expires` timestamp."""
+    return f"{expires}:{_sign(key, path, expires)}"
+
+
+def _has_valid_profile_header() -> bool:
+    key = app.config["SHHH_PROFILING_KEY"]
+    if not key or not (value := request.headers.get(PROFILE_HEADER)):
+        return False
+    expires, _, signature = value.partition(":")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature,
+                               _sign(key, request.path, int(expires)))
+
+
+# draws of the requests sampled for profiling
+_sampling = secrets.SystemRandom()
+
+# cProfile can only profile one request at a time (from Python 3.12, it
+# registers with the process-wide `sys.monitoring`, and a second profiler
+# fails to be enabled)
+_profiler_slot = threading.Lock()
+
+
+def _is_profile_requested() -> bool:
+    rate = app.config["SHHH_PROFILING_RATE"]
+    return ((rate > 0 and _sampling.random() < rate)
+            or _has_valid_profile_header())
+
+
+def _start_request() -> None:
+    if app.config["SHHH_SERVER_TIMING"]:
+        g.server_timing = ServerTiming()
+    if app.config["SHHH_PROFILING_DIR"] and _is_profile_requested():
+        if not _profiler_slot.acquire(blocking=False):
+            logger.info("Another request is being profiled, skipping %s %s",
+                        request.method,
+                        request.path)
+            return
+        if "server_timing" not in g:
+            g.server_timing = ServerTiming()
+        _tracemalloc_sessions.enter()
+        g.profiler = profiler = cProfile.Profile()
+        profiler.enable()
+
+
+def _write_profile(profiler: cProfile.Profile,
+                   snapshot: tracemalloc.Snapshot) -> None:
+    directory = app.config["SHHH_PROFILING_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory,
+        f"{time.strftime('%Y%m%dT%H%M%S')}-"
+        f"{request.endpoint or 'none'}-{secrets.token_hex(4)}")
+    profiler.dump_stats(f"{path}.prof")
+    snapshot.dump(f"{path}.tracemalloc")
+    logger.info("Profile of %s %s written to %s.prof",
+                request.method,
+                request.path,
+                path)
+
+
+def _stop_profiler() -> None:
+    if (profiler := g.pop("profiler", None)) is None:
+        return
+    profiler.disable()
+    try:
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        _tracemalloc_sessions.exit()
+        _profiler_slot.release()
+    _write_profile(profiler, snapshot)
+
+
+def _finish_request(response: Response) -> Response:
+    _stop_profiler()
+    if (timing := g.get("server_timing")) is not None:
+        response.headers.set("Server-Timing", timing.header())
+    return response
+
+
+def _teardown_request(exc: BaseException | None) -> None:
+    # the after request handlers are skipped on unhandled errors
+    if (profiler := g.pop("profiler", None)) is not None:
+        profiler.disable()
+        _tracemalloc_sessions.exit()
+        _profiler_slot.release()
+
+
+def _before_cursor_execute(conn: Connection, *args: Any) -> None:
+    if _get_server_timing() is not None:
+        conn.info.setdefault("server_timing_started",
+                             []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Connection, *args: Any) -> None:
+    if started := conn.info.get("server_timing_started"):
+        add_phase("db", time.perf_counter() - started.pop())
+
+
+def init_app(app: Flask) -> None:
+    """Register the request hooks, when timing or profiling is enabled.
+
+    Must be registered before the other after request handlers, so the
+    timings and profiles include them.
+    """
+    if not app.config["SHHH_SERVER_TIMING"] and not app.config[
+            "SHHH_PROFILING_DIR"]:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    if not event.contains(
+            Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,321 @@
+"""Token bucket rate limiting of the API.
+
+Reading a secret costs a key derivation, even with a wrong passphrase, so
+the requests are throttled before any derivation: reads per client and per
+secret (so brute forcing a link is slow whatever the number of clients),
+and writes per client. Each limit is a bucket of `count` tokens, refilled
+over `period` seconds, so short bursts are allowed.
+
+Buckets are kept in a store selected with SHHH_RATELIMIT_STORE:
+
+* `shared` (default) maps a file in memory, shared by the worker processes
+  of a node.
+* `memory` is local to each process, for tests and single process
+  deployments.
+* `redis` is shared across the nodes, using SHHH_REDIS_URL.
+"""
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import secrets
+import struct
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, cast
+
+from flask import current_app, request
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+EXTENSION_NAME = "shhh.ratelimit"
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True)
+class Limit:
+    """Up to `count` requests per `period` seconds."""
+    count: int
+    period: int
+
+    @classmethod
+    def parse(cls, value: str) -> Limit:
+        """Parse a limit written as `<count>/<period>` (ex: `5/minute`)."""
+        count, _, period = value.partition("/")
+        try:
+            limit = cls(int(count), PERIODS[period.strip()])
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid rate limit {value!r}") from None
+        if limit.count < 1:
+            raise ValueError(f"Invalid rate limit {value!r}")
+        return limit
+
+    @property
+    def rate(self) -> float:
+        """Tokens refilled per second."""
+        return self.count / self.period
+
+
+class LimitExceeded(ValueError):
+    """Raised when a request costs more tokens than its bucket holds, so it
+    could never be allowed."""
+
+    def __init__(self, name: str, limit: Limit, cost: int) -> None:
+        super().__init__(f"{cost} {name} tokens exceed the limit of "
+                         f"{limit.count} per {limit.period}s")
+        self.name = name
+        self.limit = limit
+        self.cost = cost
+
+
+def _refill(tokens: float, updated: float, now: float, limit: Limit,
+            cost: int) -> tuple[float, float]:
+    """Return the tokens left after taking `cost` tokens (unchanged if there
+    are not enough of them), and the seconds to wait for enough tokens."""
+    tokens = min(limit.count, tokens + max(now - updated, 0) * limit.rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / limit.rate
+
+
+class BucketStore(ABC):
+    """Store of token buckets."""
+
+    @abstractmethod
+    def take(self, key: str, limit: Limit, cost: int = 1) -> float:
+        """Take `cost` tokens from the bucket of `key`, return 0 if they
+        were, or the seconds to wait before there are enough tokens."""
+
+
+class MemoryBucketStore(BucketStore):
+    """Buckets local to the process, the least recently used ones being
+    evicted past `max_size` buckets."""
+
+    def __init__(self, max_size: int = 65536) -> None:
+        self.max_size = max_size
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, cost: int = 1) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.count, now))
+            tokens, wait = _refill(tokens, updated, now, limit, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedBucketStore(BucketStore):
+    """Buckets in a memory mapped file, shared by the processes of a node.
+
+    The file is a fixed size table of `slots` buckets, addressed by a hash of
+    their key salted with a random value stored in the file header, so the
+    slots of other keys can't be targeted. A bucket taking the slot of
+    another one starts full. Updates are serialised with a lock on the file.
+    """
+
+    _HEADER_SIZE = 16
+    # key hash, tokens, last update
+    _SLOT = struct.Struct("<Qdd")
+
+    def __init__(self, path: str, slots: int = 65536) -> None:
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+        self._fd = -1
+        self._map: mmap.mmap | None = None
+        self._salt = b""
+
+    def _open(self) -> mmap.mmap:
+        # each process maps the file on its own first use
+        if self._map is not None and self._pid == os.getpid():
+            return self._map
+        size = self._HEADER_SIZE + self.slots * self._SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            mapped = mmap.mmap(fd, size)
+            if not any(mapped[:self._HEADER_SIZE]):
+                mapped[:self._HEADER_SIZE] = secrets.token_bytes(
+                    self._HEADER_SIZE)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._map, self._pid = fd, mapped, os.getpid()
+        self._salt = mapped[:self._HEADER_SIZE]
+        return mapped
+
+    def _slot(self, key: str) -> tuple[int, int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=8,
+                                 key=self._salt).digest()
+        key_hash = int.from_bytes(digest, "little")
+        offset = (self._HEADER_SIZE +
+                  (key_hash % self.slots) * self._SLOT.size)
+        return key_hash, offset
+
+    def take(self, key: str, limit: Limit, cost: int = 1) -> float:
+        now = time.time()
+        with self._lock:
+            mapped = self._open()
+            key_hash, offset = self._slot(key)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                slot_hash, tokens, updated = self._SLOT.unpack_from(
+                    mapped, offset)
+                if slot_hash != key_hash:
+                    tokens, updated = limit.count, now
+                tokens, wait = _refill(tokens, updated, now, limit, cost)
+                self._SLOT.pack_into(mapped, offset, key_hash, tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+
+# Token bucket updated atomically, with the time of the Redis server so the
+# nodes don't need synchronised clocks.
+_TAKE_SCRIPT = """
+local count, period, cost = tonumber(ARGV[1]), tonumber(ARGV[2]),
+    tonumber(ARGV[3])
+local rate = count / period
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens, updated = tonumber(bucket[1]), tonumber(bucket[2])
+if tokens == nil then
+    tokens, updated = count, now
+end
+tokens = math.min(count, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens),
+           "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], period)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore(BucketStore):
+    """Buckets stored in Redis, shared across the nodes. Buckets expire once
+    they would be full again."""
+
+    prefix = "ratelimit:"
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis
+        except ImportError as exc:  # pragma: no cover
+            raise RuntimeError(
+                "The redis rate limit store needs the redis package, install "
+                "requirements.redis.txt") from exc
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key: str, limit: Limit, cost: int = 1) -> float:
+        return float(
+            self._take(keys=[f"{self.prefix}{key}"],
+                       args=[limit.count, limit.period, cost]))
+
+
+def create_store(app: Flask) -> BucketStore:
+    store = app.config["SHHH_RATELIMIT_STORE"]
+    if store == "shared":
+        path = app.config["SHHH_RATELIMIT_PATH"] or os.path.join(
+            tempfile.gettempdir(), "shhh-ratelimit")
+        return SharedBucketStore(path)
+    if store == "memory":
+        return MemoryBucketStore()
+    if store == "redis":
+        if not (url := app.config["SHHH_REDIS_URL"]):
+            raise RuntimeError("SHHH_REDIS_URL is required by the redis "
+                               "rate limit store")
+        return RedisBucketStore(url)
+    raise RuntimeError(f"Rate limit {store=} is not supported")
+
+
+class RateLimiter:
+    """Rate limits of the API, checked by the handlers."""
+
+    def __init__(self, store: BucketStore, limits: dict[str, Limit]) -> None:
+        self.store = store
+        self.limits = limits
+
+    def check(self, name: str, cost: int) -> None:
+        """Raise `LimitExceeded` if `cost` tokens are more than the `name`
+        buckets hold."""
+        if cost > (limit := self.limits[name]).count:
+            raise LimitExceeded(name, limit, cost)
+
+    def take(self, name: str, key: str, cost: int = 1) -> float:
+        """Take tokens from the `name` bucket of `key`, return the seconds
+        to wait if there are not enough of them, 0 otherwise."""
+        self.check(name, cost)
+        return self.store.take(f"{name}:{key}", self.limits[name], cost)
+
+
+def init_app(app: Flask) -> None:
+    try:
+        limits = {
+            name: Limit.parse(app.config[f"SHHH_RATELIMIT_{name.upper()}"])
+            for name in ("read", "secret", "write")
+        }
+    except ValueError as exc:
+        raise RuntimeError(str(exc)) from exc
+    if (app.config["SHHH_RATELIMIT_ENABLED"]
+            and not app.config["SHHH_TRUSTED_PROXIES"]):
+        app.logger.warning(
+            "Rate limiting clients by the address of their connection, set "
+            "SHHH_TRUSTED_PROXIES if Shhh is behind a reverse proxy, or all "
+            "the clients share the same limits")
+    app.extensions[EXTENSION_NAME] = RateLimiter(create_store(app), limits)
+
+
+def get_rate_limiter() -> RateLimiter:
+    return cast(RateLimiter, current_app.extensions[EXTENSION_NAME])
+
+
+def client_address() -> str:
+    """Address of the client, as forwarded by the SHHH_TRUSTED_PROXIES
+    proxies in front of the application, if any."""
+    trusted: int = current_app.config["SHHH_TRUSTED_PROXIES"]
+    forwarded = [
+        address.strip()
+        for address in request.headers.get("X-Forwarded-For", "").split(",")
+        if address.strip()
+    ]
+    if trusted and len(forwarded) >= trusted:
+        return forwarded[-trusted]
+    return request.remote_addr or ""
+
+
+def throttle(*limits: tuple[str, str, int]) -> int:
+    """Take tokens from each `(name, key, cost)` bucket in turn, return the
+    number of seconds to retry after once one of them is exhausted (without
+    taking from the next ones), 0 otherwise. Raise `LimitExceeded`, without
+    taking any token, if a cost is more than its buckets hold."""
+    if not current_app.config["SHHH_RATELIMIT_ENABLED"]:
+        return 0
+    limiter = get_rate_limiter()
+    for name, _, cost in limits:
+        limiter.check(name, cost)
+    for limit in limits:
+        if wait := limiter.take(*limit):
+            return math.ceil(wait)
+    return 0
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from shhh.adapters.repository import (PartitionedSqlSecretRepository,
+                                      get_repository)
+from shhh.scheduler import tasks
+
+if TYPE_CHECKING:
+    from flask_apscheduler import APScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def start_scheduler(scheduler: APScheduler) -> None:
+    """Start the background scheduler and register its jobs."""
+    scheduler._scheduler.start()
+    repository = get_repository(scheduler.app)
+    if isinstance(repository, PartitionedSqlSecretRepository):
+        # run straight away, so the partitions exist before any insert
+        scheduler.add_job(id=tasks.MAINTAIN_PARTITIONS_JOB,
+                          func=tasks.maintain_partitions,
+                          trigger="interval",
+                          seconds=tasks.MAINTAIN_PARTITIONS_INTERVAL,
+                          next_run_time=datetime.now())
+    if repository.needs_reaper:
+        scheduler.add_job(id=tasks.DELETE_EXPIRED_RECORDS_JOB,
+                          func=tasks.delete_expired_records,
+                          trigger="interval",
+                          seconds=scheduler.app.config["SHHH_REAPER_INTERVAL"])
+    else:
+        logger.info("Secrets expire on their own, the reaper is disabled")
+    # blobs are not expired by any store
+    scheduler.add_job(id=tasks.DELETE_EXPIRED_BLOBS_JOB,
+                      func=tasks.delete_expired_blobs,
+                      trigger="interval",
+                      seconds=scheduler.app.config["SHHH_REAPER_INTERVAL"])
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import cast
+
+from sqlalchemy import CursorResult, delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from shhh.adapters import orm
+from shhh.extensions import db
+
+logger = logging.getLogger(__name__)
+
+lease_table = orm.scheduler_lease
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaderLease:
+    """Database backed lease electing a single leader for a scheduled job.
+
+    The leader renews the lease each time it runs the job. If the leader
+    dies, the lease expires after its TTL and the next worker trying to
+    acquire it takes over. Only plain UPDATE and INSERT statements are used,
+    so it works the same on PostgreSQL, MySQL and SQLite.
+
+    Must be used within an application context.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._owner: str | None = None
+        self._owner_pid: int | None = None
+
+    @property
+    def owner(self) -> str:
+        # a forked worker must not inherit the identity of its parent
+        if self._owner is None or self._owner_pid != os.getpid():
+            self._owner = (f"{socket.gethostname()}:{os.getpid()}:"
+                           f"{uuid.uuid4().hex[:8]}")
+            self._owner_pid = os.getpid()
+        return self._owner
+
+    def acquire(self, ttl: float) -> bool:
+        """Acquire or renew the lease, return whether we are the leader."""
+        now = _utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        is_renewable = or_(lease_table.c.owner == self.owner,
+                           lease_table.c.expires_at < now)
+        stmt = update(lease_table).where(lease_table.c.name == self.name,
+                                         is_renewable).values(
+                                             owner=self.owner,
+                                             expires_at=expires_at)
+        result = cast(CursorResult, db.session.execute(stmt))
+        db.session.commit()
+        if result.rowcount == 1:
+            return True
+
+        try:
+            db.session.execute(
+                insert(lease_table).values(name=self.name,
+                                           owner=self.owner,
+                                           expires_at=expires_at))
+            db.session.commit()
+        except IntegrityError:
+            # the lease is held by another worker
+            db.session.rollback()
+            return False
+        logger.info("%s acquired the %s lease", self.owner, self.name)
+        return True
+
+    def release(self) -> None:
+        """Release the lease if we hold it, so another worker can take over
+        without waiting for it to expire."""
+        db.session.execute(
+            delete(lease_table).where(lease_table.c.name == self.name,
+                                      lease_table.c.owner == self.owner))
+        db.session.commit()
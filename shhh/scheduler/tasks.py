@@ -1,31 +1,222 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, cast
 
+from apscheduler.triggers.interval import IntervalTrigger
+
+from shhh import metrics
+from shhh.adapters.blobs import get_blob_store
+from shhh.adapters.repository import get_repository
 from shhh.constants import ClientType
-from shhh.domain import model
-from shhh.extensions import db, scheduler
+from shhh.extensions import scheduler
 from shhh.liveness import db_liveness_ping
+from shhh.scheduler.leader import LeaderLease
 
 if TYPE_CHECKING:
-    from typing import Iterable
+    from flask import Flask
+
+    from shhh.adapters.repository import (PartitionedSqlSecretRepository,
+                                          SecretRepository)
 
 logger = logging.getLogger("tasks")
 
+DELETE_EXPIRED_RECORDS_JOB = "delete_expired_records"
+MAINTAIN_PARTITIONS_JOB = "maintain_partitions"
+DELETE_EXPIRED_BLOBS_JOB = "delete_expired_blobs"
+
+# Interval in seconds between runs of the partitions maintenance job, short
+# enough for hourly partitions to be dropped soon after they expire.
+MAINTAIN_PARTITIONS_INTERVAL = 600
+
+# Seconds the leases outlive the longest interval between two runs of the
+# jobs renewing them, for the runs starting late.
+LEASE_TTL_MARGIN = 60
+
+# Minimum interval in seconds between counts of the active secrets reported
+# by the reaper, as counting scans the whole expiry date index.
+ACTIVE_COUNT_INTERVAL = 300
+
+# monotonic time of the last count of the active secrets
+_active_counted_at: float | None = None
+
+reaper_lease = LeaderLease(DELETE_EXPIRED_RECORDS_JOB)
+partitions_lease = LeaderLease(MAINTAIN_PARTITIONS_JOB)
+blobs_lease = LeaderLease(DELETE_EXPIRED_BLOBS_JOB)
+
+
+@dataclass
+class ReaperStats:
+    """Outcome of a run of the expired records reaper."""
+    deleted: int
+    elapsed: float
+    backlog: int
+
+    @property
+    def rate(self) -> float:
+        return self.deleted / self.elapsed if self.elapsed else 0.0
+
+
+@db_liveness_ping(ClientType.TASK)
+def delete_expired_records() -> ReaperStats | None:
+    """Delete expired secrets from the database.
+
+    Only scheduled with storages not expiring the secrets on their own.
+    Only the worker holding the reaper lease runs the job, so a single reaper
+    is active across workers and nodes. Secrets are deleted in bounded chunks
+    using bulk deletes driven by the expiry date index, committing after each
+    chunk. A run stops after SHHH_REAPER_MAX_RUNTIME seconds, and the job
+    interval is adapted to the remaining backlog.
+    """
+    flask_app = scheduler.app
+    with flask_app.app_context():
+        if not reaper_lease.acquire(_lease_ttl(flask_app)):
+            logger.debug("Not the reaper leader, skipping run.")
+            return None
+
+        repository = get_repository(flask_app)
+        stats = _delete_expired_chunks(
+            repository,
+            chunk_size=flask_app.config["SHHH_REAPER_CHUNK_SIZE"],
+            max_runtime=flask_app.config["SHHH_REAPER_MAX_RUNTIME"])
+        logger.info(
+            "%s expired records have been deleted in %.2fs (%.0f rows/s), "
+            "%s remaining in backlog.",
+            stats.deleted,
+            stats.elapsed,
+            stats.rate,
+            stats.backlog)
+        if metrics.is_enabled():
+            metrics.record_reaper_run(stats, active=_count_active(repository))
+        _adapt_interval(flask_app, stats)
+    return stats
+
+
+@db_liveness_ping(ClientType.TASK)
+def maintain_partitions() -> tuple[int, int] | None:
+    """Create the upcoming partitions of the secret table, and drop the
+    partitions whose secrets have all expired.
+
+    Only scheduled with a partitioned table, by the worker holding the
+    partitions lease.
+    """
+    flask_app = scheduler.app
+    with flask_app.app_context():
+        if not partitions_lease.acquire(_lease_ttl(flask_app)):
+            logger.debug("Not the partitions leader, skipping run.")
+            return None
+
+        repository = cast("PartitionedSqlSecretRepository",
+                          get_repository(flask_app))
+        created, dropped = repository.maintain()
+        logger.info(
+            "%s partitions have been created, %s expired partitions "
+            "have been dropped.",
+            created,
+            dropped)
+    return created, dropped
+
 
 @db_liveness_ping(ClientType.TASK)
-def delete_expired_records() -> None:
-    """Delete expired secrets from the database."""
-    with scheduler.app.app_context():
-        expired_secrets = db.session.query(model.Secret).filter(
-            model.Secret.has_expired()).all()
-        _delete_records(expired_secrets)
-        logger.info("%s expired records have been deleted.",
-                    len(expired_secrets))
-
-
-def _delete_records(records: Iterable[model.Secret]) -> None:
-    for record in records:
-        db.session.delete(record)
-    db.session.commit()
+def delete_expired_blobs() -> int | None:
+    """Delete the blobs of the expired large secrets.
+
+    The secrets themselves are deleted by the reaper or expired by their
+    storage. Only the worker holding the blobs lease runs the job. Without
+    a database to store the lease, every worker runs it, deleting a blob
+    twice being harmless.
+    """
+    flask_app = scheduler.app
+    with flask_app.app_context():
+        if get_repository(flask_app).uses_database and not blobs_lease.acquire(
+                _lease_ttl(flask_app)):
+            logger.debug("Not the blobs leader, skipping run.")
+            return None
+
+        deleted = get_blob_store(flask_app).delete_expired()
+        logger.info("%s expired blobs have been deleted.", deleted)
+    return deleted
+
+
+def _lease_ttl(flask_app: Flask) -> float:
+    """SHHH_SCHEDULER_LEASE_TTL, raised above the longest job interval so a
+    live leader never loses its lease between two runs."""
+    ttl: float = flask_app.config["SHHH_SCHEDULER_LEASE_TTL"]
+    longest: float = max(flask_app.config["SHHH_REAPER_INTERVAL"],
+                         flask_app.config["SHHH_REAPER_MAX_INTERVAL"],
+                         MAINTAIN_PARTITIONS_INTERVAL)
+    return max(ttl, longest + LEASE_TTL_MARGIN)
+
+
+def _count_active(repository: SecretRepository) -> int | None:
+    """Count the active secrets, unless counted in the last
+    ACTIVE_COUNT_INTERVAL seconds."""
+    global _active_counted_at
+    now = time.monotonic()
+    if (_active_counted_at is not None
+            and now - _active_counted_at < ACTIVE_COUNT_INTERVAL):
+        return None
+    _active_counted_at = now
+    return repository.count_active()
+
+
+def _delete_expired_chunks(repository: SecretRepository,
+                           chunk_size: int,
+                           max_runtime: float) -> ReaperStats:
+    started = time.monotonic()
+    deleted = 0
+    while True:
+        chunk = repository.purge_expired(chunk_size)
+        deleted += chunk
+        if chunk < chunk_size:
+            backlog = 0
+            break
+        if time.monotonic() - started >= max_runtime:
+            backlog = repository.count_expired()
+            break
+    return ReaperStats(deleted=deleted,
+                       elapsed=time.monotonic() - started,
+                       backlog=backlog)
+
+
+def _next_interval(current: float,
+                   stats: ReaperStats,
+                   base: float,
+                   minimum: float,
+                   maximum: float) -> float:
+    if stats.backlog:
+        # the run has been cut short, catch up as soon as possible
+        return minimum
+    if not stats.deleted:
+        # nothing to do, back off
+        return min(max(current, base) * 2, maximum)
+    return min(max(base, minimum), maximum)
+
+
+def _adapt_interval(flask_app: Flask, stats: ReaperStats) -> None:
+    job = scheduler.get_job(DELETE_EXPIRED_RECORDS_JOB)
+    if job is None:
+        return
+    current = job.trigger.interval.total_seconds()
+    interval = _next_interval(current,
+                              stats,
+                              flask_app.config["SHHH_REAPER_INTERVAL"],
+                              flask_app.config["SHHH_REAPER_MIN_INTERVAL"],
+                              flask_app.config["SHHH_REAPER_MAX_INTERVAL"])
+    if interval == current:
+        return
+
+    logger.info("Rescheduling %s to run every %ss",
+                DELETE_EXPIRED_RECORDS_JOB,
+                interval)
+    trigger = IntervalTrigger(seconds=interval,
+                              timezone=scheduler.scheduler.timezone)
+    changes: dict[str, Any] = {"trigger": trigger}
+    if job.next_run_time is not None:
+        # do not resume the job if it has been paused
+        changes["next_run_time"] = trigger.get_next_fire_time(
+            None, datetime.now(scheduler.scheduler.timezone))
+    job.modify(**changes)
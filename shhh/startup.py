@@ -0,0 +1,130 @@
+"""Startup timing and warm-up of the application.
+
+`create_app` times each step of the creation of the application, and
+`warm_up` initialises what the first requests would otherwise pay for: the
+connections of the database pool, the key derivation workers and the
+OpenSSL bindings, and the compiled templates. It runs in each worker before
+it serves requests (see `gunicorn.conf.py`, and the lifespan of the ASGI
+application).
+
+`flask startup-profile` reports the duration of each phase of a cold start,
+imports included, by running this module in a new process.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import secrets
+import time
+from typing import TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+    from typing import Iterator
+
+    from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_NAME = "shhh.startup"
+
+
+class StartupTiming:
+    """Durations of the phases of the startup, in seconds."""
+
+    def __init__(self) -> None:
+        self.phases: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (self.phases.get(name, 0.0) +
+                                 time.perf_counter() - started)
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {duration * 1000:.0f}ms"
+                         for name, duration in self.phases.items())
+
+
+def get_startup_timing(app: Flask) -> StartupTiming:
+    return cast(StartupTiming,
+                app.extensions.setdefault(EXTENSION_NAME, StartupTiming()))
+
+
+def _warm_up_db_pool(app: Flask) -> None:
+    from sqlalchemy import QueuePool, text
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from shhh.extensions import db
+
+    engine = db.engine
+    # open the connections the pool keeps, rather than on the first requests
+    size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+    with contextlib.ExitStack() as stack:
+        try:
+            for _ in range(size):
+                connection = stack.enter_context(engine.connect())
+                connection.execute(text("SELECT 1"))
+        except SQLAlchemyError as exc:
+            # the liveness check answers the requests until it is reachable
+            logger.warning("Could not connect to the database: %s", exc)
+
+
+def _warm_up_crypto() -> None:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    from shhh.domain.kdf import KdfParams, kdf_pool
+
+    # load the OpenSSL bindings of the key derivation and encryption
+    key = KdfParams("pbkdf2", (1, )).derive(b"warm-up",
+                                            secrets.token_bytes(16))
+    nonce = secrets.token_bytes(12)
+    AESGCM(key).decrypt(nonce,
+                        AESGCM(key).encrypt(nonce, b"warm-up", None),
+                        None)
+    kdf_pool.warm_up()
+
+
+def _warm_up_templates(app: Flask) -> None:
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+
+def warm_up(app: Flask) -> None:
+    """Initialise the database pool, cryptography and templates before the
+    first requests."""
+    timing = get_startup_timing(app)
+    with app.app_context():
+        with timing.phase("db_pool"):
+            _warm_up_db_pool(app)
+        with timing.phase("crypto"):
+            _warm_up_crypto()
+        with timing.phase("templates"):
+            _warm_up_templates(app)
+    logger.info("Worker %s ready in %.0fms (%s)",
+                os.getpid(),
+                timing.total * 1000,
+                timing.summary())
+
+
+def profile_startup() -> dict[str, float]:
+    """Start the application, return the duration of each phase."""
+    started = time.perf_counter()
+    from shhh.entrypoint import create_app
+    imports = time.perf_counter() - started
+
+    app = create_app(os.environ.get("FLASK_ENV"))  # type: ignore[arg-type]
+    warm_up(app)
+    return {"imports": imports, **get_startup_timing(app).phases}
+
+
+if __name__ == "__main__":
+    print(json.dumps(profile_startup()))
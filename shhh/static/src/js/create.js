@@ -10,28 +10,31 @@ const status = {
   ERROR: "error"
 }
 
+// the server can't check the strength of the passphrases it never sees
+const passphrasePattern = /^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9]).{8,}$/;
+
 createSecretForm.addEventListener("submit", (e) => {
   e.preventDefault();
   createBtn.classList.add("is-loading");
 
-  let headers = new Headers([
-    ["Content-Type", "application/json"],
-    ["Accept", "application/json"],
-  ]);
-
   let formData = new FormData(createSecretForm);
   let object = {};
   formData.forEach((value, key) => (object[key] = value));
 
+  const clientAction = createSecretForm.getAttribute("data-client-action");
+  if (clientAction && !passphrasePattern.test(object.passphrase)) {
+    errorResponseHandler({
+      response: {
+        details: "Sorry, your passphrase is too weak. It needs minimum 8 " +
+          "characters, with 1 number and 1 uppercase.",
+      },
+    });
+    return;
+  }
+
   createSecretFs.setAttribute("disabled", "disabled");  // lock form
 
-  fetch(createSecretForm.getAttribute("action"), {
-    method: createSecretForm.getAttribute("method"),
-    headers: headers,
-    body: JSON.stringify(object),
-    cache: "no-store",
-  })
-    .then((res) => res.json())
+  (clientAction ? createClientSecret(clientAction, object) : createSecret(object))
     .then((data) => {
       switch (data.response.status) {
         case status.CREATED:
@@ -44,6 +47,37 @@ createSecretForm.addEventListener("submit", (e) => {
     });
 });
 
+function postJson(endpoint, object) {
+  let headers = new Headers([
+    ["Content-Type", "application/json"],
+    ["Accept", "application/json"],
+  ]);
+
+  return fetch(endpoint, {
+    method: createSecretForm.getAttribute("method"),
+    headers: headers,
+    body: JSON.stringify(object),
+    cache: "no-store",
+  }).then((res) => res.json());
+}
+
+function createSecret(object) {
+  return postJson(createSecretForm.getAttribute("action"), object);
+}
+
+// encrypt the secret in the browser, neither the secret nor the passphrase
+// are sent
+async function createClientSecret(endpoint, object) {
+  const iterations = Number(createSecretForm.getAttribute("data-iterations"));
+  const encrypted = await encryptSecret(
+    object.secret, object.passphrase, iterations);
+  return postJson(endpoint, {
+    ...encrypted,
+    expire: object.expire,
+    tries: object.tries,
+  });
+}
+
 function successResponseHandler(data) {
   let params = new URLSearchParams();
   params.set("link", data.response.link);
@@ -0,0 +1,77 @@
+// Encryption of the secrets in the browser, when SHHH_CLIENT_ENCRYPTION is
+// set. A key is derived from the passphrase with PBKDF2-SHA256, and split
+// with HKDF into the AES-GCM key of the secret, and a key proving the
+// passphrase is known. The server only stores the ciphertext and the SHA-256
+// of the proof, and sends the ciphertext back to whoever sends the proof.
+
+const encoder = new TextEncoder();
+
+function toBase64(bytes) {
+  return btoa(String.fromCharCode(...new Uint8Array(bytes)))
+    .replaceAll("+", "-")
+    .replaceAll("/", "_")
+    .replace(/=+$/, "");
+}
+
+function fromBase64(value) {
+  const binary = atob(value.replaceAll("-", "+").replaceAll("_", "/"));
+  return Uint8Array.from(binary, (c) => c.charCodeAt(0));
+}
+
+function hkdfParams(info) {
+  return {
+    name: "HKDF",
+    hash: "SHA-256",
+    salt: new Uint8Array(),
+    info: encoder.encode(info),
+  };
+}
+
+async function deriveKeys(passphrase, salt, iterations) {
+  const material = await crypto.subtle.importKey(
+    "raw", encoder.encode(passphrase), "PBKDF2", false, ["deriveBits"]);
+  const bits = await crypto.subtle.deriveBits(
+    { name: "PBKDF2", hash: "SHA-256", salt: salt, iterations: iterations },
+    material,
+    256
+  );
+  const master = await crypto.subtle.importKey(
+    "raw", bits, "HKDF", false, ["deriveBits", "deriveKey"]);
+  const key = await crypto.subtle.deriveKey(
+    hkdfParams("shhh encryption"),
+    master,
+    { name: "AES-GCM", length: 256 },
+    false,
+    ["encrypt", "decrypt"]
+  );
+  const proof = await crypto.subtle.deriveBits(
+    hkdfParams("shhh proof"), master, 256);
+  return { key: key, proof: new Uint8Array(proof) };
+}
+
+// Return the fields of a request creating the secret, nonce and ciphertext
+// being sent together.
+async function encryptSecret(secret, passphrase, iterations) {
+  const salt = crypto.getRandomValues(new Uint8Array(16));
+  const nonce = crypto.getRandomValues(new Uint8Array(12));
+  const { key, proof } = await deriveKeys(passphrase, salt, iterations);
+  const ciphertext = new Uint8Array(await crypto.subtle.encrypt(
+    { name: "AES-GCM", iv: nonce }, key, encoder.encode(secret)));
+
+  const data = new Uint8Array(nonce.length + ciphertext.length);
+  data.set(nonce);
+  data.set(ciphertext, nonce.length);
+  return {
+    ciphertext: toBase64(data),
+    salt: toBase64(salt),
+    iterations: iterations,
+    verifier: toBase64(await crypto.subtle.digest("SHA-256", proof)),
+  };
+}
+
+async function decryptSecret(ciphertext, key) {
+  const data = fromBase64(ciphertext);
+  const message = await crypto.subtle.decrypt(
+    { name: "AES-GCM", iv: data.slice(0, 12) }, key, data.slice(12));
+  return new TextDecoder().decode(message);
+}
@@ -1,24 +1,31 @@
 const status = {
   INVALID: "invalid",
   EXPIRED: "expired",
-  SUCCESS: "success"
+  SUCCESS: "success",
+  FOUND: "found",
+  DOWNLOADED: "downloaded"
 }
 
+// the page is the same for every secret, the id is taken from the URL
+externalId.value = decodeURIComponent(location.pathname.split("/").pop());
+
 readSecretForm.addEventListener("submit", (e) => {
   e.preventDefault();
 
   decryptBtn.classList.add("is-loading");
 
-  let endpoint = readSecretForm.getAttribute("action");
-  let params = new URLSearchParams(new FormData(readSecretForm)).toString();
+  const clientAction = readSecretForm.getAttribute("data-client-action");
 
   readSecretFs.setAttribute("disabled", "disabled");  // lock form
 
-  fetch(`${endpoint}?${params}`, {
-    method: readSecretForm.getAttribute("method"),
-    cache: "no-store",
-  })
-    .then((res) => res.json())
+  let read = readSecret;
+  if (readSecretForm.hasAttribute("data-file")) {
+    read = readFile;
+  } else if (clientAction) {
+    read = () => readClientSecret(clientAction);
+  }
+
+  read()
     .then((data) => {
       switch (data.response.status) {
         case status.INVALID:
@@ -32,10 +39,91 @@ readSecretForm.addEventListener("submit", (e) => {
           successResponseHandler(data);
           makeCopyable();
           break;
+        case status.DOWNLOADED:
+          errorResponseHandler(data, "is-primary");
+          break;
       }
     });
 });
 
+function getJson(url) {
+  return fetch(url, {
+    method: readSecretForm.getAttribute("method"),
+    cache: "no-store",
+  }).then((res) => res.json());
+}
+
+function readSecret() {
+  let endpoint = readSecretForm.getAttribute("action");
+  let params = new URLSearchParams(new FormData(readSecretForm)).toString();
+  return getJson(`${endpoint}?${params}`);
+}
+
+// derive the key in the browser, and decrypt the secret sent back once the
+// key is proven to be the right one, the passphrase is never sent
+async function readClientSecret(endpoint) {
+  let params = new URLSearchParams({ external_id: externalId.value });
+  const kdfEndpoint = readSecretForm.getAttribute("data-kdf-action");
+  const found = await getJson(`${kdfEndpoint}?${params.toString()}`);
+  if (found.response.status !== status.FOUND) {
+    return found;
+  }
+  if (!found.response.client_encrypted) {
+    return readSecret();  // encrypted by the server
+  }
+
+  const { key, proof } = await deriveKeys(
+    passphrase.value,
+    fromBase64(found.response.salt),
+    found.response.iterations
+  );
+  params.set("proof", toBase64(proof));
+  const data = await getJson(`${endpoint}?${params.toString()}`);
+  if (data.response.status === status.SUCCESS) {
+    data.response.msg = await decryptSecret(data.response.msg, key);
+  }
+  return data;
+}
+
+function attachmentName(res) {
+  const disposition = res.headers.get("Content-Disposition") || "";
+  const encoded = disposition.match(/filename\*=UTF-8''([^;]+)/i);
+  if (encoded) {
+    return decodeURIComponent(encoded[1]);
+  }
+  const plain = disposition.match(/filename="?([^";]+)"?/i);
+  return plain ? plain[1] : "secret";
+}
+
+// the content of the file is sent as is, errors as JSON, the passphrase is
+// sent in a header to keep it out of the access logs
+async function readFile() {
+  let endpoint = readSecretForm.getAttribute("action");
+  let params = new URLSearchParams({ external_id: externalId.value });
+  const res = await fetch(`${endpoint}?${params.toString()}`, {
+    method: readSecretForm.getAttribute("method"),
+    cache: "no-store",
+    headers: { "X-Shhh-Passphrase": passphrase.value },
+  });
+  if ((res.headers.get("Content-Type") || "").includes("application/json")) {
+    return res.json();
+  }
+
+  const name = attachmentName(res);
+  const url = URL.createObjectURL(await res.blob());
+  const link = document.createElement("a");
+  link.href = url;
+  link.download = name;
+  link.click();
+  URL.revokeObjectURL(url);
+  return {
+    response: {
+      status: status.DOWNLOADED,
+      msg: `${name} has been downloaded and deleted.`,
+    },
+  };
+}
+
 function successResponseHandler(data) {
   let content = notificationSecretTemplate.content.cloneNode(true);
   notification.innerHTML = "";
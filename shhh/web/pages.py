@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from flask import current_app as app, make_response, render_template, request
+
+from shhh import profiling
+from shhh.compression import ENCODERS
+
+if TYPE_CHECKING:
+    from typing import Hashable
+
+    from flask import Response
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    body: str
+    etag: str
+
+
+class PageCache:
+    """Rendered pages, memoized per template and context.
+
+    Only used when the CSP relies on hashes, as a per-request nonce makes
+    every rendered page unique.
+    """
+
+    def __init__(self) -> None:
+        self._pages: dict[Hashable, CachedPage] = {}
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+
+    def get_or_render(self, template_name: str, **context) -> CachedPage:
+        key = (template_name, tuple(sorted(context.items())))
+        if (page := self._pages.get(key)) is not None:
+            return page
+
+        with profiling.phase("render"):
+            body = render_template(template_name, **context)
+        etag = hashlib.sha256(body.encode()).hexdigest()[:32]
+        page = CachedPage(body=body, etag=etag)
+        with self._lock:
+            self._pages[key] = page
+        return page
+
+
+page_cache = PageCache()
+
+
+def _get_matching_etag(etag: str) -> str | None:
+    # compressed representations get their own strong ETag, suffixed with
+    # their encoding
+    candidates = [etag] + [f"{etag}-{encoding}" for encoding in ENCODERS]
+    for candidate in candidates:
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def render_page(template_name: str,
+                status: int = 200,
+                **context: Hashable) -> Response:
+    """Render a page that does not depend on the request.
+
+    When SHHH_CSP_MODE is `hash`, the page is rendered once and served from
+    memory with a strong ETag, answering conditional requests with a 304.
+    """
+    if app.config["SHHH_CSP_MODE"] != "hash":
+        with profiling.phase("render"):
+            body = render_template(template_name, **context)
+        return make_response(body, status)
+
+    page = page_cache.get_or_render(template_name, **context)
+    if status == 200 and (etag := _get_matching_etag(page.etag)):
+        response = make_response("", 304)
+        response.set_etag(etag)
+    else:
+        response = make_response(page.body, status)
+        response.set_etag(page.etag)
+    response.cache_control.no_cache = True
+    return response
@@ -9,18 +9,22 @@ from shhh.constants import (DEFAULT_EXPIRATION_TIME_VALUE,
                             DEFAULT_READ_TRIES_VALUE,
                             READ_TRIES_VALUES,
                             EXPIRATION_TIME_VALUES)
+from shhh.web.pages import render_page
 
 web = Blueprint("web", __name__, url_prefix="/")
 
 
 @web.get("/")
-def create() -> str:
-    return rt("create.html",
-              secret_max_length=app.config["SHHH_SECRET_MAX_LENGTH"],
-              expiration_time_values=EXPIRATION_TIME_VALUES,
-              default_expiration_time_value=DEFAULT_EXPIRATION_TIME_VALUE,
-              read_tries_values=READ_TRIES_VALUES,
-              default_read_tries_value=DEFAULT_READ_TRIES_VALUE)
+def create() -> Response:
+    return render_page(
+        "create.html",
+        secret_max_length=app.config["SHHH_SECRET_MAX_LENGTH"],
+        expiration_time_values=tuple(EXPIRATION_TIME_VALUES.items()),
+        default_expiration_time_value=DEFAULT_EXPIRATION_TIME_VALUE,
+        read_tries_values=READ_TRIES_VALUES,
+        default_read_tries_value=DEFAULT_READ_TRIES_VALUE,
+        client_encryption=app.config["SHHH_CLIENT_ENCRYPTION"],
+        client_kdf_iterations=app.config["SHHH_CLIENT_KDF_ITERATIONS"])
 
 
 @web.get("/secret")
@@ -32,8 +36,16 @@ def created() -> str | Response:
 
 
 @web.get("/secret/<external_id>")
-def read(external_id: str) -> str:
-    return rt("read.html", external_id=external_id)
+def read(external_id: str) -> Response:
+    # the external id is read from the URL client side, so the page is the
+    # same for every secret
+    return render_page("read.html",
+                       client_encryption=app.config["SHHH_CLIENT_ENCRYPTION"])
+
+
+@web.get("/file/<external_id>")
+def read_file(external_id: str) -> Response:
+    return render_page("read.html", file=True)
 
 
 @web.get("/robots.txt")
@@ -1,9 +1,14 @@
+from unittest import mock
+
 import pytest
+from sqlalchemy import create_engine
 
 from shhh.adapters import orm
+from shhh.adapters.gone_cache import gone_cache
 from shhh.constants import EnvConfig
 from shhh.entrypoint import create_app
 from shhh.extensions import db
+from shhh.liveness import db_health
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -28,7 +33,25 @@ def session(app):
     for table in reversed(orm.metadata.sorted_tables):
         db.session.execute(table.delete())
 
+    db_health.reset()
+    gone_cache.clear()
+
     yield
 
     db.session.rollback()
     context.pop()
+
+
+@pytest.fixture
+def file_database(app, tmp_path):
+    """Database in a file, for the tests running concurrent transactions:
+    each thread gets its own connection, while the in memory database shares
+    a single one."""
+    db.session.rollback()
+    engine = create_engine(f"sqlite:///{tmp_path / 'shhh.db'}",
+                           connect_args={"timeout": 30})
+    orm.metadata.create_all(engine)
+    with mock.patch.dict(db._app_engines[app], {None: engine}):
+        yield engine
+        db.session.remove()
+    engine.dispose()
@@ -1,4 +1,8 @@
-from datetime import datetime, timedelta
+import hashlib
+import secrets
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
 from unittest.mock import patch
 from urllib.parse import urlparse
@@ -6,8 +10,11 @@ from urllib.parse import urlparse
 import pytest
 from flask import url_for
 
+from shhh.adapters.blobs import BlobNotFound, get_blob_store
+from shhh.api.handlers import ReadHandler
 from shhh.constants import Message, Status
 from shhh.domain import model
+from shhh.domain.kdf import KdfPoolBusy, kdf_pool
 from shhh.extensions import db
 
 
@@ -16,6 +23,27 @@ def post_payload() -> dict[str, str]:
     return {"secret": "message", "passphrase": "Hello123", "expire": "3d"}
 
 
+def _b64(data: bytes) -> str:
+    return urlsafe_b64encode(data).decode().rstrip("=")
+
+
+@pytest.fixture
+def proof() -> bytes:
+    return secrets.token_bytes(32)
+
+
+@pytest.fixture
+def client_payload(proof) -> dict[str, str | int]:
+    return {
+        "ciphertext": _b64(secrets.token_bytes(12 + 7 + 16)),
+        "salt": _b64(secrets.token_bytes(16)),
+        "iterations": 600000,
+        "verifier": _b64(hashlib.sha256(proof).digest()),
+        "expire": "3d",
+        "tries": 3
+    }
+
+
 @pytest.fixture
 def secret(post_payload) -> model.Secret:
     secret = model.Secret.encrypt(message=post_payload["secret"],
@@ -151,6 +179,20 @@ def test_api_message_expired(app):
     assert data["response"]["msg"] == Message.NOT_FOUND
 
 
+def test_api_read_expired_secret_before_reaper(app, secret, post_payload):
+    # expired, but not deleted yet by the reaper
+    secret.date_expires = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.session.commit()
+
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(
+            url_for("api.secret",
+                    external_id=secret.external_id,
+                    passphrase=post_payload["passphrase"]))
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.get_json()["response"]["msg"] == Message.NOT_FOUND
+
+
 def test_api_read_secret(app, secret, post_payload):
     external_id = secret.external_id
     with app.test_request_context(), app.test_client() as test_client:
@@ -190,3 +232,353 @@ def test_secret_encrypt_invalid_expire_code():
         model.Secret.encrypt(message="test",
                              passphrase="Hello123",
                              expire_code="1x")
+
+
+@pytest.mark.parametrize("method", ("get", "post"))
+def test_api_kdf_pool_busy(app, secret, post_payload, method):
+    with app.test_request_context(), app.test_client() as test_client:
+        with patch("shhh.domain.model.kdf_pool.run", side_effect=KdfPoolBusy):
+            if method == "get":
+                response = test_client.get(
+                    url_for("api.secret",
+                            external_id=secret.external_id,
+                            passphrase=post_payload["passphrase"]))
+            else:
+                response = test_client.post(url_for("api.secret"),
+                                            json=post_payload)
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+    data = response.get_json()
+    assert data["response"]["status"] == Status.ERROR
+    assert data["response"]["details"] == Message.BUSY
+
+    # the secret must not have been consumed
+    db.session.refresh(secret)
+    assert secret.tries == 5
+
+
+def _read_concurrently(app, external_id, passphrase, count=16):
+
+    def read(_):
+        with app.app_context():
+            response, code = ReadHandler(external_id, passphrase).handle()
+            return code, response.msg
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(read, range(count)))
+
+
+def test_api_read_secret_concurrently_burns_once(app,
+                                                 file_database,
+                                                 secret,
+                                                 post_payload):
+    results = _read_concurrently(app,
+                                 secret.external_id,
+                                 post_payload["passphrase"])
+    codes = [code for code, _ in results]
+    assert codes.count(HTTPStatus.OK) == 1
+    assert codes.count(HTTPStatus.NOT_FOUND) == len(results) - 1
+
+
+def test_api_wrong_passphrase_concurrently_decrements_tries(
+        app, file_database, secret):
+    results = _read_concurrently(app, secret.external_id, "wrong!")
+    messages = [msg for _, msg in results]
+
+    # every try has been accounted for, exactly once
+    assert messages.count(Message.EXCEEDED) == 1
+    for remaining in range(1, secret.tries):
+        assert messages.count(Message.INVALID.format(remaining=remaining)) == 1
+    assert messages.count(Message.NOT_FOUND) == len(results) - secret.tries
+
+
+def test_api_bulk_create_secrets(app, post_payload):
+    payload = {"secrets": [post_payload, {**post_payload, "tries": 3}]}
+    with app.test_request_context(), app.test_client() as test_client:
+        with patch.object(kdf_pool, "_size", 2):
+            response = test_client.post(url_for("api.secrets"), json=payload)
+    assert response.status_code == HTTPStatus.CREATED
+    data = response.get_json()["response"]
+    assert data["created"] == 2
+    external_ids = [result["external_id"] for result in data["results"]]
+    for result in data["results"]:
+        assert result["status"] == Status.CREATED
+        assert result["link"].endswith(f"/secret/{result['external_id']}")
+
+    records = db.session.query(model.Secret).filter(
+        model.Secret.external_id.in_(external_ids)).all()
+    assert sorted(r.tries for r in records) == [3, 5]
+    for record in records:
+        assert record.decrypt(post_payload["passphrase"]) == "message"
+
+
+def test_api_bulk_create_secrets_partially_invalid(app, post_payload):
+    payload = {
+        "secrets": [{
+            **post_payload, "passphrase": "weak"
+        },
+                    post_payload,
+                    "not a secret"]
+    }
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.post(url_for("api.secrets"), json=payload)
+    assert response.status_code == HTTPStatus.MULTI_STATUS
+    data = response.get_json()["response"]
+    assert data["created"] == 1
+    invalid, created, malformed = data["results"]
+    assert invalid["status"] == Status.ERROR
+    assert invalid["details"].startswith("Sorry, your passphrase is too weak")
+    assert created["status"] == Status.CREATED
+    assert malformed == {
+        "status": Status.ERROR, "details": "Invalid input type."
+    }
+
+
+def test_api_bulk_create_secrets_all_invalid(app, post_payload):
+    payload = {"secrets": [{**post_payload, "expire": "12m"}]}
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.post(url_for("api.secrets"), json=payload)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.get_json()["response"]["created"] == 0
+
+
+@pytest.mark.parametrize("size", (0, 3))
+def test_api_bulk_create_secrets_size_limit(app, post_payload, size):
+    payload = {"secrets": [post_payload] * size}
+    with app.test_request_context(), app.test_client() as test_client:
+        with patch.dict(app.config, {"SHHH_BULK_MAX_SECRETS": 2}):
+            response = test_client.post(url_for("api.secrets"), json=payload)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.get_json()["response"]["details"] == (
+        "Between 1 and 2 secrets can be created at once.")
+
+
+def test_api_bulk_create_secrets_kdf_pool_busy(app, post_payload):
+    payload = {"secrets": [post_payload] * 2}
+    with app.test_request_context(), app.test_client() as test_client:
+        with patch.object(model.Secret, "_derive_key",
+                          side_effect=KdfPoolBusy):
+            response = test_client.post(url_for("api.secrets"), json=payload)
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_api_client_secret(app, client_payload, proof):
+    with patch.object(kdf_pool, "run") as run, \
+            app.test_request_context(), app.test_client() as test_client:
+        created = test_client.post(url_for("api.client_secret"),
+                                   json=client_payload)
+        external_id = created.get_json()["response"]["external_id"]
+        found = test_client.get(url_for("api.kdf", external_id=external_id))
+        read = test_client.get(
+            url_for("api.client_secret",
+                    external_id=external_id,
+                    proof=_b64(proof)))
+        read_again = test_client.get(
+            url_for("api.client_secret",
+                    external_id=external_id,
+                    proof=_b64(proof)))
+    # the server never derives the key
+    run.assert_not_called()
+
+    assert created.status_code == HTTPStatus.CREATED
+    assert found.status_code == HTTPStatus.OK
+    assert found.get_json()["response"] == {
+        "status": Status.FOUND,
+        "client_encrypted": True,
+        "kdf": "pbkdf2",
+        "iterations": 600000,
+        "salt": client_payload["salt"] + "=="
+    }
+    assert read.status_code == HTTPStatus.OK
+    data = read.get_json()["response"]
+    assert data["status"] == Status.SUCCESS
+    assert data["msg"].rstrip("=") == client_payload["ciphertext"]
+    assert read_again.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_api_client_secret_wrong_proof(app, client_payload):
+    with app.test_request_context(), app.test_client() as test_client:
+        created = test_client.post(url_for("api.client_secret"),
+                                   json=client_payload)
+        external_id = created.get_json()["response"]["external_id"]
+        responses = [
+            test_client.get(
+                url_for("api.client_secret",
+                        external_id=external_id,
+                        proof=_b64(secrets.token_bytes(32)))) for _ in range(3)
+        ]
+    assert [response.status_code
+            for response in responses] == [HTTPStatus.UNAUTHORIZED] * 3
+    assert responses[0].get_json()["response"]["msg"] == (
+        Message.INVALID.value.format(remaining=2))
+    assert responses[-1].get_json()["response"]["msg"] == Message.EXCEEDED
+
+
+def test_api_client_secret_read_with_passphrase(app, client_payload):
+    with app.test_request_context(), app.test_client() as test_client:
+        created = test_client.post(url_for("api.client_secret"),
+                                   json=client_payload)
+        response = test_client.get(
+            url_for("api.secret",
+                    external_id=created.get_json()["response"]["external_id"],
+                    passphrase="Hello123"))
+    assert response.status_code == HTTPStatus.CONFLICT
+    assert response.get_json()["response"]["msg"] == (
+        Message.WRONG_ENDPOINT.format(endpoint="/api/secret/client"))
+
+
+def test_api_client_read_of_server_encrypted_secret(app, secret, proof):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(
+            url_for("api.client_secret",
+                    external_id=secret.external_id,
+                    proof=_b64(proof)))
+    assert response.status_code == HTTPStatus.CONFLICT
+    assert response.get_json()["response"]["msg"] == (
+        Message.WRONG_ENDPOINT.format(endpoint="/api/secret"))
+    assert db.session.get(model.Secret, secret.id).tries == secret.tries
+
+
+def test_api_kdf_of_server_encrypted_secret(app, secret):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(
+            url_for("api.kdf", external_id=secret.external_id))
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json()["response"]["client_encrypted"] is False
+    assert response.get_json()["response"]["salt"] is None
+
+
+def test_api_kdf_not_found(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("api.kdf", external_id="gone"))
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    "field, value, details",
+    (("iterations", 1000, "At least 600000 iterations are needed."),
+     ("salt", _b64(b"salt"), "Length must be 16."),
+     ("verifier", "not base64!", "Not a valid base64 string."),
+     ("ciphertext",
+      _b64(secrets.token_bytes(3 * 20 + 12 + 16 + 1)),
+      "The ciphertext should not exceed 88 bytes."),
+     ))
+def test_api_client_secret_invalid(app, client_payload, field, value, details):
+    client_payload[field] = value
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.post(url_for("api.client_secret"),
+                                    json=client_payload)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.get_json()["response"]["details"] == details
+
+
+def _upload_file(test_client, content, passphrase="Hello123", **params):
+    return test_client.post(url_for("api.file", name="report.pdf", **params),
+                            data=content,
+                            headers={"X-Shhh-Passphrase": passphrase},
+                            content_type="application/octet-stream")
+
+
+def test_api_file(app):
+    content = secrets.token_bytes(200000)
+    with app.test_request_context(), app.test_client() as test_client:
+        response = _upload_file(test_client, content)
+        assert response.status_code == HTTPStatus.CREATED
+        data = response.get_json()["response"]
+        assert urlparse(data["link"]).path == f"/file/{data['external_id']}"
+
+        response = test_client.get(
+            url_for("api.file",
+                    external_id=data["external_id"],
+                    passphrase="Hello123"))
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == "application/octet-stream"
+        assert response.headers["Content-Disposition"] == (
+            "attachment; filename=report.pdf")
+        assert response.data == content
+
+        response = test_client.get(
+            url_for("api.file",
+                    external_id=data["external_id"],
+                    passphrase="Hello123"))
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_api_file_passphrase_in_url_refused(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.post(url_for("api.file",
+                                            passphrase="Hello123",
+                                            name="report.pdf"),
+                                    data=b"content",
+                                    content_type="application/octet-stream")
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.get_json()["response"]["details"] == (
+        "Missing data for required field.")
+
+
+def test_api_file_passphrase_header(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = _upload_file(test_client, b"content")
+        external_id = response.get_json()["response"]["external_id"]
+
+        # the header takes precedence over the query argument
+        response = test_client.get(url_for("api.file",
+                                           external_id=external_id,
+                                           passphrase="wrong!"),
+                                   headers={"X-Shhh-Passphrase": "Hello123"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.data == b"content"
+
+
+def test_api_file_read_passphrase_missing(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("api.file", external_id="123"))
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.get_json()["response"]["details"] == (
+        "Missing data for required field.")
+
+
+def test_api_file_too_large(app):
+    with app.test_request_context(), app.test_client() as test_client, \
+            patch.dict(app.config, {"SHHH_FILE_MAX_SIZE": 1000}):
+        response = _upload_file(test_client, bytes(1001))
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert response.get_json()["response"]["details"] == (
+        "The file should not exceed 1000 bytes.")
+
+
+def test_api_file_exceeded_tries(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = _upload_file(test_client, b"content", tries=3)
+        external_id = response.get_json()["response"]["external_id"]
+        for _ in range(3):
+            response = test_client.get(
+                url_for("api.file",
+                        external_id=external_id,
+                        passphrase="wrong!"))
+            assert response.status_code == HTTPStatus.UNAUTHORIZED
+    assert response.get_json()["response"]["msg"] == Message.EXCEEDED
+
+    # the content has been deleted with the secret
+    with pytest.raises(BlobNotFound):
+        get_blob_store(app).pop(external_id)
+
+
+def test_api_file_read_as_message(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = _upload_file(test_client, b"content")
+        external_id = response.get_json()["response"]["external_id"]
+        response = test_client.get(
+            url_for("api.secret",
+                    external_id=external_id,
+                    passphrase="Hello123"))
+        assert response.status_code == HTTPStatus.CONFLICT
+        assert response.get_json()["response"]["msg"] == (
+            Message.WRONG_ENDPOINT.format(endpoint="/api/file"))
+
+        # no try has been used
+        response = test_client.get(
+            url_for("api.file", external_id=external_id,
+                    passphrase="Hello123"))
+    assert response.data == b"content"
@@ -0,0 +1,83 @@
+import pytest
+
+from benchmarks.__main__ import compare
+from benchmarks.stats import welch_t_test
+from benchmarks.suite import measure
+
+
+def _results(samples):
+    return {
+        "benchmarks": {
+            "op": {
+                "samples": samples, "mean": sum(samples) / len(samples)
+            }
+        }
+    }
+
+
+def test_welch_t_test():
+    # reference values from Welch's original example
+    a = [
+        27.5,
+        21.0,
+        19.0,
+        23.6,
+        17.0,
+        17.9,
+        16.9,
+        20.1,
+        21.9,
+        22.6,
+        23.1,
+        19.6,
+        19.0,
+        21.7,
+        21.4
+    ]
+    b = [
+        27.1,
+        22.0,
+        20.8,
+        23.4,
+        23.4,
+        23.5,
+        25.8,
+        22.0,
+        24.8,
+        20.2,
+        21.9,
+        22.1,
+        22.9,
+        20.5,
+        24.4
+    ]
+    t, p_value = welch_t_test(a, b)
+    assert t == pytest.approx(-2.46, abs=0.01)
+    assert p_value == pytest.approx(0.021, abs=0.001)
+
+
+def test_welch_t_test_no_variance():
+    assert welch_t_test([1.0, 1.0], [1.0, 1.0]) == (0.0, 1.0)
+    assert welch_t_test([1.0, 1.0], [2.0, 2.0])[1] == 0.0
+
+
+def test_compare_flags_significant_slowdown():
+    baseline = _results([1.0, 1.01, 0.99, 1.0, 1.02, 0.98])
+    slower = _results([1.2, 1.21, 1.19, 1.2, 1.22, 1.18])
+    assert compare(baseline, slower, alpha=0.01, threshold=0.05) == ["op"]
+    # faster, or not different enough, is not a regression
+    assert compare(slower, baseline, alpha=0.01, threshold=0.05) == []
+    assert compare(baseline, slower, alpha=0.01, threshold=0.5) == []
+
+
+def test_compare_ignores_noise():
+    baseline = _results([1.0, 1.5, 0.7, 1.2, 0.9, 1.1])
+    current = _results([1.1, 1.4, 0.8, 1.3, 1.0, 1.2])
+    assert compare(baseline, current, alpha=0.01, threshold=0.05) == []
+
+
+def test_measure_runs_setup_untimed():
+    calls = []
+    timings = measure(calls.append, 3, setup=lambda: (len(calls), ))
+    assert len(timings) == 3
+    assert calls == [0, 1, 2, 3]  # including the warmup
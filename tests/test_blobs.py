@@ -0,0 +1,100 @@
+import os
+import secrets
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from shhh.adapters import blobs
+from shhh.domain import stream
+
+EXPIRES = datetime.now(timezone.utc) + timedelta(days=1)
+
+
+@pytest.fixture(params=("file", "memory"))
+def store(request, tmp_path):
+    if request.param == "file":
+        return blobs.FileBlobStore(str(tmp_path))
+    return blobs.MemoryBlobStore()
+
+
+def test_write_and_pop(store):
+    assert store.write("blob_id", [b"hello ", b"world"], EXPIRES) == 11
+    with store.pop("blob_id") as blob:
+        assert blob.read() == b"hello world"
+    with pytest.raises(blobs.BlobNotFound):
+        store.pop("blob_id")
+
+
+def test_delete(store):
+    store.write("blob_id", [b"content"], EXPIRES)
+    store.delete("blob_id")
+    store.delete("blob_id")
+    with pytest.raises(blobs.BlobNotFound):
+        store.pop("blob_id")
+
+
+def test_delete_expired(store):
+    store.write("expired", [b"content"], EXPIRES - timedelta(days=2))
+    store.write("active", [b"content"], EXPIRES)
+    assert store.delete_expired() == 1
+    with pytest.raises(blobs.BlobNotFound):
+        store.pop("expired")
+    assert store.pop("active").read() == b"content"
+
+
+def test_file_store_failed_write(tmp_path):
+    store = blobs.FileBlobStore(str(tmp_path))
+
+    def chunks():
+        yield b"content"
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        store.write("blob_id", chunks(), EXPIRES)
+    with pytest.raises(blobs.BlobNotFound):
+        store.pop("blob_id")
+    assert os.listdir(tmp_path / "bl") == []
+
+
+def test_file_store_stale_upload(tmp_path):
+    store = blobs.FileBlobStore(str(tmp_path))
+    store.write("blob_id", [b"content"], EXPIRES)
+    upload = tmp_path / "bl" / ".upload"
+    upload.write_bytes(b"content")
+    assert store.delete_expired() == 0
+
+    stale = time.time() - store.stale_upload_age
+    os.utime(upload, (stale, stale))
+    assert store.delete_expired() == 1
+    assert os.listdir(tmp_path / "bl") == ["blob_id"]
+
+
+def test_file_store_invalid_id(tmp_path):
+    store = blobs.FileBlobStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.write("../blob_id", [b"content"], EXPIRES)
+
+
+def test_file_store_bounded_memory(tmp_path):
+    store = blobs.FileBlobStore(str(tmp_path))
+    cipher = stream.StreamCipher(secrets.token_bytes(32),
+                                 b"header",
+                                 secrets.token_bytes(7))
+    size = 64 * stream.CHUNK_SIZE
+
+    def content():
+        for _ in range(size // stream.CHUNK_SIZE):
+            yield bytes(stream.CHUNK_SIZE)
+
+    tracemalloc.start()
+    try:
+        store.write("blob_id", cipher.encrypt(content()), EXPIRES)
+        with store.pop("blob_id") as blob:
+            assert sum(len(chunk)
+                       for chunk in cipher.decrypt(blob.read)) == size
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 8 * stream.CHUNK_SIZE
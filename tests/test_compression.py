@@ -0,0 +1,111 @@
+import gzip
+import os
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+from flask import url_for
+
+from shhh.compression import (ENCODERS,
+                              compression_cache,
+                              precompress_static_files)
+from shhh.extensions import assets
+
+
+@pytest.fixture(autouse=True)
+def clear_compression_cache():
+    compression_cache.clear()
+
+
+def test_response_not_compressed_without_accept_encoding(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("web.create"))
+    assert response.status_code == HTTPStatus.OK
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+
+def test_response_compressed_with_gzip(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        plain = test_client.get(url_for("web.read", external_id="abc"))
+        response = test_client.get(url_for("web.read", external_id="abc"),
+                                   headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+
+
+@pytest.mark.skipif("br" not in ENCODERS, reason="brotli is not installed")
+def test_response_compressed_with_preferred_encoding(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(
+            url_for("web.create"),
+            headers={"Accept-Encoding": "gzip, deflate, br"})
+    assert response.headers["Content-Encoding"] == "br"
+
+
+def test_compressed_pages_are_cached(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        for _ in range(3):
+            test_client.get(url_for("web.created",
+                                    link="https://test.test/secret/abc",
+                                    expires_on="May 01, 2020"),
+                            headers={"Accept-Encoding": "gzip"})
+    assert compression_cache.misses == 1
+    assert compression_cache.hits == 2
+
+
+def test_json_response_compression(app):
+    url_kwargs = {"external_id": "123456", "passphrase": "Hello123"}
+    headers = {"Accept-Encoding": "gzip"}
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("api.secret", **url_kwargs),
+                                   headers=headers)
+        assert "Content-Encoding" not in response.headers
+
+        with patch.dict(
+                app.config, {
+                    "SHHH_COMPRESS_JSON": True, "SHHH_COMPRESSION_MIN_SIZE": 0
+                }):
+            response = test_client.get(url_for("api.secret", **url_kwargs),
+                                       headers=headers)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"] == "application/json"
+
+    # JSON bodies are never cached
+    assert compression_cache.hits == compression_cache.misses == 0
+
+
+def test_static_precompressed_variant(app, tmp_path):
+    with app.test_request_context(), app.test_client() as test_client:
+        asset_url = assets["read"].urls()[0]
+        path = os.path.join(app.static_folder,
+                            asset_url.removeprefix("/static/"))
+        precompressed = path + ".gz"
+        with open(precompressed, "wb") as f:
+            f.write(gzip.compress(b"precompressed"))
+        try:
+            response = test_client.get(asset_url,
+                                       headers={"Accept-Encoding": "gzip"})
+            response.close()
+        finally:
+            os.remove(precompressed)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.mimetype in ("text/javascript", "application/javascript")
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+
+def test_precompress_static_files(tmp_path):
+    (tmp_path / "app.min.js").write_text("const a = 1;" * 100)
+    (tmp_path / "logo.png").write_bytes(b"png")
+
+    written = list(precompress_static_files(str(tmp_path)))
+
+    assert str(tmp_path / "app.min.js.gz") in written
+    assert not any("logo.png" in path for path in written)
+    assert gzip.decompress(
+        (tmp_path / "app.min.js.gz").read_bytes()) == b"const a = 1;" * 100
@@ -23,3 +23,52 @@ def test_shhh_db_liveness_sleep_interval_invalid_value():
         from shhh import config
         importlib.reload(config)
         assert config.DefaultConfig.SHHH_DB_LIVENESS_SLEEP_INTERVAL == 1
+
+
+def test_shhh_db_pool_size_below_minimum():
+    with patch.dict(os.environ, {"SHHH_DB_POOL_SIZE": "0"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_DB_POOL_SIZE == 5
+
+
+def test_shhh_db_pool_invalid_value():
+    with patch.dict(os.environ, {"SHHH_DB_POOL": "invalid"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_DB_POOL == "queue"
+
+
+def test_shhh_db_isolation_level_is_normalized():
+    with patch.dict(os.environ, {"SHHH_DB_ISOLATION_LEVEL": "read committed"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_DB_ISOLATION_LEVEL == "READ COMMITTED"
+
+
+def test_shhh_csp_mode_invalid_value():
+    with patch.dict(os.environ, {"SHHH_CSP_MODE": "invalid"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_CSP_MODE == "hash"
+
+
+def test_shhh_storage_invalid_value():
+    with patch.dict(os.environ, {"SHHH_STORAGE": "invalid"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_STORAGE == "sql"
+
+
+def test_shhh_blob_store_invalid_value():
+    with patch.dict(os.environ, {"SHHH_BLOB_STORE": "invalid"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_BLOB_STORE == "file"
+
+
+def test_shhh_ratelimit_store_invalid_value():
+    with patch.dict(os.environ, {"SHHH_RATELIMIT_STORE": "invalid"}):
+        from shhh import config
+        importlib.reload(config)
+        assert config.DefaultConfig.SHHH_RATELIMIT_STORE == "shared"
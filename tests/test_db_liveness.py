@@ -1,9 +1,12 @@
+import time
 from http import HTTPStatus
 from unittest import mock
 
 from flask import url_for
 from sqlalchemy.exc import OperationalError
 
+from shhh.liveness import db_health
+
 
 @mock.patch("shhh.liveness._perform_db_connectivity_query",
             side_effect=OperationalError(None, None, None))
@@ -36,3 +39,42 @@ def test_db_liveness_table_does_not_exists(mock_check_table_exists,
     assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE  # 503
     assert ("Could not query required table 'secret', make sure it "
             "has been created on the database") in caplog.text
+
+
+def test_db_liveness_verdict_is_cached(app):
+    with mock.patch("shhh.liveness._perform_db_connectivity_query"
+                    ) as mock_ping, mock.patch(
+                        "shhh.liveness._check_table_exists",
+                        return_value=True) as mock_table_exists:
+        assert db_health.is_healthy(app)
+        assert db_health.is_healthy(app)
+
+    mock_ping.assert_called_once()
+    mock_table_exists.assert_called_once()
+
+
+def test_db_liveness_circuit_fails_fast_and_recovers(app):
+    with mock.patch.dict(app.config, {"SHHH_DB_LIVENESS_SLEEP_INTERVAL": 0.3}):
+        with mock.patch("shhh.liveness._perform_db_connectivity_query",
+                        side_effect=OperationalError(None, None,
+                                                     None)) as mock_ping:
+            assert not db_health.is_healthy(app)
+            assert db_health.is_open
+
+            # the circuit is open, requests do not reach the database
+            with app.test_request_context(), app.test_client() as client:
+                response = client.get(
+                    url_for("api.secret",
+                            external_id="123456",
+                            passphrase="Hello123"))
+            assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+            assert response.headers["Retry-After"] == "1"
+            mock_ping.assert_called_once()
+
+    # the database is back, the background probe closes the circuit
+    for _ in range(40):
+        if not db_health.is_open:
+            break
+        time.sleep(0.05)
+    assert not db_health.is_open
+    assert db_health.is_healthy(app)
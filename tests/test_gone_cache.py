@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from unittest import mock
+
+from flask import url_for
+
+from shhh import metrics
+from shhh.adapters import repository
+from shhh.adapters.gone_cache import GoneCache, gone_cache
+from shhh.constants import Message
+from shhh.domain import model
+from shhh.domain.kdf import KdfParams
+from shhh.extensions import db
+from shhh.liveness import db_health
+
+PASSPHRASE = "Hello123"
+FAST_KDF = KdfParams("pbkdf2", (1, ))
+
+
+def _create_secret(tries=3):
+    secret = model.Secret.encrypt(message="message",
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  tries=tries,
+                                  kdf=FAST_KDF)
+    db.session.add(secret)
+    db.session.commit()
+    return secret.external_id
+
+
+def _read(test_client, external_id, passphrase=PASSPHRASE):
+    return test_client.get(
+        url_for("api.secret", external_id=external_id, passphrase=passphrase))
+
+
+def test_cache_evicts_least_recently_used():
+    cache = GoneCache(max_size=2)
+    cache.update(["a", "b"])
+    assert cache.contains("a")
+    cache.add("c")
+    assert len(cache) == 2
+    assert cache.contains("a") and cache.contains("c")
+    assert not cache.contains("b")
+    assert cache.memory_size > 0
+
+    cache.clear()
+    assert not len(cache)
+
+
+def test_disabled_cache():
+    cache = GoneCache(max_size=0)
+    cache.add("a")
+    assert not cache.contains("a")
+
+
+def test_cache_lookup_metrics():
+    cache = GoneCache()
+    cache.add("a")
+    with mock.patch.object(metrics, "record_gone_cache_lookup") as record:
+        cache.contains("a")
+        cache.contains("b")
+    assert record.call_args_list == [mock.call(True), mock.call(False)]
+
+
+def test_unknown_secret_is_cached(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        assert _read(test_client, "123456").status_code == HTTPStatus.NOT_FOUND
+        assert gone_cache.contains("123456")
+
+        with mock.patch.object(db_health, "is_healthy") as is_healthy, \
+                mock.patch.object(repository.SqlSecretRepository,
+                                  "get") as get:
+            response = _read(test_client, "123456")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.get_json()["response"]["msg"] == Message.NOT_FOUND
+    is_healthy.assert_not_called()
+    get.assert_not_called()
+
+
+def test_read_secret_is_cached(app):
+    external_id = _create_secret()
+    with app.test_request_context(), app.test_client() as test_client:
+        assert _read(test_client, external_id).status_code == HTTPStatus.OK
+        assert gone_cache.contains(external_id)
+        response = _read(test_client, external_id)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_secret_out_of_tries_is_cached(app):
+    external_id = _create_secret(tries=1)
+    with app.test_request_context(), app.test_client() as test_client:
+        response = _read(test_client, external_id, passphrase="Wrong123")
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    assert gone_cache.contains(external_id)
+
+
+def test_wrong_passphrase_is_not_cached(app):
+    external_id = _create_secret()
+    with app.test_request_context(), app.test_client() as test_client:
+        response = _read(test_client, external_id, passphrase="Wrong123")
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    assert not gone_cache.contains(external_id)
+
+
+def test_reaped_secrets_are_cached(app):
+    external_id = _create_secret()
+    db.session.execute(
+        db.update(model.Secret).values(
+            date_expires=datetime.now(timezone.utc) - timedelta(minutes=1)))
+    db.session.commit()
+
+    assert repository.SqlSecretRepository().purge_expired(100) == 1
+    assert gone_cache.contains(external_id)
@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from shhh.domain.kdf import (KdfError,
+                             KdfParams,
+                             KdfPool,
+                             KdfPoolBusy,
+                             calibrate,
+                             last_kdf_timing)
+
+
+@pytest.fixture
+def pool():
+    kdf_pool = KdfPool()
+    yield kdf_pool
+    kdf_pool.shutdown()
+
+
+def test_kdf_pool_inline_when_not_configured(pool):
+    assert pool.run(sum, (1, 2)) == 3
+    timing = last_kdf_timing.get()
+    assert timing is not None
+    assert timing.queue_wait < 1
+
+
+def test_kdf_pool_reports_timings(pool):
+    timings = []
+    pool.on_timing = timings.append
+    pool.run(sum, (1, 2))
+    assert timings == [last_kdf_timing.get()]
+
+
+def test_kdf_pool_runs_on_workers(pool):
+    pool.configure(pool_type="thread", size=1, queue_size=0)
+    assert pool.run(threading.current_thread) is not threading.current_thread()
+
+
+def test_kdf_pool_map(pool):
+    pool.configure(pool_type="thread", size=2, queue_size=0)
+    assert pool.map(str, [1, 2, 3]) == ["1", "2", "3"]
+    callers = pool._callers
+    assert threading.current_thread() not in pool.map(
+        lambda _: threading.current_thread(), [1, 2])
+    # the threads are shared by the calls
+    assert pool._callers is callers is not None
+
+
+def test_kdf_pool_map_raises(pool):
+    pool.configure(pool_type="thread", size=2, queue_size=0)
+
+    def fail(item):
+        raise KdfPoolBusy
+
+    with pytest.raises(KdfPoolBusy):
+        pool.map(fail, [1, 2, 3])
+
+
+def test_kdf_pool_rejects_when_saturated(pool):
+    pool.configure(pool_type="thread", size=1, queue_size=0)
+    started, release = threading.Event(), threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+
+    worker = threading.Thread(target=pool.run, args=(blocking, ))
+    worker.start()
+    started.wait(5)
+    try:
+        with pytest.raises(KdfPoolBusy):
+            pool.run(sum, (1, 2))
+    finally:
+        release.set()
+        worker.join()
+
+    # the slot has been released, so work is admitted again
+    assert pool.run(sum, (1, 2)) == 3
+
+
+def test_kdf_pool_unsupported_type(pool):
+    with pytest.raises(RuntimeError, match="is not supported"):
+        pool.configure(pool_type="fiber", size=1, queue_size=0)
+
+
+def test_kdf_params_parse():
+    assert KdfParams.parse("pbkdf2") == KdfParams("pbkdf2", (100_000, ))
+    params = KdfParams.parse("argon2id", " memory_cost=1024, iterations=2")
+    assert params == KdfParams("argon2id", (2, 1024, 4))
+    assert str(params) == "iterations=2,memory_cost=1024,lanes=4"
+
+
+@pytest.mark.parametrize("algorithm, params",
+                         [("md5", ""), ("scrypt", "iterations=2"),
+                          ("scrypt", "n=0"), ("scrypt", "n=abc"),
+                          ("scrypt", "n=²"),
+                          ("pbkdf2", f"iterations={2**32}")])
+def test_kdf_params_parse_invalid(algorithm, params):
+    with pytest.raises(KdfError):
+        KdfParams.parse(algorithm, params)
+
+
+def test_kdf_pool_invalid_params_fallback(pool, caplog):
+    app = Flask(__name__)
+    app.config.update(SHHH_KDF_ALGORITHM="scrypt",
+                      SHHH_KDF_PARAMS=f"n={2**32}",
+                      SHHH_KDF_POOL_TYPE="thread",
+                      SHHH_KDF_POOL_SIZE=0,
+                      SHHH_KDF_QUEUE_SIZE=0,
+                      SHHH_KDF_ADMISSION_TIMEOUT=0.0)
+    pool.init_app(app)
+    assert pool.params == KdfParams.parse("scrypt")
+    assert "Invalid scrypt parameter" in caplog.text
+
+
+@pytest.mark.parametrize("algorithm", ("pbkdf2", "scrypt", "argon2id"))
+def test_kdf_params_bytes(algorithm):
+    params = KdfParams.parse(algorithm)
+    data = params.to_bytes() + b"rest"
+    assert KdfParams.from_bytes(data) == (params, len(data) - 4)
+
+
+def test_kdf_params_from_unknown_bytes():
+    with pytest.raises(KdfError):
+        KdfParams.from_bytes(b"\xff")
+
+
+@pytest.mark.parametrize("algorithm", ("pbkdf2", "scrypt", "argon2id"))
+def test_calibrate(algorithm):
+    params, elapsed = calibrate(algorithm, target=0.005, memory_cost=64)
+    assert params.algorithm == algorithm
+    assert all(param > 0 for param in params.params)
+    assert elapsed > 0
+
+
+def test_calibrate_kdf_command(app):
+    result = app.test_cli_runner().invoke(
+        args=["calibrate-kdf", "--algorithm", "scrypt", "--target", "5"])
+    assert result.exit_code == 0
+    assert "SHHH_KDF_ALGORITHM=scrypt" in result.output
+    assert "SHHH_KDF_PARAMS=n=" in result.output
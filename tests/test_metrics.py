@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from unittest.mock import Mock, patch
+
+import pytest
+from flask import url_for
+from prometheus_client import REGISTRY
+
+from shhh import metrics
+from shhh.domain import model
+from shhh.extensions import db, scheduler
+from shhh.scheduler import tasks
+
+PASSPHRASE = "Hello123"
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def _request_count(outcome, endpoint="api.secret"):
+    return _sample("shhh_request_duration_seconds_count",
+                   endpoint=endpoint,
+                   method="GET",
+                   outcome=outcome)
+
+
+@pytest.fixture
+def secret():
+    secret = model.Secret.encrypt(message="message",
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  tries=1)
+    db.session.add(secret)
+    db.session.commit()
+    return secret
+
+
+def test_metrics_endpoint(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("metrics.expose"))
+    assert response.status_code == HTTPStatus.OK
+    assert response.mimetype == "text/plain"
+    assert b"shhh_request_duration_seconds" in response.data
+    assert b"shhh_secrets_active" in response.data
+
+
+@pytest.mark.parametrize("authorization, code",
+                         ((None, HTTPStatus.UNAUTHORIZED),
+                          ("Bearer wrong", HTTPStatus.UNAUTHORIZED),
+                          ("Bearer token", HTTPStatus.OK)))
+def test_metrics_endpoint_token(app, authorization, code):
+    headers = {"Authorization": authorization} if authorization else {}
+    with app.test_request_context(), app.test_client() as test_client, \
+            patch.dict(app.config, {"SHHH_METRICS_TOKEN": "token"}):
+        response = test_client.get(url_for("metrics.expose"), headers=headers)
+    assert response.status_code == code
+
+
+def test_metrics_create_outcome(app):
+    created = _sample("shhh_secrets_created_total")
+    kdf = _sample("shhh_kdf_duration_seconds_count")
+    queries = _sample("shhh_db_query_duration_seconds_count")
+    with app.test_request_context(), app.test_client() as test_client:
+        test_client.post(url_for("api.secret"),
+                         json={
+                             "secret": "message", "passphrase": PASSPHRASE
+                         })
+    assert _sample("shhh_secrets_created_total") == created + 1
+    assert _sample("shhh_kdf_duration_seconds_count") == kdf + 1
+    assert _sample("shhh_db_query_duration_seconds_count") > queries
+    assert _sample("shhh_request_duration_seconds_count",
+                   endpoint="api.secret",
+                   method="POST",
+                   outcome="created") >= 1
+
+
+@pytest.mark.parametrize("passphrase, outcome, reason",
+                         [(PASSPHRASE, "success", "read"),
+                          ("Wrong123", "exceeded", "exceeded")])
+def test_metrics_read_outcome(app, secret, passphrase, outcome, reason):
+    requests = _request_count(outcome)
+    deleted = _sample("shhh_secrets_deleted_total", reason=reason)
+    with app.test_request_context(), app.test_client() as test_client:
+        test_client.get(url_for("api.secret"),
+                        query_string={
+                            "external_id": secret.external_id,
+                            "passphrase": passphrase
+                        })
+    assert _request_count(outcome) == requests + 1
+    assert _sample("shhh_secrets_deleted_total", reason=reason) == deleted + 1
+
+
+def test_metrics_expired_outcome(app):
+    requests = _request_count("expired")
+    with app.test_request_context(), app.test_client() as test_client:
+        test_client.get(url_for("api.secret"),
+                        query_string={
+                            "external_id": "unknown", "passphrase": PASSPHRASE
+                        })
+    assert _request_count("expired") == requests + 1
+
+
+def test_metrics_web_pages_outcome(app):
+    requests = _sample("shhh_request_duration_seconds_count",
+                       endpoint="web.create",
+                       method="GET",
+                       outcome="200")
+    with app.test_request_context(), app.test_client() as test_client:
+        test_client.get(url_for("web.create"))
+    assert _sample("shhh_request_duration_seconds_count",
+                   endpoint="web.create",
+                   method="GET",
+                   outcome="200") == requests + 1
+
+
+def test_metrics_reaper(app, secret):
+    scheduler.pause_job("delete_expired_records")
+    expired = model.Secret.encrypt(message="message",
+                                   passphrase=PASSPHRASE,
+                                   expire_code="1d")
+    expired.date_expires = datetime.now() - timedelta(days=1)
+    db.session.add(expired)
+    db.session.commit()
+    deleted = _sample("shhh_secrets_deleted_total", reason="expired")
+
+    try:
+        with patch.object(tasks, "_active_counted_at", None):
+            tasks.delete_expired_records()
+    finally:
+        scheduler.resume_job("delete_expired_records")
+
+    assert _sample("shhh_secrets_deleted_total",
+                   reason="expired") == deleted + 1
+    assert _sample("shhh_secrets_active") == 1
+    assert _sample("shhh_reaper_backlog") == 0
+    assert _sample("shhh_reaper_run_duration_seconds_count") >= 1
+
+
+def test_metrics_disabled_records_nothing(app):
+    with patch.object(metrics, "_enabled", False):
+        created = _sample("shhh_secrets_created_total")
+        hits = _sample("shhh_gone_cache_lookups_total", result="hit")
+        metrics.record_outcome(Mock(created=3))
+        metrics.record_gone_cache_lookup(hit=True)
+        assert _sample("shhh_secrets_created_total") == created
+        assert _sample("shhh_gone_cache_lookups_total", result="hit") == hits
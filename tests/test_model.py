@@ -0,0 +1,209 @@
+import hashlib
+import io
+import secrets
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from shhh.domain import kdf, model, stream
+
+PASSPHRASE = "Hello123"
+FAST_KDF = kdf.KdfParams("pbkdf2", (1, ))
+
+
+def _legacy_encrypted_text(message, passphrase, iterations=1):
+    # format of the secrets created before the v2 format
+    salt = secrets.token_bytes(16)
+    key = urlsafe_b64encode(
+        kdf._pbkdf2_sha256(passphrase.encode(), salt, iterations))
+    return urlsafe_b64encode(
+        b"%b%b%b" % (salt,
+                     iterations.to_bytes(4, "big"),
+                     urlsafe_b64decode(Fernet(key).encrypt(message.encode()))))
+
+
+def _secret(encrypted_text):
+    now = datetime.now(timezone.utc)
+    return model.Secret(encrypted_text=encrypted_text,
+                        date_created=now,
+                        date_expires=now,
+                        external_id="external_id",
+                        tries=3)
+
+
+def _v2_encrypted_text(message, passphrase, iterations=1):
+    # format of the secrets created before the KDF was recorded
+    salt, nonce = secrets.token_bytes(16), secrets.token_bytes(12)
+    key = kdf._pbkdf2_sha256(passphrase.encode(), salt, iterations)
+    header = b"%c%b%b" % (model.FORMAT_V2, iterations.to_bytes(4, "big"), salt)
+    return header + nonce + AESGCM(key).encrypt(
+        nonce, message.encode(), header)
+
+
+def test_encrypt_v3_format():
+    secret = model.Secret.encrypt(message="message",
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  kdf=FAST_KDF)
+    data = secret.encrypted_text
+    assert data[0] == model.FORMAT_V3
+    assert kdf.KdfParams.from_bytes(data[1:]) == (FAST_KDF, 5)
+    # header, nonce, ciphertext and tag
+    assert len(data) == 1 + 5 + 16 + 12 + len("message") + 16
+    assert secret.decrypt(PASSPHRASE) == "message"
+
+
+@pytest.mark.parametrize(
+    "params",
+    (kdf.KdfParams.parse("scrypt", "n=16"),
+     kdf.KdfParams.parse("argon2id", "iterations=1,memory_cost=64,lanes=1")))
+def test_encrypt_with_kdf(params):
+    secret = model.Secret.encrypt(message="message",
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  kdf=params)
+    assert kdf.KdfParams.from_bytes(secret.encrypted_text[1:])[0] == params
+    assert secret.decrypt(PASSPHRASE) == "message"
+    with pytest.raises(InvalidToken):
+        secret.decrypt("Wrong123")
+
+
+def test_encrypt_with_configured_kdf():
+    params = kdf.KdfParams.parse("scrypt", "n=16")
+    with mock.patch.object(kdf.kdf_pool, "params", params):
+        secret = model.Secret.encrypt(message="message",
+                                      passphrase=PASSPHRASE,
+                                      expire_code="1d")
+    assert kdf.KdfParams.from_bytes(secret.encrypted_text[1:])[0] == params
+
+
+def test_decrypt_v2_format():
+    secret = _secret(_v2_encrypted_text("message", PASSPHRASE))
+    assert secret.decrypt(PASSPHRASE) == "message"
+    with pytest.raises(InvalidToken):
+        secret.decrypt("Wrong123")
+
+
+def test_format_is_smaller_than_legacy():
+    message = "a message of a typical size" * 4
+    secret = model.Secret.encrypt(message=message,
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  kdf=FAST_KDF)
+    legacy = _legacy_encrypted_text(message, PASSPHRASE)
+    assert len(secret.encrypted_text) < len(legacy) * 2 / 3
+
+
+def test_decrypt_legacy_format():
+    secret = _secret(_legacy_encrypted_text("message", PASSPHRASE))
+    assert secret.decrypt(PASSPHRASE) == "message"
+
+
+@pytest.mark.parametrize("legacy", (True, False))
+def test_decrypt_wrong_passphrase(legacy):
+    if legacy:
+        secret = _secret(_legacy_encrypted_text("message", PASSPHRASE))
+    else:
+        secret = model.Secret.encrypt(message="message",
+                                      passphrase=PASSPHRASE,
+                                      expire_code="1d",
+                                      kdf=FAST_KDF)
+    with pytest.raises(InvalidToken):
+        secret.decrypt("Wrong123")
+
+
+def test_decrypt_tampered_nonce():
+    secret = model.Secret.encrypt(message="message",
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  kdf=FAST_KDF)
+    data = bytearray(secret.encrypted_text)
+    data[-30] ^= 1  # in the nonce
+    with pytest.raises(InvalidToken):
+        _secret(bytes(data)).decrypt(PASSPHRASE)
+
+
+def test_client_encrypted_secret():
+    salt, proof = secrets.token_bytes(16), secrets.token_bytes(32)
+    secret = model.Secret.from_client(ciphertext=b"ciphertext",
+                                      salt=salt,
+                                      iterations=600000,
+                                      verifier=hashlib.sha256(proof).digest(),
+                                      expire_code="1d")
+    assert secret.client_encrypted
+    assert secret.client_kdf() == (kdf.KdfParams("pbkdf2", (600000, )), salt)
+    assert secret.open(proof) == b"ciphertext"
+    with pytest.raises(InvalidToken):
+        secret.open(secrets.token_bytes(32))
+    # only the client can derive the key
+    with mock.patch.object(kdf.kdf_pool, "run") as run:
+        with pytest.raises(InvalidToken):
+            secret.decrypt(PASSPHRASE)
+    run.assert_not_called()
+
+
+def test_open_server_encrypted_secret():
+    secret = model.Secret.encrypt(message="message",
+                                  passphrase=PASSPHRASE,
+                                  expire_code="1d",
+                                  kdf=FAST_KDF)
+    assert not secret.client_encrypted
+    with pytest.raises(InvalidToken):
+        secret.open(secrets.token_bytes(32))
+
+
+def _stream_secret(name="report.pdf"):
+    return model.Secret.encrypt_stream(name=name,
+                                       passphrase=PASSPHRASE,
+                                       expire_code="1d",
+                                       tries=3,
+                                       kdf=FAST_KDF)
+
+
+@pytest.mark.parametrize(
+    "size", (0, 1, stream.CHUNK_SIZE, 3 * stream.CHUNK_SIZE, 200000))
+def test_stream_secret(size):
+    content = secrets.token_bytes(size)
+    secret, cipher = _stream_secret()
+    encrypted = b"".join(cipher.encrypt([content[:1000], content[1000:]]))
+    assert secret.streamed
+
+    name, cipher = _secret(secret.encrypted_text).decrypt_stream(PASSPHRASE)
+    assert name == "report.pdf"
+    chunks = list(cipher.decrypt(io.BytesIO(encrypted).read))
+    assert b"".join(chunks) == content
+    assert all(len(chunk) <= stream.CHUNK_SIZE for chunk in chunks)
+
+
+def test_stream_secret_wrong_passphrase():
+    secret, _ = _stream_secret()
+    with pytest.raises(InvalidToken):
+        secret.decrypt_stream("wrong")
+    # the content is not a message
+    with pytest.raises(InvalidToken):
+        secret.decrypt(PASSPHRASE)
+
+
+def test_stream_secret_tampered():
+    secret, cipher = _stream_secret()
+    chunk_size = stream.CHUNK_SIZE + stream.TAG_SIZE
+    encrypted = b"".join(cipher.encrypt([secrets.token_bytes(200000)]))
+    chunks = [
+        encrypted[i:i + chunk_size]
+        for i in range(0, len(encrypted), chunk_size)
+    ]
+    _, cipher = secret.decrypt_stream(PASSPHRASE)
+    for tampered in (chunks[1] + chunks[0] + b"".join(chunks[2:]),
+                     b"".join(chunks[:-1]),
+                     encrypted[:-1]):
+        with pytest.raises(InvalidToken):
+            list(cipher.decrypt(io.BytesIO(tampered).read))
+    # nor is the content of another secret
+    other, _ = _stream_secret()
+    _, cipher = other.decrypt_stream(PASSPHRASE)
+    with pytest.raises(InvalidToken):
+        list(cipher.decrypt(io.BytesIO(encrypted).read))
@@ -0,0 +1,127 @@
+import time
+
+import pytest
+from flask import Flask
+
+from shhh import profiling
+
+KEY = "profiling-key"
+
+
+def _create_app(**config):
+    app = Flask(__name__)
+    app.config.update({
+        "SHHH_SERVER_TIMING": False,
+        "SHHH_PROFILING_DIR": None,
+        "SHHH_PROFILING_RATE": 0.0,
+        "SHHH_PROFILING_KEY": KEY,
+        **config
+    })
+    profiling.init_app(app)
+
+    @app.get("/slow")
+    def slow():
+        with profiling.phase("parse"):
+            time.sleep(0.01)
+        profiling.add_phase("kdf", 0.02)
+        profiling.add_phase("kdf", 0.03)
+        return "slow"
+
+    return app
+
+
+def _phases(response):
+    header = response.headers["Server-Timing"]
+    return {
+        name: float(duration.removeprefix("dur="))
+        for name, duration in (metric.split(";")
+                               for metric in header.split(", "))
+    }
+
+
+def test_server_timing_disabled_by_default(app):
+    with app.test_client() as test_client:
+        response = test_client.get("/")
+    assert "Server-Timing" not in response.headers
+
+
+def test_server_timing_header():
+    app = _create_app(SHHH_SERVER_TIMING=True)
+    with app.test_client() as test_client:
+        phases = _phases(test_client.get("/slow"))
+    assert list(phases) == ["parse", "kdf", "total"]
+    assert phases["parse"] >= 10
+    assert phases["kdf"] == pytest.approx(50)
+    assert phases["total"] >= phases["parse"]
+
+
+def test_phase_outside_of_a_request():
+    with profiling.phase("parse"):
+        profiling.add_phase("kdf", 1)
+
+
+def test_profile_with_rate(tmp_path):
+    app = _create_app(SHHH_PROFILING_DIR=str(tmp_path),
+                      SHHH_PROFILING_RATE=1.0)
+    with app.test_client() as test_client:
+        response = test_client.get("/slow")
+    assert "Server-Timing" in response.headers
+    assert len(list(tmp_path.glob("*-slow-*.prof"))) == 1
+    assert len(list(tmp_path.glob("*-slow-*.tracemalloc"))) == 1
+
+
+def test_profile_one_request_at_a_time(tmp_path):
+    app = _create_app(SHHH_PROFILING_DIR=str(tmp_path),
+                      SHHH_PROFILING_RATE=1.0)
+    # another request is being profiled
+    with profiling._profiler_slot, app.test_client() as test_client:
+        response = test_client.get("/slow")
+    assert response.status_code == 200
+    assert not list(tmp_path.glob("*.prof"))
+
+    # the slot is released after each profile
+    with app.test_client() as test_client:
+        test_client.get("/slow")
+        test_client.get("/slow")
+    assert len(list(tmp_path.glob("*-slow-*.prof"))) == 2
+
+
+def test_profile_with_signed_header(tmp_path):
+    app = _create_app(SHHH_PROFILING_DIR=str(tmp_path))
+    token = profiling.sign_profile_request(KEY, "/slow", int(time.time()) + 60)
+    with app.test_client() as test_client:
+        response = test_client.get("/slow")
+        assert "Server-Timing" not in response.headers
+        response = test_client.get("/slow",
+                                   headers={profiling.PROFILE_HEADER: token})
+        assert "Server-Timing" in response.headers
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+
+
+@pytest.mark.parametrize("key, path, expires",
+                         [("wrong-key", "/slow", 60), (KEY, "/other", 60),
+                          (KEY, "/slow", -1)])
+def test_profile_with_invalid_header(tmp_path, key, path, expires):
+    app = _create_app(SHHH_PROFILING_DIR=str(tmp_path))
+    token = profiling.sign_profile_request(key,
+                                           path,
+                                           int(time.time()) + expires)
+    with app.test_client() as test_client:
+        response = test_client.get("/slow",
+                                   headers={profiling.PROFILE_HEADER: token})
+    assert "Server-Timing" not in response.headers
+    assert not list(tmp_path.iterdir())
+
+
+def test_profile_token_command(app, tmp_path):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["profile-token", "/api/secret"])
+    assert result.exit_code != 0
+
+    app.config.update(SHHH_PROFILING_DIR=str(tmp_path), SHHH_PROFILING_KEY=KEY)
+    try:
+        result = runner.invoke(args=["profile-token", "/api/secret"])
+    finally:
+        app.config.update(SHHH_PROFILING_DIR=None, SHHH_PROFILING_KEY=None)
+    assert result.exit_code == 0
+    assert result.output.startswith(f"{profiling.PROFILE_HEADER}: ")
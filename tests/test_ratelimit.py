@@ -0,0 +1,178 @@
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+from flask import url_for
+
+from shhh import ratelimit
+from shhh.constants import Message
+
+LIMIT = ratelimit.Limit(2, 60)
+PAYLOAD = {"secret": "message", "passphrase": "Hello123"}
+
+
+@pytest.fixture
+def rate_limiter(app):
+    limiter = ratelimit.RateLimiter(
+        ratelimit.MemoryBucketStore(),
+        {
+            "read": ratelimit.Limit(3, 60),
+            "secret": ratelimit.Limit(2, 60),
+            "write": ratelimit.Limit(2, 60)
+        })
+    with mock.patch.dict(app.extensions,
+                         {ratelimit.EXTENSION_NAME: limiter}), \
+            mock.patch.dict(app.config, {"SHHH_RATELIMIT_ENABLED": True,
+                                         "SHHH_TRUSTED_PROXIES": 1}):
+        yield limiter
+
+
+@pytest.mark.parametrize("value, limit", [("5/minute", (5, 60)),
+                                          ("100/day", (100, 86400))])
+def test_parse_limit(value, limit):
+    assert ratelimit.Limit.parse(value) == ratelimit.Limit(*limit)
+
+
+@pytest.mark.parametrize("value", ["5", "0/minute", "5/week", "a/second"])
+def test_parse_invalid_limit(value):
+    with pytest.raises(ValueError):
+        ratelimit.Limit.parse(value)
+
+
+@pytest.mark.parametrize("store_type", ["memory", "shared"])
+def test_token_bucket(tmp_path, store_type):
+    if store_type == "memory":
+        store = ratelimit.MemoryBucketStore()
+    else:
+        store = ratelimit.SharedBucketStore(str(tmp_path / "buckets"))
+    with mock.patch("time.time", return_value=1000):
+        assert store.take("a", LIMIT) == 0
+        assert store.take("a", LIMIT) == 0
+        # a token is refilled every 30 seconds
+        assert store.take("a", LIMIT) == 30
+        assert store.take("b", LIMIT, cost=2) == 0
+    with mock.patch("time.time", return_value=1015):
+        assert store.take("a", LIMIT) == 15
+    with mock.patch("time.time", return_value=1030):
+        assert store.take("a", LIMIT) == 0
+        assert store.take("a", LIMIT) == 30
+
+
+def test_shared_buckets_across_processes(tmp_path):
+    path = str(tmp_path / "buckets")
+    # each store maps the file on its own, as each worker process does
+    first = ratelimit.SharedBucketStore(path)
+    second = ratelimit.SharedBucketStore(path)
+    with mock.patch("time.time", return_value=1000):
+        assert first.take("a", LIMIT) == 0
+        assert second.take("a", LIMIT) == 0
+        assert first.take("a", LIMIT) == 30
+
+
+def test_memory_store_evicts_buckets():
+    store = ratelimit.MemoryBucketStore(max_size=2)
+    for key in ("a", "b", "c"):
+        store.take(key, LIMIT, cost=2)
+    # the least recently used bucket has been evicted, and starts full
+    assert store.take("a", LIMIT) == 0
+    assert store.take("c", LIMIT) > 0
+
+
+def test_invalid_limit_config(app):
+    with mock.patch.dict(app.config, {"SHHH_RATELIMIT_READ": "5/week"}):
+        with pytest.raises(RuntimeError):
+            ratelimit.init_app(app)
+
+
+@pytest.mark.parametrize("proxies, warned", ((0, True), (1, False)))
+def test_warn_without_trusted_proxies(app, caplog, proxies, warned):
+    with mock.patch.dict(app.config, {
+            "SHHH_RATELIMIT_ENABLED": True, "SHHH_TRUSTED_PROXIES": proxies
+    }), mock.patch.dict(app.extensions):
+        ratelimit.init_app(app)
+    assert ("SHHH_TRUSTED_PROXIES" in caplog.text) is warned
+
+
+def test_redis_store_needs_url(app):
+    with mock.patch.dict(app.config, {"SHHH_RATELIMIT_STORE": "redis"}):
+        with pytest.raises(RuntimeError):
+            ratelimit.create_store(app)
+
+
+def test_throttle_reads_per_client(app, rate_limiter):
+    with mock.patch("shhh.domain.model.kdf_pool.run") as kdf:
+        with app.test_request_context(), app.test_client() as test_client:
+            for i in range(4):
+                response = test_client.get(
+                    url_for("api.secret",
+                            external_id=f"external-id-{i}",
+                            passphrase="Hello123"),
+                    headers={"X-Forwarded-For": "10.0.0.1"})
+            other_client = test_client.get(
+                url_for("api.secret",
+                        external_id="external-id",
+                        passphrase="Hello123"),
+                headers={"X-Forwarded-For": "10.0.0.2"})
+    assert response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    assert response.headers["Retry-After"] == "20"
+    assert response.get_json()["response"]["details"] == Message.THROTTLED
+    assert other_client.status_code == HTTPStatus.NOT_FOUND
+    kdf.assert_not_called()
+
+
+def test_throttle_reads_per_secret(app, rate_limiter):
+    with mock.patch("shhh.domain.model.kdf_pool.run") as kdf:
+        with app.test_request_context(), app.test_client() as test_client:
+            responses = [
+                test_client.get(url_for("api.secret",
+                                        external_id="external-id",
+                                        passphrase="Hello123"),
+                                headers={"X-Forwarded-For": f"10.0.0.{i}"})
+                for i in range(3)
+            ]
+    assert [response.status_code for response in responses] == [
+        HTTPStatus.NOT_FOUND,
+        HTTPStatus.NOT_FOUND,
+        HTTPStatus.TOO_MANY_REQUESTS
+    ]
+    kdf.assert_not_called()
+
+
+def test_throttle_writes(app, rate_limiter):
+    with app.test_request_context(), app.test_client() as test_client:
+        responses = [
+            test_client.post(url_for("api.secret"), json=PAYLOAD)
+            for _ in range(3)
+        ]
+        bulk = test_client.post(url_for("api.secrets"),
+                                json={"secrets": [PAYLOAD]},
+                                headers={"X-Forwarded-For": "10.0.0.2"})
+    assert [response.status_code for response in responses] == [
+        HTTPStatus.CREATED, HTTPStatus.CREATED, HTTPStatus.TOO_MANY_REQUESTS
+    ]
+    assert bulk.status_code == HTTPStatus.CREATED
+
+
+def test_bulk_write_larger_than_bucket_refused(app, rate_limiter):
+    with app.test_request_context(), app.test_client() as test_client:
+        bulk = test_client.post(url_for("api.secrets"),
+                                json={"secrets": [PAYLOAD] * 3})
+        # no token has been taken
+        responses = [
+            test_client.post(url_for("api.secret"), json=PAYLOAD)
+            for _ in range(2)
+        ]
+    assert bulk.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert bulk.get_json()["response"]["details"] == (
+        Message.LIMIT_EXCEEDED.format(count=2))
+    assert [response.status_code for response in responses
+            ] == [HTTPStatus.CREATED, HTTPStatus.CREATED]
+
+
+def test_client_address_ignores_untrusted_forwarded_for(app):
+    headers = {"X-Forwarded-For": "10.0.0.1, 10.0.0.2"}
+    with app.test_request_context(headers=headers,
+                                  environ_base={"REMOTE_ADDR": "10.0.0.3"}):
+        assert ratelimit.client_address() == "10.0.0.3"
+        with mock.patch.dict(app.config, {"SHHH_TRUSTED_PROXIES": 1}):
+            assert ratelimit.client_address() == "10.0.0.2"
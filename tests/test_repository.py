@@ -0,0 +1,242 @@
+from base64 import urlsafe_b64decode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+from flask import url_for
+from sqlalchemy import text
+
+from shhh.adapters import repository
+from shhh.constants import Message, Status
+from shhh.domain import model
+from shhh.domain.kdf import KdfParams
+from shhh.extensions import db
+
+PASSPHRASE = "Hello123"
+FAST_KDF = KdfParams("pbkdf2", (1, ))
+
+
+def _secret(expire_code="1d", tries=3):
+    return model.Secret.encrypt(message="message",
+                                passphrase=PASSPHRASE,
+                                expire_code=expire_code,
+                                tries=tries,
+                                kdf=FAST_KDF)
+
+
+@pytest.fixture(params=["sql", "memory"])
+def secrets_repository(request, app):
+    if request.param == "sql":
+        return repository.SqlSecretRepository()
+    return repository.KeyValueSecretRepository(repository.MemoryStore())
+
+
+@pytest.fixture
+def memory_storage(app):
+    kv_repository = repository.KeyValueSecretRepository(
+        repository.MemoryStore())
+    with mock.patch.dict(app.extensions,
+                         {repository.EXTENSION_NAME: kv_repository}):
+        yield kv_repository
+
+
+def test_default_repository(app):
+    assert isinstance(repository.get_repository(app),
+                      repository.SqlSecretRepository)
+
+
+def test_unsupported_storage(app):
+    with mock.patch.dict(app.config, {"SHHH_STORAGE": "unknown"}):
+        with pytest.raises(RuntimeError):
+            repository.create_repository(app)
+
+
+def test_redis_storage_needs_url(app):
+    with mock.patch.dict(app.config, {"SHHH_STORAGE": "redis"}):
+        with pytest.raises(RuntimeError):
+            repository.create_repository(app)
+
+
+def test_add_and_get(secrets_repository):
+    secret = _secret()
+    external_id, encrypted_text = secret.external_id, secret.encrypted_text
+    secrets_repository.add(secret)
+
+    stored = secrets_repository.get(external_id)
+    assert stored.external_id == external_id
+    assert stored.encrypted_text == encrypted_text
+    assert stored.tries == 3
+    assert stored.decrypt(PASSPHRASE) == "message"
+    assert secrets_repository.get("unknown") is None
+
+
+def test_add_all(secrets_repository):
+    secrets = [_secret() for _ in range(3)]
+    external_ids = [secret.external_id for secret in secrets]
+    secrets_repository.add_all(secrets)
+    for external_id in external_ids:
+        assert secrets_repository.get(external_id) is not None
+
+
+def test_consume_once(secrets_repository):
+    secret = _secret()
+    external_id = secret.external_id
+    secrets_repository.add(secret)
+
+    assert secrets_repository.consume(external_id)
+    assert not secrets_repository.consume(external_id)
+    assert secrets_repository.get(external_id) is None
+
+
+def test_decrement_tries(secrets_repository):
+    secret = _secret(tries=2)
+    external_id = secret.external_id
+    secrets_repository.add(secret)
+
+    assert secrets_repository.decrement_tries(external_id) == 1
+    # the secret is deleted once no tries are left
+    assert secrets_repository.decrement_tries(external_id) == 0
+    assert secrets_repository.get(external_id) is None
+    assert secrets_repository.decrement_tries(external_id) is None
+
+
+def test_sql_repository_expired_secret_not_readable(app):
+    secret = _secret()
+    external_id = secret.external_id
+    secret.date_expires = datetime.now(timezone.utc) - timedelta(seconds=1)
+    repository.SqlSecretRepository().add(secret)
+
+    # until deleted by the reaper
+    assert repository.SqlSecretRepository().get(external_id) is None
+    assert repository.SqlSecretRepository().count_expired() == 1
+
+
+def test_external_id_stored_as_bytes(app):
+    secret = _secret()
+    external_id = secret.external_id
+    repository.SqlSecretRepository().add(secret)
+
+    stored = db.session.execute(
+        text("SELECT external_id FROM secret")).scalar_one()
+    assert stored == urlsafe_b64decode(external_id)
+    assert len(stored) == model.EXTERNAL_ID_SIZE
+
+
+def test_sql_repository_statements_are_compiled_once(app):
+    sql_repository = repository.SqlSecretRepository()
+    secrets = [_secret(tries=2) for _ in range(2)]
+
+    sizes = []
+    for secret in secrets:
+        external_id = secret.external_id
+        sql_repository.add(secret)
+        stored = sql_repository.get(external_id)
+        sql_repository.decrement_tries(external_id)
+        sql_repository.consume(external_id)
+        sql_repository.purge_expired(10)
+        sizes.append(len(db.engine._compiled_cache))
+    assert sizes[0] == sizes[1]
+    # secrets are read as rows, not tracked by the session
+    assert stored.external_id == external_id
+    assert secret not in db.session and stored not in db.session
+
+
+def test_malformed_external_id_never_matches(app):
+    secret = _secret()
+    external_id = secret.external_id
+    sql_repository = repository.SqlSecretRepository()
+    sql_repository.add(secret)
+
+    assert sql_repository.get(external_id) is not None
+    for malformed in (f"{external_id}A",
+                      f"{external_id[:-1]}=",
+                      f"{external_id[:-1]}!"):
+        assert sql_repository.get(malformed) is None
+
+
+def test_memory_store_expires_keys():
+    store = repository.MemoryStore()
+    with mock.patch("time.time", return_value=1000):
+        store.set("a", {"field": "1"}, ttl=10)
+        store.set("b", {"field": "1"}, ttl=20)
+        # a key set again gets the new time to live
+        store.set("a", {"field": "2"}, ttl=30)
+    with mock.patch("time.time", return_value=1025):
+        assert store.get("a") == {"field": "2"}
+        assert store.get("b") is None
+        assert store.count("") == 1
+    with mock.patch("time.time", return_value=1030):
+        assert store.get("a") is None
+        assert store.decrement("a", "field") is None
+        assert not store.delete("a")
+
+
+def test_key_value_repository_expires_secrets():
+    kv_repository = repository.KeyValueSecretRepository(
+        repository.MemoryStore())
+    secret = _secret(expire_code="10m")
+    kv_repository.add(secret)
+    assert kv_repository.count_active() == 1
+
+    later = datetime.now(timezone.utc) + timedelta(minutes=11)
+    with mock.patch("time.time", return_value=later.timestamp()):
+        assert kv_repository.get(secret.external_id) is None
+        assert kv_repository.count_active() == 0
+    assert kv_repository.purge_expired(100) == 0
+
+
+def test_key_value_repository_concurrent_last_try():
+    kv_repository = repository.KeyValueSecretRepository(
+        repository.MemoryStore())
+    secret = _secret(tries=1)
+    kv_repository.add(secret)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        remaining = list(
+            executor.map(kv_repository.decrement_tries,
+                         [secret.external_id] * 8))
+    assert remaining.count(0) == 1
+    assert remaining.count(None) == 7
+
+
+def test_api_with_memory_storage(app, memory_storage):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.post(url_for("api.secret"),
+                                    json={
+                                        "secret": "message",
+                                        "passphrase": PASSPHRASE
+                                    })
+        assert response.status_code == HTTPStatus.CREATED
+        external_id = response.get_json()["response"]["external_id"]
+        assert memory_storage.get(external_id) is not None
+
+        response = test_client.get(url_for("api.secret"),
+                                   query_string={
+                                       "external_id": external_id,
+                                       "passphrase": PASSPHRASE
+                                   })
+        assert response.status_code == HTTPStatus.OK
+        assert response.get_json()["response"]["msg"] == "message"
+
+        response = test_client.get(url_for("api.secret"),
+                                   query_string={
+                                       "external_id": external_id,
+                                       "passphrase": PASSPHRASE
+                                   })
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.get_json()["response"]["status"] == Status.EXPIRED
+    assert response.get_json()["response"]["msg"] == Message.NOT_FOUND
+
+
+def test_api_with_memory_storage_skips_database_check(app, memory_storage):
+    with mock.patch("shhh.liveness.db_health.is_healthy") as is_healthy:
+        with app.test_request_context(), app.test_client() as test_client:
+            response = test_client.get(url_for("api.secret"),
+                                       query_string={
+                                           "external_id": "unknown",
+                                           "passphrase": PASSPHRASE
+                                       })
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    is_healthy.assert_not_called()
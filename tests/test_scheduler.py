@@ -1,8 +1,18 @@
 from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
 
+import pytest
+
+from shhh.adapters import repository
+from shhh.adapters.repository import get_repository
 from shhh.domain import model
+from shhh.domain.kdf import KdfParams
 from shhh.extensions import db, scheduler
-from shhh.scheduler import tasks
+from shhh.liveness import db_health
+from shhh.scheduler import start_scheduler, tasks
+from shhh.scheduler.leader import LeaderLease
+
+FAST_KDF = KdfParams("pbkdf2", (1, ))
 
 
 def test_scheduler_setup():
@@ -56,3 +66,130 @@ def test_scheduler_job():
     active = db.session.query(model.Secret).filter(
         model.Secret.has_external_id(active_id)).one_or_none()
     assert active is not None
+
+
+def _add_expired_secrets(count):
+    for i in range(count):
+        secret = model.Secret.encrypt(message=f"secret {i}",
+                                      passphrase="Hello123",
+                                      expire_code="1d",
+                                      kdf=FAST_KDF)
+        secret.date_expires = datetime.now() - timedelta(days=1)
+        db.session.add(secret)
+    db.session.commit()
+
+
+def test_scheduler_job_counts_active_secrets_once_per_interval(app):
+    scheduler.pause_job("delete_expired_records")
+    secrets_repository = get_repository(app)
+    with patch.object(tasks, "_active_counted_at", None), \
+            patch.object(secrets_repository, "count_active",
+                         return_value=0) as count_active:
+        tasks.delete_expired_records()
+        tasks.delete_expired_records()
+    count_active.assert_called_once()
+
+
+def test_scheduler_job_deletes_in_chunks(app):
+    scheduler.pause_job("delete_expired_records")
+    _add_expired_secrets(5)
+
+    with patch.dict(app.config, {"SHHH_REAPER_CHUNK_SIZE": 2}):
+        stats = tasks.delete_expired_records()
+
+    assert stats.deleted == 5
+    assert stats.backlog == 0
+    assert db.session.query(model.Secret).count() == 0
+
+
+def test_scheduler_job_stops_after_max_runtime(app):
+    scheduler.pause_job("delete_expired_records")
+    _add_expired_secrets(5)
+
+    with patch.dict(app.config, {
+            "SHHH_REAPER_CHUNK_SIZE": 2, "SHHH_REAPER_MAX_RUNTIME": 0
+    }):
+        stats = tasks.delete_expired_records()
+
+    # only one chunk could run, the rest is reported as backlog
+    assert stats.deleted == 2
+    assert stats.backlog == 3
+    assert db.session.query(model.Secret).count() == 3
+
+    # the job catches up with the backlog at the minimum interval
+    job = scheduler.get_job("delete_expired_records")
+    assert job.trigger.interval.total_seconds() == (
+        app.config["SHHH_REAPER_MIN_INTERVAL"])
+
+
+@pytest.mark.parametrize("deleted, backlog, current, expected",
+                         ((10, 5, 60, 5), (0, 0, 60, 120), (0, 0, 240, 300),
+                          (10, 0, 5, 60),
+                          ))
+def test_scheduler_next_interval(deleted, backlog, current, expected):
+    stats = tasks.ReaperStats(deleted=deleted, elapsed=1, backlog=backlog)
+    assert tasks._next_interval(current,
+                                stats,
+                                base=60,
+                                minimum=5,
+                                maximum=300) == expected
+
+
+def test_scheduler_lease_single_leader():
+    leader, follower = LeaderLease("job"), LeaderLease("job")
+    assert leader.acquire(ttl=60)
+    assert not follower.acquire(ttl=60)
+
+    # the leader renews its own lease
+    assert leader.acquire(ttl=60)
+
+    # once released, another worker can take over
+    leader.release()
+    assert follower.acquire(ttl=60)
+    assert not leader.acquire(ttl=60)
+
+
+def test_scheduler_lease_takeover_when_expired():
+    leader, follower = LeaderLease("job"), LeaderLease("job")
+    assert leader.acquire(ttl=-1)  # leader died, lease expired
+    assert follower.acquire(ttl=60)
+    assert not leader.acquire(ttl=60)
+
+
+@pytest.mark.parametrize("ttl, max_interval, expected",
+                         [(900, 300, 900), (300, 300, 660), (900, 1200, 1260)])
+def test_scheduler_lease_ttl_above_job_intervals(app,
+                                                 ttl,
+                                                 max_interval,
+                                                 expected):
+    with patch.dict(app.config,
+                    SHHH_SCHEDULER_LEASE_TTL=ttl,
+                    SHHH_REAPER_MAX_INTERVAL=max_interval):
+        assert tasks._lease_ttl(app) == expected
+
+
+def test_scheduler_job_skipped_when_not_leader():
+    scheduler.pause_job("delete_expired_records")
+    _add_expired_secrets(2)
+    assert LeaderLease(tasks.DELETE_EXPIRED_RECORDS_JOB).acquire(ttl=60)
+
+    assert tasks.delete_expired_records() is None
+    assert db.session.query(model.Secret).count() == 2
+
+
+def test_scheduler_with_memory_storage(app):
+    with patch.dict(app.config, {"SHHH_STORAGE": "memory"}):
+        memory_repository = repository.create_repository(app)
+    memory_scheduler = Mock(app=app)
+    with patch.dict(app.extensions,
+                    {repository.EXTENSION_NAME: memory_repository}):
+        start_scheduler(memory_scheduler)
+        with patch.object(db_health, "is_healthy") as is_healthy, \
+                patch.object(tasks.blobs_lease, "acquire") as acquire:
+            assert tasks.delete_expired_blobs() == 0
+
+    # only the blobs are expired, without any database
+    assert [call.kwargs["id"] for call in memory_scheduler.add_job.mock_calls
+            ] == [tasks.DELETE_EXPIRED_BLOBS_JOB]
+    is_healthy.assert_not_called()
+    acquire.assert_not_called()
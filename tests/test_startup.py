@@ -0,0 +1,73 @@
+import json
+import subprocess
+import sys
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+from shhh import startup
+from shhh.domain.kdf import KdfPool
+from shhh.extensions import db
+
+
+def test_create_app_phases(app):
+    phases = startup.get_startup_timing(app).phases
+    assert {"config", "extensions", "blueprints", "mappers",
+            "assets"} <= set(phases)
+
+
+def test_warm_up(app):
+    with mock.patch("shhh.domain.kdf.kdf_pool.warm_up") as kdf_warm_up:
+        startup.warm_up(app)
+    assert {"db_pool", "crypto",
+            "templates"} <= set(startup.get_startup_timing(app).phases)
+    kdf_warm_up.assert_called_once_with()
+    # the templates are compiled
+    assert len(app.jinja_env.cache)
+
+
+def test_warm_up_without_database(app, caplog):
+    error = OperationalError("SELECT 1", {}, Exception("unreachable"))
+    with mock.patch.object(db.engine, "connect", side_effect=error):
+        startup.warm_up(app)
+    assert "Could not connect to the database" in caplog.text
+
+
+def test_kdf_pool_warm_up():
+    pool = KdfPool()
+    pool.warm_up()
+    pool.configure(pool_type="thread", size=2, queue_size=0)
+    try:
+        pool.warm_up()
+        assert pool._executor is not None
+    finally:
+        pool.shutdown()
+
+
+def test_request_path_does_not_import_alembic():
+    code = (
+        "import sys, shhh.entrypoint; "
+        "print('alembic' in sys.modules, 'webassets.script' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True,
+                            text=True,
+                            check=True).stdout
+    assert output.split() == ["False", "False"]
+
+
+def test_migrations_command(app):
+    # the commands run on a new application, which has not served requests
+    with mock.patch.object(app, "_got_first_request", False):
+        result = app.test_cli_runner().invoke(args=["db", "heads"])
+    assert result.exit_code == 0
+    assert "(head)" in result.output
+
+
+def test_startup_profile_command(app):
+    phases = {"imports": 0.5, "config": 0.001, "templates": 0.02}
+    completed = subprocess.CompletedProcess([], 0, json.dumps(phases), "")
+    with mock.patch("subprocess.run", return_value=completed):
+        result = app.test_cli_runner().invoke(args=["startup-profile"])
+    assert result.exit_code == 0
+    assert "imports" in result.output
+    assert "521.0ms" in result.output
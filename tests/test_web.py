@@ -1,8 +1,13 @@
+import base64
+import hashlib
+import re
 from http import HTTPStatus
 from unittest.mock import PropertyMock, patch
 
 from flask import Flask, url_for
 
+from shhh.extensions import assets
+
 
 def test_create_route(app):
     with app.test_request_context(), app.test_client() as test_client:
@@ -10,6 +15,22 @@ def test_create_route(app):
     assert response.status_code == HTTPStatus.OK
 
 
+def test_client_encryption_pages(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        pages = [
+            test_client.get(url_for("web.create")),
+            test_client.get(url_for("web.read", external_id="external-id"))
+        ]
+        with patch.dict(app.config, {"SHHH_CLIENT_ENCRYPTION": True}):
+            client_pages = [
+                test_client.get(url_for("web.create")),
+                test_client.get(url_for("web.read", external_id="external-id"))
+            ]
+    assert all(b"data-client-action" not in page.data for page in pages)
+    assert all(b"data-client-action" in page.data for page in client_pages)
+    assert b'data-iterations="600000"' in client_pages[0].data
+
+
 def test_robots_dot_txt_route(app):
     with app.test_request_context(), app.test_client() as test_client:
         response = test_client.get(url_for("web.robots_dot_txt"))
@@ -34,6 +55,16 @@ def test_read_route(app):
     assert response.status_code == HTTPStatus.OK
 
 
+def test_read_file_route(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(
+            url_for("web.read_file", external_id="fK6YTEVO2bvOln7pHOFi"))
+        action = url_for("api.file")
+    assert response.status_code == HTTPStatus.OK
+    assert f'action="{action}"' in response.text
+    assert "data-file" in response.text
+
+
 def test_created_route(app):
     with app.test_request_context(), app.test_client() as test_client:
         response = test_client.get(
@@ -70,3 +101,74 @@ def test_hsts_header_on_secure_request(app):
     assert response.status_code == HTTPStatus.OK
     assert response.headers.get("Strict-Transport-Security") == \
         "max-age=63072000; includeSubDomains"
+
+
+def test_static_assets_are_immutable(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        asset_url = assets["create"].urls()[0]
+        response = test_client.get(asset_url)
+        response.close()
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["Cache-Control"] == (
+        "public, max-age=31536000, immutable")
+
+
+def test_static_vendor_assets_are_not_immutable(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("static", filename="img/logo.png"))
+        response.close()
+    assert "immutable" not in response.headers.get("Cache-Control", "")
+
+
+def test_read_page_does_not_depend_on_the_secret(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        first = test_client.get(url_for("web.read", external_id="abc"))
+        second = test_client.get(url_for("web.read", external_id="def"))
+    assert first.get_data() == second.get_data()
+    assert first.headers["ETag"] == second.headers["ETag"]
+
+
+def test_page_not_modified(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("web.create"))
+        etag = response.headers["ETag"]
+        response = test_client.get(url_for("web.create"),
+                                   headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == etag
+    assert not response.get_data()
+
+
+def test_compressed_page_not_modified(app):
+    headers = {"Accept-Encoding": "gzip"}
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("web.create"), headers=headers)
+        etag = response.headers["ETag"]
+        response = test_client.get(url_for("web.create"),
+                                   headers={
+                                       **headers, "If-None-Match": etag
+                                   })
+    assert etag.endswith('-gzip"')
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["ETag"] == etag
+
+
+def test_csp_allows_inline_script_hash(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        response = test_client.get(url_for("web.create"))
+    script = re.search(r"<script>(.+?)</script>", response.text).group(1)
+    digest = base64.b64encode(hashlib.sha256(script.encode()).digest())
+    csp = response.headers["Content-Security-Policy"]
+    assert f"script-src 'self' 'sha256-{digest.decode()}';" in csp
+    assert "nonce-" not in csp
+
+
+def test_csp_nonce_mode(app):
+    with app.test_request_context(), app.test_client() as test_client:
+        with patch.dict(app.config, {"SHHH_CSP_MODE": "nonce"}):
+            first = test_client.get(url_for("web.read", external_id="abc"))
+            second = test_client.get(url_for("web.read", external_id="abc"))
+    nonce = re.search(r'<script nonce="(.+?)">', first.text).group(1)
+    assert f"'nonce-{nonce}'" in first.headers["Content-Security-Policy"]
+    assert first.get_data() != second.get_data()
+    assert "ETag" not in first.headers